@@ -0,0 +1,352 @@
+"""
+Population analytics kept as per-day rollups, so the /analytics endpoints
+read a few small tables instead of scanning sessions or chat_messages.
+
+The conversation engine reports what each committed turn changed: stages
+entered, newly extracted symptoms, tests, findings and treatments (the
+cohort index terms), and messages processed. Counts accumulate in this
+process and a background thread adds them to analytics_counters every
+ANALYTICS_FLUSH_INTERVAL seconds. Distinct users (active users, users
+reaching each stage) are HyperLogLog sketches merged into
+analytics_sketches, so they can be combined across days and workers.
+
+Counts are recorded once the turn's transaction commits (or its
+write-behind record is journaled); a crash loses at most the last
+unflushed interval. The endpoints read only flushed counts, so they lag
+turns by up to ANALYTICS_FLUSH_INTERVAL. Deleted sessions are not subtracted.
+"""
+import os
+import math
+import hashlib
+import logging
+import threading
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import event, func, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app.models import AnalyticsCounter, AnalyticsSketch
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_FLUSH_INTERVAL = float(os.getenv("ANALYTICS_FLUSH_INTERVAL", "5"))
+
+# Conversation stages in order; the funnel counts sessions entering each one
+FUNNEL_STAGES = ("initial", "demographics", "symptoms", "diagnostic_tests", "treatments", "lifestyle", "analysis")
+
+STAGE = "stage"
+STAGE_USERS = "stage_users"
+ACTIVE_USERS = "active_users"
+MESSAGES = "messages"
+
+# Session.info key holding turn events to record once the transaction commits
+PENDING_KEY = "analytics_pending"
+
+HLL_PRECISION = 12
+
+
+class HyperLogLog:
+    """HyperLogLog sketch of 2^precision one-byte registers (about 1.6% standard error at 12)."""
+    def __init__(self, registers: Optional[bytes] = None, precision: int = HLL_PRECISION):
+        self.precision = precision
+        size = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(size)
+        if len(self.registers) != size:
+            raise ValueError(f"Expected {size} registers, got {len(self.registers)}")
+
+    def add(self, value: str) -> None:
+        h = int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+        width = 64 - self.precision
+        index, rest = h >> width, h & ((1 << width) - 1)
+        rank = width - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> None:
+        merged = np.maximum(np.frombuffer(self.registers, dtype=np.uint8), np.frombuffer(other.registers, dtype=np.uint8))
+        self.registers = bytearray(merged.tobytes())
+
+    def estimate(self) -> int:
+        registers = np.frombuffer(self.registers, dtype=np.uint8)
+        m = len(registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / float(np.sum(np.ldexp(1.0, -registers.astype(np.int32))))
+        zeros = int(np.count_nonzero(registers == 0))
+        if raw <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            return int(round(m * math.log(m / zeros)))
+        return int(round(raw))
+
+
+def stages_entered(previous: str, stage: str) -> List[str]:
+    """Stages a session entered moving from `previous` to `stage`, counting any it skipped in the funnel."""
+    if stage == previous:
+        return []
+    if previous in FUNNEL_STAGES and stage in FUNNEL_STAGES:
+        return list(FUNNEL_STAGES[FUNNEL_STAGES.index(previous) + 1:FUNNEL_STAGES.index(stage) + 1])
+    return [stage]
+
+
+class TurnEvents:
+    """What one committed batch of turns added to a session."""
+    __slots__ = ("email", "messages", "stages", "terms")
+
+    def __init__(self, email: str, messages: int, stages: List[str], terms: Set[str]):
+        self.email = email
+        self.messages = messages
+        self.stages = stages
+        self.terms = terms
+
+
+class Rollup:
+    """Counts and sketches of this process not yet added to the rollup tables."""
+    def __init__(self):
+        self._counts: Counter = Counter()
+        self._sketches: Dict[Tuple[date, str, str], HyperLogLog] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def record(self, events: TurnEvents, day: Optional[date] = None) -> None:
+        day = day or datetime.utcnow().date()
+        with self._lock:
+            counts, sketches = self._counts, self._sketches
+            counts[(day, MESSAGES, "")] += events.messages
+            for stage in events.stages:
+                counts[(day, STAGE, stage)] += 1
+            for term in events.terms:
+                metric, _, key = term.partition(":")
+                counts[(day, metric, key)] += 1
+            if events.email:
+                for metric, key in [(ACTIVE_USERS, "")] + [(STAGE_USERS, stage) for stage in events.stages]:
+                    sketch = sketches.get((day, metric, key))
+                    if sketch is None:
+                        sketch = sketches[(day, metric, key)] = HyperLogLog()
+                    sketch.add(events.email)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._counts) + len(self._sketches)
+
+    def flush(self, session_factory: Callable[[], Session]) -> int:
+        """Add the accumulated counts and sketches to the rollup tables; returns the rows written."""
+        with self._flush_lock:
+            with self._lock:
+                counts, self._counts = self._counts, Counter()
+                sketches, self._sketches = self._sketches, {}
+            if not counts and not sketches:
+                return 0
+            db = session_factory()
+            try:
+                _apply(db, counts, sketches)
+                db.commit()
+            except Exception:
+                db.rollback()
+                # Keep them for the next attempt
+                with self._lock:
+                    self._counts.update(counts)
+                    for key, sketch in sketches.items():
+                        if key in self._sketches:
+                            self._sketches[key].merge(sketch)
+                        else:
+                            self._sketches[key] = sketch
+                raise
+            finally:
+                db.close()
+            return len(counts) + len(sketches)
+
+
+def _insert(db: Session, table):
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql_insert(table)
+    if dialect == "sqlite":
+        return sqlite_insert(table)
+    raise NotImplementedError(f"Analytics rollups are not supported on {dialect}")
+
+
+def _apply(db: Session, counts: Counter, sketches: Dict[Tuple[date, str, str], HyperLogLog]) -> None:
+    if counts:
+        statement = _insert(db, AnalyticsCounter.__table__)
+        db.execute(
+            statement.on_conflict_do_update(
+                index_elements=["day", "metric", "key"],
+                set_={"count": AnalyticsCounter.__table__.c.count + statement.excluded.count}
+            ),
+            [{"day": day, "metric": metric, "key": key, "count": count}
+             for (day, metric, key), count in counts.items()]
+        )
+    if sketches:
+        # Registers merge by maximum, which SQL cannot express portably: create
+        # missing rows, then lock and merge the existing ones
+        empty = bytes(1 << HLL_PRECISION)
+        db.execute(
+            _insert(db, AnalyticsSketch.__table__).on_conflict_do_nothing(index_elements=["day", "metric", "key"]),
+            [{"day": day, "metric": metric, "key": key, "registers": empty} for day, metric, key in sketches]
+        )
+        days = {day for day, _, _ in sketches}
+        rows = db.execute(
+            select(AnalyticsSketch).where(AnalyticsSketch.day.in_(days)).with_for_update()
+        ).scalars()
+        for row in rows:
+            sketch = sketches.get((row.day, row.metric, row.key))
+            if sketch is not None:
+                sketch.merge(HyperLogLog(row.registers))
+                row.registers = bytes(sketch.registers)
+
+
+rollup = Rollup()
+
+
+def record_after_commit(db: Session, events: TurnEvents) -> None:
+    """Record a turn's events once `db`'s current transaction commits."""
+    db.info.setdefault(PENDING_KEY, []).append(events)
+
+
+def record(events: TurnEvents) -> None:
+    rollup.record(events)
+
+
+@event.listens_for(Session, "after_commit")
+def _record_committed(db: Session) -> None:
+    for events in db.info.pop(PENDING_KEY, ()):
+        rollup.record(events)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_rolled_back(db: Session) -> None:
+    db.info.pop(PENDING_KEY, None)
+
+
+class AnalyticsFlusher:
+    """Background thread flushing the rollup every ANALYTICS_FLUSH_INTERVAL seconds."""
+    def __init__(self, session_factory: Callable, interval: float = ANALYTICS_FLUSH_INTERVAL):
+        self.session_factory = session_factory
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="analytics", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        try:
+            rollup.flush(self.session_factory)
+        except Exception as e:
+            logger.error(f"Analytics flush failed: {str(e)}")
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                rollup.flush(self.session_factory)
+            except Exception as e:
+                logger.error(f"Analytics flush failed, retrying: {str(e)}")
+
+
+flusher: Optional[AnalyticsFlusher] = None
+
+
+def start(session_factory: Callable) -> AnalyticsFlusher:
+    """Start the process-wide analytics flusher."""
+    global flusher
+    flusher = AnalyticsFlusher(session_factory)
+    flusher.start()
+    return flusher
+
+
+def stop() -> None:
+    global flusher
+    if flusher is not None:
+        flusher.stop()
+        flusher = None
+
+
+# Queries
+
+def date_range(start: Optional[date], end: Optional[date], days: int = 30) -> Tuple[date, date]:
+    """`start` and `end` (inclusive), defaulting to the `days` days up to today."""
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=days - 1)
+    if start > end:
+        raise ValueError("start must not be after end")
+    return start, end
+
+
+def counts(db: Session, metric: str, start: date, end: date) -> List[Dict[str, Any]]:
+    """Keys of `metric` by total count over the range, highest first."""
+    total = func.sum(AnalyticsCounter.count)
+    rows = db.execute(
+        select(AnalyticsCounter.key, total)
+        .where(AnalyticsCounter.metric == metric, AnalyticsCounter.day.between(start, end))
+        .group_by(AnalyticsCounter.key)
+        .order_by(total.desc(), AnalyticsCounter.key)
+    )
+    return [{"name": key, "count": int(count)} for key, count in rows]
+
+
+def _sketches(db: Session, metric: str, start: date, end: date) -> Iterable[AnalyticsSketch]:
+    return db.execute(
+        select(AnalyticsSketch)
+        .where(AnalyticsSketch.metric == metric, AnalyticsSketch.day.between(start, end))
+    ).scalars()
+
+
+def distinct_users(db: Session, metric: str, start: date, end: date) -> Dict[str, int]:
+    """Estimated distinct users of each key of a sketch metric over the whole range."""
+    merged: Dict[str, HyperLogLog] = {}
+    for row in _sketches(db, metric, start, end):
+        if row.key in merged:
+            merged[row.key].merge(HyperLogLog(row.registers))
+        else:
+            merged[row.key] = HyperLogLog(row.registers)
+    return {key: sketch.estimate() for key, sketch in merged.items()}
+
+
+def funnel(db: Session, start: date, end: date) -> List[Dict[str, Any]]:
+    """Sessions and distinct users entering each stage, with the share of the previous stage's sessions."""
+    sessions = {row["name"]: row["count"] for row in counts(db, STAGE, start, end)}
+    users = distinct_users(db, STAGE_USERS, start, end)
+    result = []
+    previous = None
+    for stage in FUNNEL_STAGES:
+        entered = sessions.get(stage, 0)
+        result.append({
+            "stage": stage,
+            "sessions": entered,
+            "users": users.get(stage, 0),
+            "conversion": round(entered / previous, 4) if previous else None,
+        })
+        previous = entered
+    return result
+
+
+def active_users(db: Session, start: date, end: date) -> Dict[str, Any]:
+    """Estimated distinct active users per day and over the range, with messages per day."""
+    merged = HyperLogLog()
+    daily: Dict[date, Dict[str, Any]] = {}
+    for row in _sketches(db, ACTIVE_USERS, start, end):
+        sketch = HyperLogLog(row.registers)
+        merged.merge(sketch)
+        daily.setdefault(row.day, {"day": row.day, "active_users": 0, "messages": 0})["active_users"] = sketch.estimate()
+    for day, count in db.execute(
+        select(AnalyticsCounter.day, AnalyticsCounter.count)
+        .where(AnalyticsCounter.metric == MESSAGES, AnalyticsCounter.day.between(start, end))
+    ):
+        daily.setdefault(day, {"day": day, "active_users": 0, "messages": 0})["messages"] = int(count)
+    return {
+        "active_users": merged.estimate(),
+        "daily": [daily[day] for day in sorted(daily)],
+    }
@@ -1,24 +1,36 @@
 import os
-from fastapi import FastAPI, Depends, HTTPException, Header, Request, Body
+from fastapi import FastAPI, Depends, HTTPException, Header, Request, Body, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from typing import List, Dict, Optional, Union, Any
 import uuid
-from datetime import timedelta, datetime
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta, datetime
 from pydantic import BaseModel, ValidationError, EmailStr
 import logging
 from dotenv import load_dotenv
-from .ms_health_ai import MSHealthAI, MSHealthAIError, InvalidStateError, ParsingError
-from sqlalchemy.orm import Session
+from .ms_health_ai import MSHealthAI, MSHealthAIError, ConcurrentUpdateError, InvalidStateError, ParsingError
+from .profiling import ProfilingMiddleware, PROFILING_ENABLED
+from . import analytics, chat_search, cluster, cohort_index, idempotency, metrics, partitions, pattern_scoring, reports, response_store, retention, session_state, state_store, timeline, write_behind
+from .idempotency import IdempotencyConflictError
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, defer
 from fastapi.openapi.utils import get_openapi
 
-from .database import get_db, engine, init_db
+from .database import get_db, get_read_db, get_session_read_db, get_user_read_db, engine, init_db, SessionLocal, recent_writes
 from .models import Base, User, Session as DBSession, ChatMessage
+from .vocabulary import SYMPTOM_KEYWORDS
 from .schemas import (
     EmailRequest,
     SessionResponse,
     ChatMessageRequest,
     ChatMessageResponse,
+    ChatBatchRequest,
+    ChatBatchResponse,
+    ChatBatchResult,
+    ForgetSessionsRequest,
     SessionTitleUpdate
 )
 
@@ -33,6 +45,16 @@ logger = logging.getLogger(__name__)
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
 API_VERSION = os.getenv("API_VERSION", "1.0.0")
 DEBUG_MODE = os.getenv("DEBUG_MODE", "False").lower() == "true"
+CHAT_BATCH_MAX_ITEMS = int(os.getenv("CHAT_BATCH_MAX_ITEMS", "500"))
+# Sessions processed in parallel by /chat/batch; each holds a pooled connection
+CHAT_BATCH_WORKERS = int(os.getenv("CHAT_BATCH_WORKERS", "4"))
+# Sessions fetched and scored per matrix product by /cohort/patterns
+COHORT_CHUNK_SIZE = int(os.getenv("COHORT_CHUNK_SIZE", "5000"))
+COHORT_SEARCH_MAX_LIMIT = int(os.getenv("COHORT_SEARCH_MAX_LIMIT", "1000"))
+# Default and longest date range of /user/{email}/timeline
+TIMELINE_DEFAULT_DAYS = int(os.getenv("TIMELINE_DEFAULT_DAYS", "90"))
+TIMELINE_MAX_DAYS = int(os.getenv("TIMELINE_MAX_DAYS", "3660"))
+CHAT_SEARCH_MAX_LIMIT = int(os.getenv("CHAT_SEARCH_MAX_LIMIT", "100"))
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
@@ -40,6 +62,9 @@ Base.metadata.create_all(bind=engine)
 # Initialize database
 init_db()
 
+# Shared by all /chat/batch requests so concurrent batches cannot exhaust the pool
+chat_batch_executor = ThreadPoolExecutor(max_workers=CHAT_BATCH_WORKERS, thread_name_prefix="chat-batch")
+
 # Initialize MSHealthAI with database session
 def get_ms_health_ai(db: Session = Depends(get_db)) -> MSHealthAI:
     return MSHealthAI(db)
@@ -60,6 +85,50 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request profiling middleware (opt-in, see app/profiling.py)
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
+@app.on_event("startup")
+def start_write_behind():
+    # Replays any journal left by a crash before requests are served
+    if write_behind.CHAT_WRITE_BEHIND:
+        write_behind.start(SessionLocal)
+
+@app.on_event("startup")
+def start_cohort_index():
+    # After the write-behind replay, so replayed turns are indexed from the database
+    cohort_index.start(SessionLocal)
+
+@app.on_event("startup")
+def start_analytics():
+    analytics.start(SessionLocal)
+
+@app.on_event("startup")
+def start_partition_maintenance():
+    # Monthly chat_messages partitions must exist before messages are inserted;
+    # in cluster mode only worker 0 runs database maintenance
+    if partitions.partitioning_enabled(engine) and cluster.CLUSTER_WORKER_INDEX == 0:
+        partitions.start(engine)
+
+@app.on_event("startup")
+def start_chat_search():
+    # On SQLite the FTS table and its triggers must exist before messages are inserted
+    if engine.dialect.name == "sqlite" or cluster.CLUSTER_WORKER_INDEX == 0:
+        chat_search.ensure(engine)
+
+@app.on_event("startup")
+def start_retention():
+    if retention.SESSION_RETENTION_DAYS > 0 and cluster.CLUSTER_WORKER_INDEX == 0:
+        retention.start(SessionLocal)
+
+@app.on_event("shutdown")
+def stop_background_workers():
+    retention.stop()
+    partitions.stop()
+    write_behind.stop()
+    analytics.stop()
+
 # Global exception handlers
 @app.exception_handler(MSHealthAIError)
 async def ms_health_ai_exception_handler(request: Request, exc: MSHealthAIError):
@@ -113,6 +182,7 @@ def create_session(request: EmailRequest, db: Session = Depends(get_db)):
     db.add(session)
     db.commit()
     db.refresh(session)
+    recent_writes.mark(session_id=str(session.id), email=request.email)
     
     # Convert session to response model
     return SessionResponse(
@@ -130,8 +200,17 @@ def chat(request: ChatMessageRequest, db: Session = Depends(get_db)):
     Handle chat messages. Can be used in two ways:
     1. Start a new chat (no session_id provided) - creates new session
     2. Continue existing chat (session_id provided) - uses existing session
+    A request carrying an idempotency_key that was already processed returns
+    the stored response without processing the message again.
     """
+    fingerprint = None
     try:
+        if request.idempotency_key:
+            fingerprint = idempotency.request_hash(request.session_id, request.message)
+            stored = idempotency.lookup(db, request.email, request.idempotency_key, fingerprint)
+            if stored is not None:
+                return ChatMessageResponse(**stored)
+
         # Check if user exists, if not create
         user = db.query(User).filter(User.email == request.email).first()
         if not user:
@@ -143,7 +222,7 @@ def chat(request: ChatMessageRequest, db: Session = Depends(get_db)):
         # Get or create session
         if request.session_id:
             # Use existing session if provided
-            session = db.query(DBSession).filter(DBSession.id == request.session_id).first()
+            session = db.query(DBSession).options(defer(DBSession.ai_state)).filter(DBSession.id == request.session_id).first()
             if not session:
                 raise HTTPException(status_code=404, detail="Session not found")
             if session.email != request.email:
@@ -160,49 +239,220 @@ def chat(request: ChatMessageRequest, db: Session = Depends(get_db)):
             db.add(session)
             db.commit()
             db.refresh(session)
-            request.session_id = str(session.id)
 
-        # Process message with AI
+        # Process message with AI; the session update is persisted with the chat log below
+        session_id = str(session.id)
+        queue = write_behind.queue
+        timestamp = datetime.utcnow()
+
+        def respond(turn):
+            """The response to return, and its idempotency record when a key was given"""
+            result = ChatMessageResponse(
+                response=turn.response,
+                session_id=session_id,
+                analysis_complete=turn.analysis_complete,
+                message=request.message,
+                timestamp=timestamp
+            )
+            entry = None
+            if request.idempotency_key:
+                entry = idempotency.new_entry(fingerprint, result.model_dump(mode="json"))
+            return result, entry
+
+        def journal(state, version, turns, observations, report):
+            # Durable in the local journal; written to the database by the write-behind thread
+            turn = turns[0]
+            _, entry = respond(turn)
+            queue.enqueue(
+                session_id, request.email, state,
+                turn.stage, turn.analysis_complete,
+                [{"message": request.message, "response": turn.response, "stage": turn.stage, "timestamp": timestamp}],
+                idempotency=idempotency.journal_record(
+                    request.email, request.idempotency_key, session_id, entry
+                ) if entry is not None else None,
+                last_updated=timestamp,
+                version=version,
+                observations=observations,
+                report=report
+            )
+            state_store.publish(session_id, version, state)
+
         ms_health_ai = get_ms_health_ai(db)
-        response = ms_health_ai.process_message(
-            session_id=str(session.id),
-            message=request.message,
-            email=request.email
-        )
-        
-        # Get current state
-        state = ms_health_ai.get_session_state(str(session.id))
-        if not state:
-            raise HTTPException(status_code=404, detail="Session not found")
-            
+        turn = ms_health_ai.process_messages(
+            session_id=session_id,
+            messages=[request.message],
+            email=request.email,
+            commit=False,
+            journal=journal if queue is not None else None
+        )[0]
+        result, stored_entry = respond(turn)
+
         # Store message and response
-        chat_message = ChatMessage(
-            session_id=session.id,
-            message=request.message,
-            response=response,
-            stage=state.get("stage", "initial")
-        )
-        db.add(chat_message)
-        
-        # Update session state
-        session.stage = state.get("stage", "initial")
-        session.analysis_complete = state.get("analysis_complete", False)
-        session.ai_state = state
-        session.last_updated = datetime.utcnow()
-        db.commit()
+        if queue is not None:
+            db.rollback()
+        else:
+            db.add(ChatMessage(
+                session_id=session.id, message=request.message,
+                response_hash=response_store.store(db, [turn.response])[0],
+                stage=turn.stage, timestamp=timestamp
+            ))
+            if stored_entry is not None:
+                idempotency.record(db, request.email, request.idempotency_key, session_id, stored_entry)
+            db.commit()
+        if stored_entry is not None:
+            idempotency.remember(request.email, request.idempotency_key, stored_entry)
+        recent_writes.mark(session_id=session_id, email=request.email)
         
-        return ChatMessageResponse(
-            response=response,
-            session_id=str(session.id),
-            analysis_complete=session.analysis_complete,
-            message=request.message,
-            timestamp=chat_message.timestamp
-        )
+        return result
+    except IdempotencyConflictError as e:
+        db.rollback()
+        raise HTTPException(status_code=422, detail=str(e))
+    except ConcurrentUpdateError as e:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=str(e))
+    except write_behind.QueueFullError as e:
+        db.rollback()
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except IntegrityError as e:
+        db.rollback()
+        # A concurrent request with the same idempotency key committed first; replay its response
+        if request.idempotency_key:
+            try:
+                stored = idempotency.lookup(db, request.email, request.idempotency_key, fingerprint)
+            except IdempotencyConflictError as conflict:
+                raise HTTPException(status_code=422, detail=str(conflict))
+            if stored is not None:
+                return ChatMessageResponse(**stored)
+        logger.error(f"Error in chat endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"AI Error: {str(e)}")
     except Exception as e:
         db.rollback()
         logger.error(f"Error in chat endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"AI Error: {str(e)}")
 
+def process_session_batch(session_id: str, email: str, messages: List[str]) -> List[ChatBatchResult]:
+    """
+    Process one session's batch messages in order on a dedicated database session.
+    The session state and all chat messages are written in a single commit
+    (or a single write-behind record).
+    """
+    db = SessionLocal()
+    try:
+        queue = write_behind.queue
+        # Explicit, strictly increasing timestamps keep the batch in order in the chat log
+        started = datetime.utcnow()
+        timestamps = [started + timedelta(microseconds=i) for i in range(len(messages))]
+
+        def chat_rows(turns):
+            return [
+                {"message": message, "response": turn.response, "stage": turn.stage, "timestamp": timestamp}
+                for message, turn, timestamp in zip(messages, turns, timestamps)
+            ]
+
+        def journal(state, version, turns, observations, report):
+            last = turns[-1]
+            queue.enqueue(session_id, email, state, last.stage, last.analysis_complete, chat_rows(turns),
+                          last_updated=started, version=version, observations=observations, report=report)
+            state_store.publish(session_id, version, state)
+
+        ms_health_ai = MSHealthAI(db)
+        turns = ms_health_ai.process_messages(
+            session_id, messages, email, commit=False, journal=journal if queue is not None else None
+        )
+        if queue is not None:
+            db.rollback()
+        else:
+            db.add_all([
+                ChatMessage(session_id=session_id, **row) for row in response_store.reference(db, chat_rows(turns))
+            ])
+            db.commit()
+        return [
+            ChatBatchResult(
+                session_id=session_id,
+                message=message,
+                response=turn.response,
+                analysis_complete=turn.analysis_complete,
+                timestamp=timestamp
+            )
+            for message, turn, timestamp in zip(messages, turns, timestamps)
+        ]
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error in chat batch for session {session_id}: {str(e)}")
+        return [
+            ChatBatchResult(session_id=session_id, message=message, error=f"AI Error: {str(e)}")
+            for message in messages
+        ]
+    finally:
+        db.close()
+
+@app.post("/chat/batch", response_model=ChatBatchResponse)
+def chat_batch(request: ChatBatchRequest, db: Session = Depends(get_db)):
+    """
+    Handle an ordered list of (session_id, message) items in one request.
+    Messages for the same session are processed in order; different sessions
+    are processed in parallel and each is committed once. A failing session
+    reports an error on its own items without affecting the others.
+    """
+    if len(request.items) > CHAT_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch exceeds the maximum of {CHAT_BATCH_MAX_ITEMS} items"
+        )
+
+    # Group item positions by session, keeping request order within each session
+    groups: Dict[str, List[int]] = {}
+    for index, item in enumerate(request.items):
+        try:
+            session_id = str(uuid.UUID(item.session_id))
+        except ValueError:
+            session_id = item.session_id
+        groups.setdefault(session_id, []).append(index)
+
+    results: List[Optional[ChatBatchResult]] = [None] * len(request.items)
+
+    def fail(session_id: str, error: str) -> None:
+        for index in groups.pop(session_id):
+            results[index] = ChatBatchResult(
+                session_id=session_id, message=request.items[index].message, error=error
+            )
+
+    # Check every session with one query
+    for session_id in list(groups):
+        try:
+            uuid.UUID(session_id)
+        except ValueError:
+            fail(session_id, "Session not found")
+    owners = {
+        str(session_id): email
+        for session_id, email in db.query(DBSession.id, DBSession.email)
+        .filter(DBSession.id.in_(list(groups)))
+        .all()
+    } if groups else {}
+    for session_id in list(groups):
+        if session_id not in owners:
+            fail(session_id, "Session not found")
+        elif owners[session_id] != request.email:
+            fail(session_id, "Email mismatch for session")
+    # Return the request's connection to the pool before the workers check theirs out
+    db.close()
+
+    futures = [
+        (indexes, chat_batch_executor.submit(
+            contextvars.copy_context().run, process_session_batch, session_id, request.email,
+            [request.items[index].message for index in indexes]
+        ))
+        for session_id, indexes in groups.items()
+    ]
+    for indexes, future in futures:
+        for index, result in zip(indexes, future.result()):
+            results[index] = result
+    for session_id in groups:
+        recent_writes.mark(session_id=session_id)
+    recent_writes.mark(email=request.email)
+
+    return ChatBatchResponse(results=results)
+
 def generate_session_title(message: str) -> str:
     """
     Generate a meaningful title for the session based on the first message.
@@ -239,37 +489,90 @@ def generate_session_title(message: str) -> str:
     return title
 
 @app.get("/session/{session_id}/chats", response_model=List[ChatMessageResponse])
-def get_session_chats(session_id: str, db: Session = Depends(get_db)):
-    session = db.query(DBSession).filter(DBSession.id == session_id).first()
+def get_session_chats(session_id: str, db: Session = Depends(get_session_read_db)):
+    session = db.query(DBSession).options(defer(DBSession.ai_state)).filter(DBSession.id == session_id).first()
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
+    # Read unflushed write-behind messages first: a concurrent flush moves them to the table
+    pending = write_behind.pending_messages(session_id)
     messages = db.query(ChatMessage).filter(ChatMessage.session_id == session_id).order_by(ChatMessage.timestamp).all()
-    return [
+    responses = []
+    if partitions.CHAT_ARCHIVE_AFTER_MONTHS > 0 and partitions.partitioning_enabled(engine):
+        # Messages from archived partitions are older than any still in the table
+        responses += [
+            ChatMessageResponse(
+                response=msg["response"],
+                session_id=str(session_id),
+                analysis_complete=session.analysis_complete,
+                message=msg["message"],
+                timestamp=msg["timestamp"]
+            )
+            for msg in partitions.read_archived_messages(db, session_id)
+        ]
+    responses += [
         ChatMessageResponse(
-            response=msg.response,
+            response=response,
             session_id=str(session_id),
             analysis_complete=session.analysis_complete,
             message=msg.message,
             timestamp=msg.timestamp
         )
-        for msg in messages
+        for msg, response in zip(messages, response_store.resolve(db, messages))
     ]
+    if pending:
+        stored_ids = {str(msg.id) for msg in messages}
+        state = write_behind.pending_state(session_id) or {}
+        responses += [
+            ChatMessageResponse(
+                response=msg["response"],
+                session_id=str(session_id),
+                analysis_complete=state.get("analysis_complete", session.analysis_complete),
+                message=msg["message"],
+                timestamp=msg["timestamp"]
+            )
+            for msg in pending if msg["id"] not in stored_ids
+        ]
+    return responses
 
-@app.post("/generate_report/{session_id}")
-def generate_report(session_id: str, db: Session = Depends(get_db)):
-    session = db.query(DBSession).filter(DBSession.id == session_id).first()
-    if not session:
+@app.api_route("/generate_report/{session_id}", methods=["GET", "POST"])
+def generate_report(session_id: str, request: Request,
+                    if_none_match: Optional[str] = Header(None),
+                    accept_encoding: Optional[str] = Header(None),
+                    db: Session = Depends(get_session_read_db)):
+    """
+    A completed session's analysis and recommendations. A GET whose
+    If-None-Match carries the report's ETag gets 304 without a body; the
+    body is sent brotli- or gzip-compressed when the client accepts it.
+    """
+    etag = reports.stored_etag(db, session_id)
+    report = None
+    if etag is None:
+        # Not materialized: completed before reports were stored, or the completing turn is still journaled
+        session = db.query(DBSession).options(defer(DBSession.ai_state)).filter(DBSession.id == session_id).first()
+        if not session:
+            raise HTTPException(status_code=404, detail="Session not found")
+
+        # The state may be ahead of the session row while write-behind turns are pending
+        state = get_ms_health_ai(db).get_session_state(session_id) or {}
+        if not (session.analysis_complete or state.get("analysis_complete")):
+            raise HTTPException(status_code=400, detail="Analysis not complete")
+        report = reports.build(session_id, state)
+        etag = report.etag
+
+    headers = {"Vary": "Accept-Encoding", "Cache-Control": "private, no-cache"}
+    if request.method == "GET" and reports.etag_matches(if_none_match, etag):
+        headers["ETag"] = reports.representation_etag(etag, reports.negotiate(accept_encoding))
+        return Response(status_code=304, headers=headers)
+
+    report = report or reports.load(db, session_id, etag)
+    if report is None:
         raise HTTPException(status_code=404, detail="Session not found")
-    
-    if not session.analysis_complete:
-        raise HTTPException(status_code=400, detail="Analysis not complete")
-    
-    return {
-        "session_id": session_id,
-        "analysis": get_ms_health_ai(db).get_session_state(session_id)["analysis"],
-        "recommendations": get_ms_health_ai(db).get_session_state(session_id)["recommendations"]
-    }
+    encoding = reports.negotiate(accept_encoding, [e for e in reports.ENCODINGS if e in report.bodies])
+    headers["ETag"] = reports.representation_etag(report.etag, encoding)
+    if encoding != reports.IDENTITY:
+        headers["Content-Encoding"] = encoding
+    return Response(report.bodies[encoding], media_type="application/json", headers=headers)
 
 @app.delete("/session/{session_id}")
 def delete_session(session_id: str, db: Session = Depends(get_db)):
@@ -277,24 +580,64 @@ def delete_session(session_id: str, db: Session = Depends(get_db)):
     Delete a session and all its associated chat messages.
     This will permanently remove the session and all its data from the database.
     """
-    session = db.query(DBSession).filter(DBSession.id == session_id).first()
+    session = db.query(DBSession).options(defer(DBSession.ai_state)).filter(DBSession.id == session_id).first()
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
+    # Read before the delete: the committed session can no longer be refreshed
+    email = session.email
     try:
-        ms_health_ai = get_ms_health_ai(db)
-        ms_health_ai.clear_session(session_id)
+        retention.delete_sessions(db, [session.id])
+        db.commit()
+        retention.forget_sessions([session_id])
+        recent_writes.mark(session_id=session_id, email=email)
         return {"message": "Session and all associated messages deleted successfully"}
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to delete session: {str(e)}")
 
+@app.delete("/user/{email}/sessions")
+def delete_user_sessions(email: str, db: Session = Depends(get_db)):
+    """
+    Delete all sessions of a user, with their chat messages.
+    """
+    user = db.query(User).filter(User.email == email).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    try:
+        session_ids = retention.delete_user_sessions(db, email)
+        db.commit()
+        retention.forget_sessions(session_ids)
+        recent_writes.mark(email=email)
+        return {"message": "All sessions deleted successfully", "deleted": len(session_ids)}
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Failed to delete sessions: {str(e)}")
+
+@app.post(cluster.FORGET_PATH, include_in_schema=False)
+def forget_deleted_sessions(request: ForgetSessionsRequest, db: Session = Depends(get_db)):
+    """
+    Drop this worker's copies of sessions another cluster worker deleted.
+    Sessions that still exist are kept, so the call cannot hide live ones.
+    """
+    session_ids = set()
+    for session_id in request.session_ids:
+        try:
+            session_ids.add(uuid.UUID(session_id))
+        except ValueError:
+            raise HTTPException(status_code=422, detail=f"Invalid session id: {session_id}")
+    existing = {row.id for row in db.query(DBSession.id).filter(DBSession.id.in_(session_ids))} if session_ids else set()
+    deleted = session_ids - existing
+    retention.forget_sessions(deleted, peers=False)
+    return {"forgotten": len(deleted)}
+
 @app.patch("/session/{session_id}/title", response_model=SessionResponse)
 def update_session_title(session_id: str, title_update: SessionTitleUpdate, db: Session = Depends(get_db)):
     """
     Update the title of a session.
     """
-    session = db.query(DBSession).filter(DBSession.id == session_id).first()
+    session = db.query(DBSession).options(defer(DBSession.ai_state)).filter(DBSession.id == session_id).first()
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
@@ -303,6 +646,7 @@ def update_session_title(session_id: str, title_update: SessionTitleUpdate, db:
         session.last_updated = datetime.utcnow()
         db.commit()
         db.refresh(session)
+        recent_writes.mark(session_id=session_id, email=session.email)
         
         return SessionResponse(
             session_id=session.id,
@@ -317,7 +661,7 @@ def update_session_title(session_id: str, title_update: SessionTitleUpdate, db:
         raise HTTPException(status_code=500, detail=f"Failed to update session title: {str(e)}")
 
 @app.get("/user/{email}/sessions", response_model=List[SessionResponse])
-def get_user_sessions(email: str, db: Session = Depends(get_db)):
+def get_user_sessions(email: str, db: Session = Depends(get_user_read_db)):
     """
     Get all sessions for a specific user by their email.
     Returns a list of sessions ordered by last_updated timestamp (most recent first).
@@ -328,7 +672,7 @@ def get_user_sessions(email: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="User not found")
     
     # Get all sessions for the user
-    sessions = db.query(DBSession).filter(DBSession.email == email).order_by(DBSession.last_updated.desc()).all()
+    sessions = db.query(DBSession).options(defer(DBSession.ai_state)).filter(DBSession.email == email).order_by(DBSession.last_updated.desc()).all()
     
     return [
         SessionResponse(
@@ -342,6 +686,188 @@ def get_user_sessions(email: str, db: Session = Depends(get_db)):
         for session in sessions
     ]
 
+@app.get("/user/{email}/timeline")
+def get_user_timeline(email: str, start: Optional[date] = None, end: Optional[date] = None,
+                      kind: Optional[str] = None, resolution: str = "auto",
+                      db: Session = Depends(get_user_read_db)):
+    """
+    Symptoms, tests, findings and treatments extracted from a user's sessions
+    between `start` and `end` (default: the last TIMELINE_DEFAULT_DAYS days),
+    optionally of one `kind`. `resolution` is raw (one point per observation),
+    day, week or month (counts per period), or auto: raw when the range has
+    at most TIMELINE_MAX_POINTS observations, else the finest period that
+    keeps the range within that many periods. At most TIMELINE_MAX_POINTS
+    points are returned, oldest first; `truncated` says whether there were more.
+    Turns still pending in the write-behind journal are not included.
+    """
+    if resolution != "auto" and resolution not in timeline.RESOLUTIONS:
+        raise HTTPException(status_code=422, detail=f"resolution must be auto or one of {', '.join(timeline.RESOLUTIONS)}")
+    try:
+        start, end = analytics.date_range(start, end, days=TIMELINE_DEFAULT_DAYS)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if (end - start).days >= TIMELINE_MAX_DAYS:
+        raise HTTPException(status_code=422, detail=f"Timeline ranges are limited to {TIMELINE_MAX_DAYS} days")
+    if resolution == "auto":
+        resolution = timeline.choose_resolution(db, email, start, end, kind)
+    points, truncated = timeline.query(db, email, start, end, resolution, kind)
+    return {
+        "email": email, "start": start, "end": end, "resolution": resolution,
+        "points": points, "truncated": truncated,
+    }
+
+@app.get("/user/{email}/search")
+def search_user_chats(email: str, q: str, limit: int = Query(20, ge=1, le=CHAT_SEARCH_MAX_LIMIT),
+                      offset: int = Query(0, ge=0), db: Session = Depends(get_user_read_db)):
+    """
+    Search a user's messages and responses. Words must all match unless
+    joined with OR; "quoted phrases" match in order and -word excludes.
+    Results are best match first, with the matching parts of the message and
+    response highlighted. `next_offset` is the offset of the next page, or
+    null on the last one. Turns still pending in the write-behind journal
+    are not included.
+    """
+    try:
+        results = chat_search.search(db, email, q, limit + 1, offset)
+    except chat_search.SearchQueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "query": q, "offset": offset, "limit": limit,
+        "results": results[:limit],
+        "next_offset": offset + limit if len(results) > limit else None,
+    }
+
+@app.get("/cohort/patterns")
+def cohort_patterns(db: Session = Depends(get_read_db)):
+    """
+    Similarity of every session's symptoms to the MS course patterns:
+    sessions scanned and scored, and per pattern the mean similarity and the
+    number of sessions it matches best. Only the symptoms of each state are
+    read, COHORT_CHUNK_SIZE sessions at a time; turns still pending in the
+    write-behind journal are not included.
+    """
+    rows = db.query(DBSession.ai_state["symptoms"]).yield_per(COHORT_CHUNK_SIZE)
+    return pattern_scoring.cohort_report(
+        (symptoms if isinstance(symptoms, dict) else {} for symptoms, in rows),
+        chunk_size=COHORT_CHUNK_SIZE
+    )
+
+@app.get("/cohort/search")
+def cohort_search(q: str, limit: int = Query(100, ge=0, le=COHORT_SEARCH_MAX_LIMIT)):
+    """
+    Sessions matching a boolean query over extracted terms, e.g.
+    `symptom:numbness AND symptom:"vision problems" AND finding:"mri/lesions detected"`.
+    Terms are symptom:, test:, finding:<test>/<finding> and treatment:, combined
+    with AND (or juxtaposition), OR, NOT and parentheses. Returns the number
+    of matching sessions and the ids of the first `limit`.
+    """
+    cohort_index.index.load(SessionLocal)
+    try:
+        result = cohort_index.index.search(q, limit)
+    except cohort_index.QueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"query": q, "count": result.count, "limit": limit, "session_ids": result.session_ids}
+
+def analytics_range(start: Optional[date], end: Optional[date]):
+    """
+    The requested date range of an analytics endpoint. Reads do not flush
+    this process's pending counts; they lag by up to ANALYTICS_FLUSH_INTERVAL.
+    """
+    try:
+        return analytics.date_range(start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@app.get("/analytics/symptoms")
+def symptom_analytics(start: Optional[date] = None, end: Optional[date] = None, db: Session = Depends(get_read_db)):
+    """
+    Sessions reporting each symptom between `start` and `end` (default: the
+    last 30 days), counted on the day the symptom was first extracted.
+    """
+    start, end = analytics_range(start, end)
+    return {"start": start, "end": end, "symptoms": analytics.counts(db, "symptom", start, end)}
+
+@app.get("/analytics/symptoms/{symptom}")
+def symptom_sessions(symptom: str, db: Session = Depends(get_read_db)):
+    """
+    Stored sessions whose extracted symptoms include `symptom`, over all
+    time. Counted from the state documents; on PostgreSQL the GIN index on
+    ai_state serves the filter.
+    """
+    symptom = symptom.lower()
+    if not any(symptom in names for names in SYMPTOM_KEYWORDS.values()):
+        raise HTTPException(status_code=404, detail="Unknown symptom")
+    count = db.query(func.count(DBSession.id)).filter(
+        session_state.sessions_with_symptom(symptom, db.get_bind().dialect.name)
+    ).scalar()
+    return {"symptom": symptom, "sessions": count}
+
+@app.get("/analytics/treatments")
+def treatment_analytics(start: Optional[date] = None, end: Optional[date] = None, db: Session = Depends(get_read_db)):
+    """
+    Sessions reporting each treatment between `start` and `end` (default: the
+    last 30 days), counted on the day the treatment was first extracted.
+    """
+    start, end = analytics_range(start, end)
+    return {"start": start, "end": end, "treatments": analytics.counts(db, "treatment", start, end)}
+
+@app.get("/analytics/tests")
+def test_analytics(start: Optional[date] = None, end: Optional[date] = None, db: Session = Depends(get_read_db)):
+    """
+    Sessions reporting each diagnostic test and each test finding
+    (`<test>/<finding>`) between `start` and `end` (default: the last 30 days).
+    """
+    start, end = analytics_range(start, end)
+    return {
+        "start": start, "end": end,
+        "tests": analytics.counts(db, "test", start, end),
+        "findings": analytics.counts(db, "finding", start, end),
+    }
+
+@app.get("/analytics/funnel")
+def funnel_analytics(start: Optional[date] = None, end: Optional[date] = None, db: Session = Depends(get_read_db)):
+    """
+    Conversation stage funnel between `start` and `end` (default: the last
+    30 days): sessions and estimated distinct users entering each stage from
+    initial to analysis, and each stage's share of the previous stage's sessions.
+    """
+    start, end = analytics_range(start, end)
+    return {"start": start, "end": end, "stages": analytics.funnel(db, start, end)}
+
+@app.get("/analytics/users")
+def user_analytics(start: Optional[date] = None, end: Optional[date] = None, db: Session = Depends(get_read_db)):
+    """
+    Estimated distinct active users between `start` and `end` (default: the
+    last 30 days) and per day, with the messages processed per day.
+    """
+    start, end = analytics_range(start, end)
+    return {"start": start, "end": end, **analytics.active_users(db, start, end)}
+
+@app.get("/metrics/db_pool")
+def db_pool_metrics():
+    """
+    Connection pool metrics of this worker process: pool occupancy, checkout
+    time histogram, overflow peak, connects, invalidations and timeouts.
+    """
+    return metrics.pool_snapshot()
+
+@app.get("/metrics/state_updates")
+def state_update_metrics():
+    """
+    Optimistic session state updates of this worker process: successful
+    updates, version conflicts, retries, turns that gave up, and the
+    conflict rate.
+    """
+    return metrics.state_updates.snapshot()
+
+@app.get("/metrics/cohort_index")
+def cohort_index_metrics():
+    """
+    Cohort index of this worker process: whether the initial load finished,
+    indexed sessions and terms, and the size of the posting bitmaps.
+    """
+    return cohort_index.index.stats()
+
 def custom_openapi():
     if app.openapi_schema:
         return app.openapi_schema
@@ -0,0 +1,282 @@
+"""
+Full-text search over a user's chat messages and responses.
+
+PostgreSQL: a GIN index on to_tsvector(CHAT_SEARCH_LANGUAGE, message || ' '
+|| response), maintained by PostgreSQL on every insert, and one on the text
+of chat_responses, which holds the responses of newer messages (see
+app/response_store.py). A message matches if its own document or its
+stored response does. Queries use the indexed expressions verbatim, so they
+are answered from the indexes, and are parsed with websearch_to_tsquery
+("quoted phrases", OR, -excluded). Results are ranked with ts_rank_cd and
+highlighted with ts_headline, which only runs for the returned page. On a
+partitioned chat_messages the index is created on the parent and inherited
+by every partition.
+
+SQLite: an FTS5 table kept in sync with chat_messages by insert, update and
+delete triggers, ranked with bm25 and highlighted with snippet(). Besides
+the message and response it indexes an owner token derived from the
+session's email, so a user's matches are found by intersecting posting
+lists instead of filtering every user's matches. The text is not copied:
+the table reads it back through a view over chat_messages and
+chat_responses, keyed by chat_messages' rowid, which VACUUM may renumber;
+call rebuild() after a VACUUM.
+
+ensure() creates the indexes (or the FTS table, filled from the existing
+rows, and its view and triggers, which it replaces) and is idempotent. Turns
+still in the write-behind journal, archived partitions and responses stored
+compressed are not searched.
+
+Excerpts are returned as HTML: the text is escaped and the matches are
+wrapped in HIGHLIGHT_START/HIGHLIGHT_END. The database marks matches with
+private-use characters, which are swapped for the tags after escaping.
+"""
+import os
+import re
+import html
+import logging
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import DateTime, Float, String, Text, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app import partitions
+from app.models import UUID
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Text search configuration of the PostgreSQL index; changing it requires dropping the index
+CHAT_SEARCH_LANGUAGE = os.getenv("CHAT_SEARCH_LANGUAGE", "english")
+if not re.fullmatch(r"\w+", CHAT_SEARCH_LANGUAGE):
+    raise ValueError(f"Invalid CHAT_SEARCH_LANGUAGE: {CHAT_SEARCH_LANGUAGE!r}")
+
+INDEX_NAME = "ix_chat_messages_search"
+RESPONSES_INDEX_NAME = "ix_chat_responses_search"
+# Created by the model on new databases (Session.email index=True)
+SESSIONS_EMAIL_INDEX = "ix_sessions_email"
+FTS_TABLE = "chat_messages_fts"
+HIGHLIGHT_START = "<b>"
+HIGHLIGHT_END = "</b>"
+# What snippet() and ts_headline() put around matches; replaced by the tags once the excerpt is escaped
+_MARK_START = "\ue000"
+_MARK_END = "\ue001"
+
+
+def _document(alias: str = "") -> str:
+    """The indexed expression; queries must use it verbatim for PostgreSQL to use the index."""
+    prefix = f"{alias}." if alias else ""
+    return (
+        f"to_tsvector('{CHAT_SEARCH_LANGUAGE}', "
+        f"coalesce({prefix}message, '') || ' ' || coalesce({prefix}response, ''))"
+    )
+
+
+_RESPONSE_DOCUMENT = f"to_tsvector('{CHAT_SEARCH_LANGUAGE}', coalesce(text, ''))"
+
+# Result columns typed so both dialects return UUIDs and datetimes
+_RESULT_COLUMNS = dict(id=UUID(), session_id=UUID(), stage=String, timestamp=DateTime, rank=Float,
+                       message=Text, response=Text)
+
+_POSTGRESQL_SEARCH = text(f"""
+    SELECT page.id, page.session_id, page.stage, page.timestamp, page.rank,
+           ts_headline('{CHAT_SEARCH_LANGUAGE}', coalesce(page.message, ''), page.query, :options) AS message,
+           ts_headline('{CHAT_SEARCH_LANGUAGE}', coalesce(page.response, ''), page.query, :options) AS response
+    FROM (
+        SELECT cm.id, cm.session_id, cm.stage, cm.timestamp, cm.message,
+               coalesce(cm.response, r.text) AS response, query,
+               ts_rank_cd(to_tsvector('{CHAT_SEARCH_LANGUAGE}',
+                                      coalesce(cm.message, '') || ' ' || coalesce(cm.response, r.text, '')),
+                          query) AS rank
+        FROM chat_messages cm
+        JOIN sessions s ON s.id = cm.session_id
+        LEFT JOIN chat_responses r ON r.hash = cm.response_hash,
+             websearch_to_tsquery('{CHAT_SEARCH_LANGUAGE}', :q) query
+        WHERE s.email = :email AND (
+            {_document('cm')} @@ query
+            OR cm.response_hash IN (
+                SELECT hash FROM chat_responses
+                WHERE {_RESPONSE_DOCUMENT} @@ websearch_to_tsquery('{CHAT_SEARCH_LANGUAGE}', :q)
+            )
+        )
+        ORDER BY rank DESC, cm.timestamp DESC
+        LIMIT :limit OFFSET :offset
+    ) page
+    ORDER BY page.rank DESC, page.timestamp DESC
+""").columns(**_RESULT_COLUMNS)
+
+_SQLITE_SEARCH = text(f"""
+    SELECT cm.id, cm.session_id, cm.stage, cm.timestamp, -bm25({FTS_TABLE}, 1.0, 1.0, 0.0) AS rank,
+           snippet({FTS_TABLE}, 0, '{_MARK_START}', '{_MARK_END}', '...', 16) AS message,
+           snippet({FTS_TABLE}, 1, '{_MARK_START}', '{_MARK_END}', '...', 16) AS response
+    FROM {FTS_TABLE}
+    JOIN chat_messages cm ON cm.rowid = {FTS_TABLE}.rowid
+    WHERE {FTS_TABLE} MATCH :q
+    ORDER BY bm25({FTS_TABLE}, 1.0, 1.0, 0.0), cm.timestamp DESC
+    LIMIT :limit OFFSET :offset
+""").columns(**_RESULT_COLUMNS)
+
+# The owner token: the hex of the email, a single FTS5 token that no other email shares
+_SQLITE_OWNER = "'u' || hex(s.email)"
+
+
+def _sqlite_response(row: str) -> str:
+    """A message's inline or stored response in a trigger; stored ones are purged after their messages."""
+    return f"coalesce({row}.response, (SELECT text FROM chat_responses WHERE hash = {row}.response_hash))"
+
+
+_SQLITE_DDL = [
+    # The view and triggers are replaced, so databases indexed by an older version pick up changes
+    f"DROP VIEW IF EXISTS {FTS_TABLE}_content",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_insert",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_delete",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_update",
+    f"""CREATE VIEW {FTS_TABLE}_content AS
+        SELECT cm.rowid AS message_rowid, cm.message, coalesce(cm.response, r.text) AS response,
+               {_SQLITE_OWNER} AS owner
+        FROM chat_messages cm JOIN sessions s ON s.id = cm.session_id
+        LEFT JOIN chat_responses r ON r.hash = cm.response_hash""",
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        message, response, owner,
+        content='{FTS_TABLE}_content', content_rowid='message_rowid', tokenize='porter unicode61'
+    )""",
+    f"""CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON chat_messages BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, message, response, owner)
+        SELECT new.rowid, new.message, {_sqlite_response('new')}, {_SQLITE_OWNER}
+        FROM sessions s WHERE s.id = new.session_id;
+    END""",
+    # Sessions are deleted after their messages, so the owner can still be looked up
+    f"""CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON chat_messages BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message, response, owner)
+        SELECT 'delete', old.rowid, old.message, {_sqlite_response('old')}, {_SQLITE_OWNER}
+        FROM sessions s WHERE s.id = old.session_id;
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_update AFTER UPDATE OF message, response, response_hash ON chat_messages BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message, response, owner)
+        SELECT 'delete', old.rowid, old.message, {_sqlite_response('old')}, {_SQLITE_OWNER}
+        FROM sessions s WHERE s.id = old.session_id;
+        INSERT INTO {FTS_TABLE}(rowid, message, response, owner)
+        SELECT new.rowid, new.message, {_sqlite_response('new')}, {_SQLITE_OWNER}
+        FROM sessions s WHERE s.id = new.session_id;
+    END""",
+]
+
+
+class SearchQueryError(ValueError):
+    pass
+
+
+def ensure(engine: Engine) -> None:
+    """Create the full-text indexes, and the index on sessions.email they are scoped by, if they do not exist yet."""
+    dialect = engine.dialect.name
+    if dialect == "postgresql":
+        columns = f"ON chat_messages USING gin (({_document()}))"
+        # Without blocking inserts from other workers while existing tables are indexed
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {SESSIONS_EMAIL_INDEX} ON sessions (email)"))
+            conn.execute(text(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {RESPONSES_INDEX_NAME} "
+                f"ON chat_responses USING gin (({_RESPONSE_DOCUMENT}))"
+            ))
+            if partitions.partitioning_enabled(engine):
+                # Partitioned tables cannot be indexed concurrently
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS {INDEX_NAME} {columns}"))
+            else:
+                conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX_NAME} {columns}"))
+    elif dialect == "sqlite":
+        with engine.begin() as conn:
+            # Holds the write lock from the start: the driver would otherwise commit each DDL statement on
+            # its own, and workers starting together could interleave their drops and creates
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {SESSIONS_EMAIL_INDEX} ON sessions (email)"))
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": FTS_TABLE}
+            ).first()
+            for statement in _SQLITE_DDL:
+                conn.execute(text(statement))
+            if not exists:
+                # Index the messages stored before search was enabled
+                conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    else:
+        logger.warning(f"Chat search is not supported on {dialect}")
+
+
+def rebuild(engine: Engine) -> None:
+    """Re-index every message (SQLite; e.g. after VACUUM renumbered rowids)."""
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as conn:
+            conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+
+def fts5_query(email: str, q: str) -> str:
+    """
+    A user query as an FTS5 expression over `email`'s messages: each word is
+    quoted (FTS5 syntax characters are not operators), "phrases" are kept
+    together, a leading "-" excludes a word and OR between words is kept.
+    """
+    positive: List[str] = []
+    negative: List[str] = []
+    pending_or = False
+    for phrase, negated, word in re.findall(r'"([^"]*)"|(-?)([^\s"]+)', q):
+        if not phrase and word == "OR" and not negated:
+            pending_or = bool(positive)
+            continue
+        tokens = re.findall(r"\w+", phrase or word)
+        if not tokens:
+            continue
+        term = '"' + " ".join(tokens) + '"'
+        if negated:
+            negative.append(term)
+        elif pending_or:
+            positive[-1] = f"{positive[-1]} OR {term}"
+        else:
+            positive.append(term)
+        pending_or = False
+    if not positive:
+        raise SearchQueryError("The query has no words to search for")
+    expression = " AND ".join(f"({term})" for term in positive) + "".join(f" NOT {term}" for term in negative)
+    owner = "u" + email.encode("utf-8").hex().upper()
+    return f'owner : "{owner}" AND ({{message response}} : ({expression}))'
+
+
+def _highlight(excerpt: Optional[str]) -> Optional[str]:
+    """An excerpt as escaped HTML with its marked matches in highlight tags."""
+    if excerpt is None:
+        return None
+    return html.escape(excerpt, quote=False).replace(_MARK_START, HIGHLIGHT_START).replace(_MARK_END, HIGHLIGHT_END)
+
+
+def search(db: Session, email: str, q: str, limit: int, offset: int = 0) -> List[Dict[str, Any]]:
+    """
+    One page of a user's messages matching `q`, best match first, each with
+    its message and response excerpts around the matches highlighted (as
+    escaped HTML).
+    """
+    if not re.search(r"\w", q):
+        raise SearchQueryError("The query has no words to search for")
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        rows = db.execute(_POSTGRESQL_SEARCH, {
+            "q": q, "email": email, "limit": limit, "offset": offset,
+            "options": f"StartSel={_MARK_START}, StopSel={_MARK_END}, MaxFragments=2, MaxWords=24, MinWords=8",
+        })
+    elif dialect == "sqlite":
+        rows = db.execute(_SQLITE_SEARCH, {
+            "q": fts5_query(email, q), "limit": limit, "offset": offset,
+        })
+    else:
+        raise NotImplementedError(f"Chat search is not supported on {dialect}")
+    return [
+        {
+            "message_id": str(row.id),
+            "session_id": str(row.session_id),
+            "stage": row.stage,
+            "timestamp": row.timestamp,
+            "rank": round(float(row.rank), 6),
+            "message": _highlight(row.message),
+            "response": _highlight(row.response),
+        }
+        for row in rows
+    ]
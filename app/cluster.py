@@ -0,0 +1,309 @@
+"""
+Multi-worker deployment with session affinity.
+
+`python main.py --workers N` starts N uvicorn worker processes on local
+ports and a routing proxy on the public port. The proxy sends every request
+for a session to the worker that owns it on a consistent-hash ring of
+session ids. Per-process state (conversation state caches, pending
+write-behind turns) is therefore only ever read by the process that wrote
+it, and no cross-worker coherence protocol is needed.
+
+Workers create new session ids that hash to themselves (see
+app/ownership.py), so a session is owned from its first message by the
+worker that created it.
+/chat/batch requests are split by owner and the results merged in request
+order. /cohort/search goes to every worker, each searching the sessions it
+owns, and the matches are merged. Requests without a session go to the
+worker owning the user's email (new chats and /user/{email}/...) or
+round-robin. A new chat is created by the email's worker, so /user/{email}/...
+requests reach the worker that created (and so owns) the user's sessions.
+
+A worker that deletes sessions it does not own (the retention sweep on
+worker 0, or a user's sessions) tells every other worker to forget them
+(see forget_on_peers), so no worker keeps indexing or caching them.
+
+The supervisor restarts workers that exit. Each worker gets its own
+write-behind journal directory and WEB_CONCURRENCY=N for pool sizing.
+"""
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import logging
+import itertools
+import threading
+import subprocess
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.ownership import CLUSTER_WORKERS, CLUSTER_WORKER_INDEX, HashRing, routing_key
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CLUSTER_BASE_PORT = int(os.getenv("CLUSTER_BASE_PORT", "8100"))
+
+# Workers POST deleted session ids here to each other (see forget_on_peers)
+FORGET_PATH = "/cluster/forget"
+SESSION_PATH = re.compile(r"^/(?:session|generate_report)/([^/]+)")
+USER_PATH = re.compile(r"^/user/([^/]+)")
+HOP_BY_HOP_HEADERS = {
+    b"connection", b"keep-alive", b"proxy-authenticate", b"proxy-authorization",
+    b"te", b"trailers", b"transfer-encoding", b"upgrade", b"host",
+}
+
+
+def forget_on_peers(session_ids: Iterable, timeout: float = 10.0) -> None:
+    """
+    Tell the other workers that sessions were deleted, once the delete has
+    committed. A worker that cannot be reached keeps its copies until it is
+    restarted and reloads from the database; the failure is logged.
+    """
+    session_ids = [str(session_id) for session_id in session_ids]
+    if CLUSTER_WORKERS <= 1 or not session_ids:
+        return
+    import httpx
+
+    for index in range(CLUSTER_WORKERS):
+        if index == CLUSTER_WORKER_INDEX:
+            continue
+        try:
+            httpx.post(
+                f"http://127.0.0.1:{CLUSTER_BASE_PORT + index}{FORGET_PATH}",
+                json={"session_ids": session_ids}, timeout=timeout
+            ).raise_for_status()
+        except httpx.HTTPError as e:
+            logger.error(f"Worker {index} did not forget {len(session_ids)} deleted sessions: {str(e)}")
+
+
+# Supervisor side
+
+class WorkerProcess:
+    """One uvicorn worker on a local port, restarted if it exits."""
+    def __init__(self, index: int, workers: int, port: int, app: str):
+        self.index = index
+        self.workers = workers
+        self.port = port
+        self.app = app
+        self.process: Optional[subprocess.Popen] = None
+
+    def start(self) -> None:
+        env = dict(os.environ)
+        env.update({
+            "CLUSTER_WORKERS": str(self.workers),
+            "CLUSTER_WORKER_INDEX": str(self.index),
+            "CLUSTER_BASE_PORT": str(self.port - self.index),
+            "WEB_CONCURRENCY": str(self.workers),
+            # Write-behind journals must not be shared between processes
+            "WRITE_BEHIND_DIR": os.path.join(os.getenv("WRITE_BEHIND_DIR", "write_behind"), f"worker-{self.index}"),
+        })
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", self.app, "--host", "127.0.0.1",
+             "--port", str(self.port), "--log-level", "warning"],
+            env=env
+        )
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self, timeout: float = 30.0) -> None:
+        if not self.alive():
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+class Router:
+    """ASGI proxy forwarding each request to the worker that owns its session."""
+    def __init__(self, ports: List[int]):
+        self.ports = ports
+        self.ring = HashRing(len(ports))
+        self._round_robin = itertools.cycle(range(len(ports)))
+        self.clients: List[Any] = []
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        if scope["method"] == "POST" and scope["path"].rstrip("/") == "/chat/batch":
+            status, headers, content = await self._batch(scope, body)
+        elif scope["method"] == "GET" and scope["path"].rstrip("/") == "/cohort/search":
+            status, headers, content = await self._cohort_search(scope, body)
+        else:
+            status, headers, content = await self._forward(self._route(scope, body), scope, body)
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": content})
+
+    async def _lifespan(self, receive, send) -> None:
+        import httpx
+
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                limits = httpx.Limits(max_connections=256, max_keepalive_connections=64)
+                self.clients = [
+                    httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=120.0)
+                    for port in self.ports
+                ]
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                for client in self.clients:
+                    await client.aclose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def _route(self, scope, body: bytes) -> int:
+        match = SESSION_PATH.match(scope["path"])
+        if match:
+            return self.ring.node_for(routing_key(match.group(1)))
+        match = USER_PATH.match(scope["path"])
+        if match:
+            return self.ring.node_for(match.group(1))
+        if scope["method"] == "POST" and scope["path"].rstrip("/") == "/chat":
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                payload = None
+            if isinstance(payload, dict):
+                if payload.get("session_id"):
+                    return self.ring.node_for(routing_key(payload["session_id"]))
+                if payload.get("email"):
+                    return self.ring.node_for(str(payload["email"]))
+        return next(self._round_robin)
+
+    async def _forward(self, node: int, scope, body: bytes) -> Tuple[int, list, bytes]:
+        import httpx
+
+        # httpx sets content-length for the (possibly re-encoded) body
+        headers = [
+            (name.decode("latin-1"), value.decode("latin-1"))
+            for name, value in scope["headers"]
+            if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() != b"content-length"
+        ]
+        path = scope["path"]
+        if scope.get("query_string"):
+            path += "?" + scope["query_string"].decode("latin-1")
+        client = self.clients[node]
+        try:
+            response = await client.send(
+                client.build_request(scope["method"], path, headers=headers, content=body), stream=True
+            )
+            try:
+                # Raw bytes: compressed responses are passed on as they are, with their Content-Encoding
+                content = b"".join([chunk async for chunk in response.aiter_raw()])
+            finally:
+                await response.aclose()
+        except httpx.HTTPError as e:
+            logger.error(f"Worker {node} unavailable: {str(e)}")
+            return 503, [(b"content-type", b"application/json")], b'{"detail":"Worker unavailable"}'
+        response_headers = [
+            (name.encode("latin-1"), value.encode("latin-1"))
+            for name, value in response.headers.multi_items()
+            if name.lower().encode("latin-1") not in HOP_BY_HOP_HEADERS
+        ]
+        return response.status_code, response_headers, content
+
+    async def _batch(self, scope, body: bytes) -> Tuple[int, list, bytes]:
+        """Split a batch by owning worker and merge the results in request order."""
+        try:
+            payload = json.loads(body)
+            items = payload["items"]
+            by_node: Dict[int, List[int]] = {}
+            for index, item in enumerate(items):
+                by_node.setdefault(self.ring.node_for(routing_key(item["session_id"])), []).append(index)
+        except (ValueError, KeyError, TypeError):
+            # Let a worker produce the validation error
+            return await self._forward(next(self._round_robin), scope, body)
+        if len(by_node) <= 1:
+            node = next(iter(by_node), next(self._round_robin))
+            return await self._forward(node, scope, body)
+
+        async def forward_part(node: int, indexes: List[int]):
+            part = json.dumps({**payload, "items": [items[i] for i in indexes]}).encode("utf-8")
+            return indexes, await self._forward(node, scope, part)
+
+        parts = await asyncio.gather(*(forward_part(node, indexes) for node, indexes in by_node.items()))
+        results: List[Any] = [None] * len(items)
+        for indexes, (status, headers, content) in parts:
+            if status != 200:
+                return status, headers, content
+            for index, result in zip(indexes, json.loads(content)["results"]):
+                results[index] = result
+        return 200, [(b"content-type", b"application/json")], json.dumps({"results": results}).encode("utf-8")
+
+    async def _cohort_search(self, scope, body: bytes) -> Tuple[int, list, bytes]:
+        """Ask every worker, each indexing the sessions it owns, and merge the matches."""
+        parts = await asyncio.gather(*(self._forward(node, scope, body) for node in range(len(self.ports))))
+        merged: Optional[Dict[str, Any]] = None
+        for status, headers, content in parts:
+            if status != 200:
+                return status, headers, content
+            part = json.loads(content)
+            if merged is None:
+                merged = part
+            else:
+                merged["count"] += part["count"]
+                merged["session_ids"] = (merged["session_ids"] + part["session_ids"])[:merged["limit"]]
+        return 200, [(b"content-type", b"application/json")], json.dumps(merged).encode("utf-8")
+
+
+def _wait_until_listening(port: int, timeout: float = 60.0) -> None:
+    import socket
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1.0):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Worker on port {port} did not start")
+
+
+def serve(workers: int, host: str = "0.0.0.0", port: int = 8000,
+          base_port: int = CLUSTER_BASE_PORT, app: str = "app.api:app") -> None:
+    """Run `workers` worker processes behind the session-affinity router until interrupted."""
+    import uvicorn
+
+    processes = [WorkerProcess(index, workers, base_port + index, app) for index in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        _wait_until_listening(process.port)
+    logger.info(f"Started {workers} workers on ports {base_port}-{base_port + workers - 1}")
+
+    stopping = threading.Event()
+
+    def supervise() -> None:
+        while not stopping.wait(1.0):
+            for process in processes:
+                if not process.alive():
+                    logger.error(f"Worker {process.index} exited, restarting")
+                    process.start()
+
+    supervisor = threading.Thread(target=supervise, name="cluster-supervisor", daemon=True)
+    supervisor.start()
+    try:
+        uvicorn.run(Router([process.port for process in processes]), host=host, port=port)
+    finally:
+        stopping.set()
+        supervisor.join()
+        for process in processes:
+            process.stop()
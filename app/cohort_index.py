@@ -0,0 +1,523 @@
+"""
+Inverted index of sessions by extracted symptom, test, finding and treatment,
+for boolean cohort queries such as
+
+    symptom:numbness AND symptom:"vision problems" AND finding:"mri/lesions detected"
+
+Each term (see state_terms) maps to a Bitmap of session ordinals, so a query
+is a few bitmap intersections, unions and differences instead of a scan of
+every ai_state document. The index lives in the API process: it is loaded
+from the sessions table once (on startup, or by the first search) and then
+kept current by every committed state update and write-behind journal
+append of this process. In cluster mode each worker indexes the sessions it
+owns and the router merges the workers' results.
+"""
+import logging
+import threading
+from array import array
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import ownership
+from app.compact_state import Lexicon
+
+logger = logging.getLogger(__name__)
+
+TERM_KINDS = ("symptom", "test", "finding", "treatment")
+
+# Session.info key holding term sets to index once the transaction commits
+PENDING_KEY = "cohort_index_pending"
+
+CHUNK_BITS = 16
+CHUNK_SIZE = 1 << CHUNK_BITS
+# Chunks with more values than this are held as bitsets
+ARRAY_MAX = 4096
+
+# A chunk is a sorted uint16 array of its values, or a uint8 bitset of CHUNK_SIZE bits
+Container = np.ndarray
+
+
+def _is_bits(container: Container) -> bool:
+    return container.dtype == np.uint8
+
+
+def _to_bits(values: np.ndarray) -> np.ndarray:
+    bits = np.zeros(CHUNK_SIZE, dtype=bool)
+    bits[values] = True
+    return np.packbits(bits, bitorder="little")
+
+
+def _to_array(bits: np.ndarray) -> np.ndarray:
+    return np.flatnonzero(np.unpackbits(bits, bitorder="little")).astype(np.uint16)
+
+
+def _count(container: Container) -> int:
+    if _is_bits(container):
+        return int.from_bytes(container.tobytes(), "little").bit_count()
+    return len(container)
+
+
+def _normalize(container: Container) -> Optional[Container]:
+    """The container in its compact form, or None if empty."""
+    count = _count(container)
+    if count == 0:
+        return None
+    if _is_bits(container):
+        return _to_array(container) if count <= ARRAY_MAX else container
+    return _to_bits(container) if count > ARRAY_MAX else container
+
+
+def _as_bits(container: Container) -> np.ndarray:
+    return container if _is_bits(container) else _to_bits(container)
+
+
+class Bitmap:
+    """
+    Compressed set of non-negative integers, in the manner of Roaring bitmaps:
+    values are split into 2^16-wide chunks, each held as a sorted uint16
+    array while sparse and as a bitset once dense.
+    """
+    __slots__ = ("_chunks",)
+
+    def __init__(self, values: Iterable[int] = ()):
+        self._chunks: Dict[int, Container] = {}
+        for value in values:
+            self.add(value)
+
+    @classmethod
+    def from_values(cls, values: Iterable[int]) -> "Bitmap":
+        """A bitmap of many values at once, built chunk by chunk rather than value by value."""
+        result = cls()
+        values = np.unique(np.fromiter(values, dtype=np.int64))
+        if not len(values):
+            return result
+        highs = values >> CHUNK_BITS
+        starts = np.flatnonzero(np.r_[True, highs[1:] != highs[:-1]])
+        for start, end in zip(starts, np.r_[starts[1:], len(values)]):
+            result._chunks[int(highs[start])] = _normalize((values[start:end] & (CHUNK_SIZE - 1)).astype(np.uint16))
+        return result
+
+    def add(self, value: int) -> None:
+        high, low = value >> CHUNK_BITS, value & (CHUNK_SIZE - 1)
+        chunk = self._chunks.get(high)
+        if chunk is None:
+            self._chunks[high] = np.array([low], dtype=np.uint16)
+        elif _is_bits(chunk):
+            # Bitsets are updated in place; results of set operations never share them with an index
+            chunk[low >> 3] |= 1 << (low & 7)
+        else:
+            # New sessions get the highest ordinals, so most adds append
+            if low > chunk[-1]:
+                index = len(chunk)
+            else:
+                index = int(np.searchsorted(chunk, low))
+                if chunk[index] == low:
+                    return
+            grown = np.empty(len(chunk) + 1, dtype=np.uint16)
+            grown[:index], grown[index], grown[index + 1:] = chunk[:index], low, chunk[index:]
+            self._chunks[high] = grown if len(grown) <= ARRAY_MAX else _to_bits(grown)
+
+    def discard(self, value: int) -> None:
+        high, low = value >> CHUNK_BITS, value & (CHUNK_SIZE - 1)
+        chunk = self._chunks.get(high)
+        if chunk is None:
+            return
+        if _is_bits(chunk):
+            chunk[low >> 3] &= ~(1 << (low & 7)) & 0xFF
+        else:
+            index = int(np.searchsorted(chunk, low))
+            if index == len(chunk) or chunk[index] != low:
+                return
+            chunk = np.delete(chunk, index)
+        chunk = _normalize(chunk)
+        if chunk is None:
+            del self._chunks[high]
+        else:
+            self._chunks[high] = chunk
+
+    def __contains__(self, value: int) -> bool:
+        chunk = self._chunks.get(value >> CHUNK_BITS)
+        if chunk is None:
+            return False
+        low = value & (CHUNK_SIZE - 1)
+        if _is_bits(chunk):
+            return bool(chunk[low >> 3] >> (low & 7) & 1)
+        index = int(np.searchsorted(chunk, low))
+        return index < len(chunk) and chunk[index] == low
+
+    def __len__(self) -> int:
+        return sum(_count(chunk) for chunk in self._chunks.values())
+
+    def __iter__(self) -> Iterator[int]:
+        for high in sorted(self._chunks):
+            chunk = self._chunks[high]
+            base = high << CHUNK_BITS
+            for low in (_to_array(chunk) if _is_bits(chunk) else chunk).tolist():
+                yield base | low
+
+    def _combine(self, other: "Bitmap", highs: Iterable[int], bits_op, array_op) -> "Bitmap":
+        result = Bitmap()
+        empty = np.zeros(0, dtype=np.uint16)
+        for high in highs:
+            a, b = self._chunks.get(high, empty), other._chunks.get(high, empty)
+            if _is_bits(a) or _is_bits(b):
+                chunk = _normalize(bits_op(_as_bits(a), _as_bits(b)))
+            else:
+                chunk = _normalize(array_op(a, b))
+            if chunk is not None:
+                result._chunks[high] = chunk
+        return result
+
+    def __and__(self, other: "Bitmap") -> "Bitmap":
+        return self._combine(other, self._chunks.keys() & other._chunks.keys(), np.bitwise_and,
+                             lambda a, b: np.intersect1d(a, b, assume_unique=True))
+
+    def __or__(self, other: "Bitmap") -> "Bitmap":
+        return self._combine(other, self._chunks.keys() | other._chunks.keys(), np.bitwise_or, np.union1d)
+
+    def __sub__(self, other: "Bitmap") -> "Bitmap":
+        return self._combine(other, self._chunks.keys(), lambda a, b: a & ~b,
+                             lambda a, b: np.setdiff1d(a, b, assume_unique=True))
+
+    def nbytes(self) -> int:
+        """Approximate size of the chunk containers."""
+        return sum(chunk.nbytes for chunk in self._chunks.values())
+
+
+def state_terms(state: Mapping[str, Any]) -> Set[str]:
+    """Index terms of a stored state document: "<kind>:<value>", lowercased."""
+    terms: Set[str] = set()
+    for symptoms in (state.get("symptoms") or {}).values():
+        terms.update(f"symptom:{symptom}".lower() for symptom in symptoms if isinstance(symptom, str))
+    for key, test in (state.get("diagnostic_tests") or {}).items():
+        terms.add(f"test:{key}".lower())
+        if isinstance(test, Mapping):
+            terms.update(
+                f"finding:{key}/{finding}".lower() for finding in test.get("findings") or () if isinstance(finding, str)
+            )
+    for treatments in (state.get("treatments") or {}).values():
+        terms.update(f"treatment:{treatment}".lower() for treatment in treatments if isinstance(treatment, str))
+    return terms
+
+
+# Query parsing
+
+class QueryError(ValueError):
+    """Raised for a cohort query that does not parse"""
+    pass
+
+
+class Term(NamedTuple):
+    term: str
+
+
+class Not(NamedTuple):
+    operand: Any
+
+
+class And(NamedTuple):
+    operands: Tuple[Any, ...]
+
+
+class Or(NamedTuple):
+    operands: Tuple[Any, ...]
+
+
+def _tokenize(query: str) -> List[str]:
+    tokens: List[str] = []
+    i = 0
+    while i < len(query):
+        char = query[i]
+        if char.isspace():
+            i += 1
+        elif char in "()":
+            tokens.append(char)
+            i += 1
+        else:
+            start = i
+            while i < len(query) and not query[i].isspace() and query[i] not in "()":
+                if query[i] == '"':
+                    end = query.find('"', i + 1)
+                    if end < 0:
+                        raise QueryError("Unterminated quoted term")
+                    i = end
+                i += 1
+            tokens.append(query[start:i])
+    return tokens
+
+
+def parse_query(query: str) -> Any:
+    """
+    Parse a boolean query of `kind:value` terms (values with spaces quoted)
+    combined with AND, OR, NOT and parentheses. Adjacent terms are ANDed;
+    NOT binds tightest, then AND, then OR.
+    """
+    tokens = _tokenize(query)
+    position = 0
+
+    def peek() -> Optional[str]:
+        return tokens[position] if position < len(tokens) else None
+
+    def take() -> str:
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def parse_or():
+        operands = [parse_and()]
+        while peek() is not None and peek().upper() == "OR":
+            take()
+            operands.append(parse_and())
+        return operands[0] if len(operands) == 1 else Or(tuple(operands))
+
+    def parse_and():
+        operands = [parse_not()]
+        while peek() is not None and peek() != ")" and peek().upper() != "OR":
+            if peek().upper() == "AND":
+                take()
+            operands.append(parse_not())
+        return operands[0] if len(operands) == 1 else And(tuple(operands))
+
+    def parse_not():
+        token = peek()
+        if token is None:
+            raise QueryError("Unexpected end of query")
+        if token.upper() == "NOT":
+            take()
+            return Not(parse_not())
+        if token == "(":
+            take()
+            node = parse_or()
+            if peek() != ")":
+                raise QueryError("Missing closing parenthesis")
+            take()
+            return node
+        if token == ")" or token.upper() in ("AND", "OR"):
+            raise QueryError(f"Unexpected {token!r}")
+        take()
+        kind, sep, value = token.partition(":")
+        value = value.replace('"', "").strip()
+        if not sep or kind.lower() not in TERM_KINDS or not value:
+            raise QueryError(f"Terms must be one of {', '.join(k + ':<value>' for k in TERM_KINDS)}, got {token!r}")
+        return Term(f"{kind}:{value}".lower())
+
+    if not tokens:
+        raise QueryError("Empty query")
+    node = parse_or()
+    if position != len(tokens):
+        raise QueryError(f"Unexpected {tokens[position]!r}")
+    return node
+
+
+class SearchResult(NamedTuple):
+    count: int
+    session_ids: List[str]
+
+
+class CohortIndex:
+    """Term -> Bitmap of session ordinals for the sessions of this process."""
+    def __init__(self):
+        self.terms = Lexicon()
+        self._postings: Dict[int, Bitmap] = {}
+        # Every indexed session, the universe NOT is taken against
+        self._all = Bitmap()
+        self._ordinals: Dict[str, int] = {}
+        self._session_ids: List[Optional[str]] = []
+        self._session_terms: Dict[int, array] = {}
+        self._free: List[int] = []
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        self._loaded = False
+        # Sessions indexed while the initial load runs, whose loaded state may be older
+        self._touched: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._ordinals)
+
+    def index(self, session_id: str, terms: Iterable[str]) -> None:
+        """Set the terms of a session, adding it to the index if new."""
+        key = ownership.routing_key(session_id)
+        term_ids = array("I", sorted({self.terms.id(term) for term in terms}))
+        with self._lock:
+            if not self._loaded:
+                self._touched.add(key)
+            self._set_terms(key, term_ids)
+
+    def _set_terms(self, key: str, term_ids: array) -> None:
+        ordinal = self._ordinals.get(key)
+        if ordinal is None:
+            ordinal = self._new_ordinal(key)
+        old = self._session_terms.get(ordinal, array("I"))
+        if old == term_ids:
+            return
+        new_set, old_set = set(term_ids), set(old)
+        for term_id in old_set - new_set:
+            self._postings[term_id].discard(ordinal)
+        for term_id in new_set - old_set:
+            postings = self._postings.get(term_id)
+            if postings is None:
+                postings = self._postings[term_id] = Bitmap()
+            postings.add(ordinal)
+        self._session_terms[ordinal] = term_ids
+
+    def _new_ordinal(self, key: str) -> int:
+        ordinal = self._free.pop() if self._free else len(self._session_ids)
+        if ordinal == len(self._session_ids):
+            self._session_ids.append(key)
+        else:
+            self._session_ids[ordinal] = key
+        self._ordinals[key] = ordinal
+        self._all.add(ordinal)
+        return ordinal
+
+    def discard(self, session_ids: Iterable[str]) -> None:
+        with self._lock:
+            for session_id in session_ids:
+                key = ownership.routing_key(session_id)
+                if not self._loaded:
+                    self._touched.add(key)
+                ordinal = self._ordinals.pop(key, None)
+                if ordinal is None:
+                    continue
+                for term_id in self._session_terms.pop(ordinal, ()):
+                    self._postings[term_id].discard(ordinal)
+                self._all.discard(ordinal)
+                self._session_ids[ordinal] = None
+                self._free.append(ordinal)
+
+    def load(self, session_factory: Callable[[], Session], chunk_size: int = 5000) -> None:
+        """Index every session this process owns from the database, once; later calls return when it is done."""
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            from app.models import Session as DBSession
+
+            started = len(self)
+            # Postings of the loaded sessions, merged into the index as bitmaps at the end
+            loaded: Dict[int, List[int]] = {}
+            db = session_factory()
+            try:
+                rows = db.query(
+                    DBSession.id, DBSession.ai_state["symptoms"],
+                    DBSession.ai_state["diagnostic_tests"], DBSession.ai_state["treatments"]
+                ).yield_per(chunk_size)
+                for session_id, symptoms, tests, treatments in rows:
+                    session_id = str(session_id)
+                    if not ownership.owns(session_id):
+                        continue
+                    terms = state_terms({
+                        "symptoms": symptoms if isinstance(symptoms, dict) else {},
+                        "diagnostic_tests": tests if isinstance(tests, dict) else {},
+                        "treatments": treatments if isinstance(treatments, dict) else {},
+                    })
+                    term_ids = array("I", sorted({self.terms.id(term) for term in terms}))
+                    with self._lock:
+                        if session_id in self._touched or session_id in self._ordinals:
+                            continue
+                        ordinal = self._new_ordinal(session_id)
+                        self._session_terms[ordinal] = term_ids
+                    for term_id in term_ids:
+                        loaded.setdefault(term_id, []).append(ordinal)
+            finally:
+                db.close()
+            with self._lock:
+                for term_id, ordinals in loaded.items():
+                    # Sessions indexed meanwhile were skipped above, so the ordinals are new to these postings
+                    postings = self._postings.get(term_id)
+                    bitmap = Bitmap.from_values(ordinals)
+                    self._postings[term_id] = postings | bitmap if postings is not None else bitmap
+                self._loaded = True
+                self._touched.clear()
+            logger.info(f"Cohort index loaded {len(self) - started} sessions")
+
+    def _evaluate(self, node: Any) -> Bitmap:
+        if isinstance(node, Term):
+            term_id = self.terms.get(node.term)
+            return self._postings.get(term_id, Bitmap()) if term_id is not None else Bitmap()
+        if isinstance(node, Not):
+            return self._all - self._evaluate(node.operand)
+        if isinstance(node, And):
+            # Positive operands first, smallest first, so intermediate results stay small
+            positive = sorted((self._evaluate(op) for op in node.operands if not isinstance(op, Not)), key=len)
+            result = positive[0] if positive else self._all
+            for bitmap in positive[1:]:
+                if not len(result):
+                    break
+                result = result & bitmap
+            for op in node.operands:
+                if isinstance(op, Not) and len(result):
+                    result = result - self._evaluate(op.operand)
+            return result
+        result = Bitmap()
+        for op in node.operands:
+            result = result | self._evaluate(op)
+        return result
+
+    def search(self, query: str, limit: int = 100) -> SearchResult:
+        """Number of sessions matching `query` and the ids of the first `limit` of them."""
+        node = parse_query(query)
+        with self._lock:
+            matches = self._evaluate(node)
+            session_ids = []
+            for ordinal in matches:
+                if len(session_ids) >= limit:
+                    break
+                session_ids.append(self._session_ids[ordinal])
+            return SearchResult(len(matches), session_ids)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "loaded": self._loaded,
+                "sessions": len(self),
+                "terms": len(self._postings),
+                "posting_bytes": sum(bitmap.nbytes() for bitmap in self._postings.values()),
+            }
+
+
+index = CohortIndex()
+
+
+def index_after_commit(db: Session, session_id: str, state: Mapping[str, Any]) -> None:
+    """Index a session's state once `db`'s current transaction commits."""
+    # Extracted now, so later changes to `state` are not indexed
+    db.info.setdefault(PENDING_KEY, {})[str(session_id)] = state_terms(state)
+
+
+def index_state(session_id: str, state: Mapping[str, Any]) -> None:
+    index.index(session_id, state_terms(state))
+
+
+def discard(session_ids: Iterable[str]) -> None:
+    index.discard(str(session_id) for session_id in session_ids)
+
+
+def start(session_factory: Callable[[], Session]) -> threading.Thread:
+    """Load the index in the background so the first search does not wait for it."""
+    def run() -> None:
+        try:
+            index.load(session_factory)
+        except Exception as e:
+            logger.error(f"Cohort index load failed: {str(e)}")
+
+    thread = threading.Thread(target=run, name="cohort-index", daemon=True)
+    thread.start()
+    return thread
+
+
+@event.listens_for(Session, "after_commit")
+def _index_committed(db: Session) -> None:
+    pending = db.info.pop(PENDING_KEY, None)
+    if pending:
+        for session_id, terms in pending.items():
+            index.index(session_id, terms)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_rolled_back(db: Session) -> None:
+    db.info.pop(PENDING_KEY, None)
@@ -0,0 +1,360 @@
+"""
+Compact in-memory containers for ConversationState.
+
+The stored and API form of a conversation state is a JSON document of
+nested dicts and lists (see state_codec). Held in memory that way, every
+resident session keeps its own copies of the same symptom, treatment and
+test strings and its own dict per chat message. These containers keep the
+same mapping/sequence interfaces the stage handlers use, but store:
+
+- symptoms, treatments and lifestyle details as ordered ids over a shared
+  Lexicon, with a bitset for O(1) membership tests
+- diagnostic test records as shared read-only records
+- chat history as a role code per message plus its content, with the
+  (mostly canned) assistant responses interned
+
+Conversion to the dict format happens only in ConversationState.to_dict.
+"""
+import sys
+import threading
+from array import array
+from types import MappingProxyType
+from collections.abc import Mapping, MutableMapping, MutableSequence
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from app.vocabulary import SYMPTOM_KEYWORDS, MS_MEDICATIONS
+
+
+class Lexicon:
+    """Append-only table interning terms to small integer ids, shared by all sessions."""
+    def __init__(self, terms: Iterable[str] = ()):
+        self._terms: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        for term in terms:
+            self.id(term)
+
+    def id(self, term: str) -> int:
+        term_id = self._ids.get(term)
+        if term_id is None:
+            if not isinstance(term, str):
+                raise TypeError(f"Lexicon terms must be strings, not {type(term).__name__}")
+            with self._lock:
+                term_id = self._ids.get(term)
+                if term_id is None:
+                    term_id = len(self._terms)
+                    self._terms.append(sys.intern(term))
+                    self._ids[self._terms[term_id]] = term_id
+        return term_id
+
+    def get(self, term: str) -> Optional[int]:
+        """Id of `term` if it has been interned, without interning it."""
+        return self._ids.get(term)
+
+    def term(self, term_id: int) -> str:
+        return self._terms[term_id]
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+
+SYMPTOM_LEXICON = Lexicon(
+    symptom for category in SYMPTOM_KEYWORDS.values() for symptom in category
+)
+TREATMENT_LEXICON = Lexicon([med.title() for med in MS_MEDICATIONS] + ["Unspecified medication", "None"])
+LIFESTYLE_LEXICON = Lexicon([
+    "Diet mentioned", "Exercise mentioned", "Stress management mentioned", "Basic lifestyle"
+])
+
+
+class TermList(MutableSequence):
+    """List of lexicon terms stored as ids, with a bitset of the ids it contains."""
+    __slots__ = ("lexicon", "_ids", "_bits")
+
+    def __init__(self, lexicon: Lexicon, terms: Iterable[str] = ()):
+        self.lexicon = lexicon
+        self._ids = array("I")
+        self._bits = 0
+        for term in terms:
+            self.append(term)
+
+    def __contains__(self, term: object) -> bool:
+        term_id = self.lexicon.get(term) if isinstance(term, str) else None
+        return term_id is not None and bool(self._bits >> term_id & 1)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.lexicon.term(term_id) for term_id in self._ids[index]]
+        return self.lexicon.term(self._ids[index])
+
+    def __setitem__(self, index, term) -> None:
+        if isinstance(index, slice):
+            self._ids[index] = array("I", (self.lexicon.id(t) for t in term))
+        else:
+            self._ids[index] = self.lexicon.id(term)
+        self._rebuild_bits()
+
+    def __delitem__(self, index) -> None:
+        del self._ids[index]
+        self._rebuild_bits()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __iter__(self) -> Iterator[str]:
+        term = self.lexicon.term
+        return (term(term_id) for term_id in self._ids)
+
+    def insert(self, index: int, term: str) -> None:
+        term_id = self.lexicon.id(term)
+        self._ids.insert(index, term_id)
+        self._bits |= 1 << term_id
+
+    def append(self, term: str) -> None:
+        term_id = self.lexicon.id(term)
+        self._ids.append(term_id)
+        self._bits |= 1 << term_id
+
+    def add(self, term: str) -> None:
+        """Append `term` unless already present."""
+        term_id = self.lexicon.id(term)
+        if not self._bits >> term_id & 1:
+            self._ids.append(term_id)
+            self._bits |= 1 << term_id
+
+    def ids(self) -> array:
+        """Lexicon ids of the terms, in order."""
+        return self._ids
+
+    def _rebuild_bits(self) -> None:
+        bits = 0
+        for term_id in self._ids:
+            bits |= 1 << term_id
+        self._bits = bits
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, (TermList, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+    def to_list(self) -> List[str]:
+        return list(self)
+
+
+class TermLists(MutableMapping):
+    """Mapping of category name to TermList; assigned lists are converted on the way in."""
+    __slots__ = ("lexicon", "_lists")
+
+    def __init__(self, lexicon: Lexicon, data: Optional[Mapping] = None):
+        self.lexicon = lexicon
+        self._lists: Dict[str, TermList] = {}
+        for key, terms in (data or {}).items():
+            self[key] = terms
+
+    def __getitem__(self, key: str) -> TermList:
+        return self._lists[key]
+
+    def __setitem__(self, key: str, terms: Iterable[str]) -> None:
+        if isinstance(terms, (str, bytes)) or not isinstance(terms, Iterable):
+            raise TypeError(f"{key} must be a list of strings")
+        self._lists[sys.intern(key)] = terms if isinstance(terms, TermList) and terms.lexicon is self.lexicon \
+            else TermList(self.lexicon, terms)
+
+    def __delitem__(self, key: str) -> None:
+        del self._lists[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._lists)
+
+    def __len__(self) -> int:
+        return len(self._lists)
+
+    def __repr__(self) -> str:
+        return repr(self.to_dict())
+
+    def to_dict(self) -> Dict[str, List[str]]:
+        return {key: terms.to_list() for key, terms in self._lists.items()}
+
+
+# Distinct test records shared across sessions, bounded so arbitrary stored records cannot grow it forever
+_TEST_RECORDS: Dict[Any, Mapping] = {}
+_TEST_RECORDS_MAX = 4096
+
+
+def _freeze(value: Any) -> Any:
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return MappingProxyType({sys.intern(k) if isinstance(k, str) else k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+def _thaw(value: Any) -> Any:
+    if isinstance(value, tuple):
+        return [_thaw(item) for item in value]
+    if isinstance(value, Mapping):
+        return {key: _thaw(item) for key, item in value.items()}
+    return value
+
+
+def _record_key(value: Any) -> Any:
+    if isinstance(value, Mapping):
+        return ("m",) + tuple((key, _record_key(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return ("l",) + tuple(_record_key(item) for item in value)
+    return value
+
+
+def intern_test(record: Mapping) -> Mapping:
+    """A shared read-only copy of a test record; findings lists become tuples."""
+    if not isinstance(record, Mapping):
+        raise TypeError("Test records must be mappings")
+    try:
+        key = _record_key(record)
+        shared = _TEST_RECORDS.get(key)
+    except TypeError:
+        # Unhashable values: keep a private frozen copy
+        return _freeze(dict(record))
+    if shared is None:
+        shared = _freeze(dict(record))
+        if len(_TEST_RECORDS) < _TEST_RECORDS_MAX:
+            _TEST_RECORDS[key] = shared
+    return shared
+
+
+class TestResults(MutableMapping):
+    """Mapping of test key to a shared read-only test record."""
+    __slots__ = ("_records",)
+
+    def __init__(self, data: Optional[Mapping] = None):
+        self._records: Dict[str, Mapping] = {}
+        for key, record in (data or {}).items():
+            self[key] = record
+
+    def __getitem__(self, key: str) -> Mapping:
+        return self._records[key]
+
+    def __setitem__(self, key: str, record: Mapping) -> None:
+        self._records[sys.intern(key)] = intern_test(record)
+
+    def __delitem__(self, key: str) -> None:
+        del self._records[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._records)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __repr__(self) -> str:
+        return repr(self.to_dict())
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {key: _thaw(record) for key, record in self._records.items()}
+
+
+ROLES = ("user", "assistant", "system")
+_ROLE_CODES = {role: code for code, role in enumerate(ROLES)}
+# Role code of messages stored as given, with their own dict
+_RAW = 255
+
+
+class ChatHistory(MutableSequence):
+    """
+    Chat messages as a role code per message plus the message content.
+
+    Messages are read and written as {"role", "content"} dicts. Messages of
+    any other shape are kept as given.
+    """
+    __slots__ = ("_roles", "_contents")
+
+    def __init__(self, messages: Iterable[Mapping] = ()):
+        self._roles = roles = bytearray()
+        self._contents: List[Any] = []
+        contents = self._contents
+        role_codes, intern = _ROLE_CODES, sys.intern
+        for message in messages:
+            # Inlined _encode for the common {"role", "content"} dict
+            if type(message) is dict and len(message) == 2:
+                code = role_codes.get(message.get("role"))
+                content = message.get("content")
+                if code is not None and type(content) is str:
+                    roles.append(code)
+                    contents.append(content if code == 0 else intern(content))
+                    continue
+            code, content = self._encode(message)
+            roles.append(code)
+            contents.append(content)
+
+    @staticmethod
+    def _encode(message: Mapping):
+        if type(message) is not dict and not isinstance(message, Mapping):
+            raise TypeError("Chat messages must be mappings")
+        if len(message) == 2:
+            code = _ROLE_CODES.get(message.get("role"))
+            content = message.get("content")
+            if code is not None and type(content) is str:
+                # User messages are rarely repeated; assistant responses mostly are
+                return code, content if code == 0 else sys.intern(content)
+        return _RAW, dict(message)
+
+    def _decode(self, index: int) -> Dict[str, Any]:
+        code = self._roles[index]
+        if code == _RAW:
+            return dict(self._contents[index])
+        return {"role": ROLES[code], "content": self._contents[index]}
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._decode(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("chat history index out of range")
+        return self._decode(index)
+
+    def __setitem__(self, index, message) -> None:
+        if isinstance(index, slice):
+            encoded = [self._encode(m) for m in message]
+            self._roles[index] = bytes(code for code, _ in encoded)
+            self._contents[index] = [content for _, content in encoded]
+        else:
+            self._roles[index], self._contents[index] = self._encode(message)
+
+    def __delitem__(self, index) -> None:
+        del self._roles[index]
+        del self._contents[index]
+
+    def __len__(self) -> int:
+        return len(self._contents)
+
+    def insert(self, index: int, message: Mapping) -> None:
+        code, content = self._encode(message)
+        self._roles.insert(index, code)
+        self._contents.insert(index, content)
+
+    def append(self, message: Mapping) -> None:
+        code, content = self._encode(message)
+        self._roles.append(code)
+        self._contents.append(content)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, (ChatHistory, list)):
+            return self.to_list() == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return repr(self.to_list())
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        if _RAW not in self._roles:
+            return [{"role": ROLES[code], "content": content} for code, content in zip(self._roles, self._contents)]
+        return [
+            {"role": ROLES[code], "content": content} if code != _RAW else dict(content)
+            for code, content in zip(self._roles, self._contents)
+        ]
@@ -0,0 +1,159 @@
+"""
+Idempotency keys for /chat.
+
+Clients may send an idempotency key with a chat turn. The first request
+stores its response in the idempotency_keys table, committed together with
+the turn itself; a retry with the same key gets the stored response back
+without re-running the conversation engine or writing anything. Recent
+records are also kept in a bounded in-process LRU so that retry storms are
+answered without a database round trip.
+"""
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, NamedTuple, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+
+from app.models import IdempotencyKey
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+
+
+class IdempotencyConflictError(Exception):
+    """Raised when an idempotency key is reused for a different request"""
+    pass
+
+
+class StoredResponse(NamedTuple):
+    request_hash: str
+    response: Dict[str, Any]
+    created_at: datetime
+
+
+class IdempotencyCache:
+    """Thread-safe bounded LRU of stored responses keyed by (email, key)."""
+    def __init__(self, max_size: int = IDEMPOTENCY_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[tuple, StoredResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, email: str, key: str) -> Optional[StoredResponse]:
+        with self._lock:
+            entry = self._entries.get((email, key))
+            if entry is not None:
+                self._entries.move_to_end((email, key))
+            return entry
+
+    def put(self, email: str, key: str, entry: StoredResponse) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[(email, key)] = entry
+            self._entries.move_to_end((email, key))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, email: str, key: str) -> None:
+        with self._lock:
+            self._entries.pop((email, key), None)
+
+    def discard_sessions(self, session_ids) -> None:
+        """Drop cached responses that belong to any of `session_ids`."""
+        session_ids = set(session_ids)
+        with self._lock:
+            for cache_key in [
+                cache_key for cache_key, entry in self._entries.items()
+                if entry.response.get("session_id") in session_ids
+            ]:
+                del self._entries[cache_key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+cache = IdempotencyCache()
+
+
+def request_hash(session_id: Optional[str], message: str) -> str:
+    """Fingerprint of the request a key was first used for."""
+    return hashlib.sha256(f"{session_id or ''}\n{message}".encode("utf-8")).hexdigest()
+
+
+def _expired(created_at: datetime) -> bool:
+    return created_at < datetime.utcnow() - timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+
+
+def lookup(db: Session, email: str, key: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+    """
+    Return the stored response for (email, key), or None if the key is new.
+
+    An expired record is deleted in the caller's transaction so the key can
+    be stored again. Raises IdempotencyConflictError if the key was used for
+    a different request.
+    """
+    entry = cache.get(email, key)
+    if entry is None:
+        record = db.get(IdempotencyKey, (email, key))
+        if record is None:
+            return None
+        entry = StoredResponse(record.request_hash, record.response, record.created_at)
+        if _expired(entry.created_at):
+            db.delete(record)
+            db.flush()
+            return None
+        cache.put(email, key, entry)
+    elif _expired(entry.created_at):
+        cache.discard(email, key)
+        return lookup(db, email, key, fingerprint)
+
+    if entry.request_hash != fingerprint:
+        raise IdempotencyConflictError("Idempotency key was already used for a different request")
+    return entry.response
+
+
+def new_entry(fingerprint: str, response: Dict[str, Any]) -> StoredResponse:
+    return StoredResponse(fingerprint, response, datetime.utcnow())
+
+
+def record(db: Session, email: str, key: str, session_id: str, entry: StoredResponse) -> None:
+    """
+    Add a response for (email, key) to the caller's transaction.
+
+    Call remember() once the transaction has committed.
+    """
+    db.add(IdempotencyKey(
+        email=email,
+        key=key,
+        request_hash=entry.request_hash,
+        session_id=session_id,
+        response=entry.response,
+        created_at=entry.created_at
+    ))
+
+
+def journal_record(email: str, key: str, session_id: str, entry: StoredResponse) -> Dict[str, Any]:
+    """The same record as JSON, for the write-behind journal."""
+    return {
+        "email": email,
+        "key": key,
+        "request_hash": entry.request_hash,
+        "session_id": session_id,
+        "response": entry.response,
+        "created_at": entry.created_at.isoformat(),
+    }
+
+
+def remember(email: str, key: str, entry: StoredResponse) -> None:
+    """Cache a committed response."""
+    cache.put(email, key, entry)
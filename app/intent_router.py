@@ -0,0 +1,241 @@
+"""
+Intent classification for the initial conversation stage.
+
+Messages are classified in two steps:
+
+1. A trie over whole tokens finds the exact INTENT_PHRASES, so "hi" matches
+   "hi there" but not "this", and "hey" does not match "they".
+2. Messages with no exact phrase are scored by a small linear model over
+   hashed word, word-pair and character-trigram features. It catches
+   paraphrases ("hiya", "what's multiple sclerosis?", "can you assist me")
+   and only answers above `min_confidence`, otherwise the message has no
+   intent and is parsed as demographics.
+
+The model is trained with NumPy from TRAINING_EXAMPLES the first time it is
+needed (tens of milliseconds); classify_batch scores many messages with one
+scatter-add over the weight matrix.
+"""
+import zlib
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from app.message_parsing import ParsedMessage
+from app.vocabulary import INTENT_PHRASES
+
+GREETING = "greeting"
+MS_QUESTION = "ms_question"
+HELP = "help"
+INTENTS: Tuple[str, ...] = tuple(INTENT_PHRASES)
+
+# Label of messages without an intent; the model's last class
+NO_INTENT = "none"
+
+FEATURE_BITS = 12
+
+# Labelled examples for the fallback model; the exact phrases are added to them
+TRAINING_EXAMPLES: Dict[str, List[str]] = {
+    GREETING: [
+        "hiya", "hii", "heya", "howdy", "yo", "hello there", "hi there", "hey there",
+        "good day", "morning", "evening", "hallo", "helo", "hullo", "greetings to you",
+        "hey, how are you", "hi, how are you doing", "nice to meet you", "good morning to you",
+        "hello again", "hi again", "sup", "hola", "hey you",
+    ],
+    MS_QUESTION: [
+        "what's ms", "whats ms", "what is ms exactly", "what exactly is multiple sclerosis",
+        "what's multiple sclerosis", "can you explain multiple sclerosis", "explain multiple sclerosis",
+        "tell me about multiple sclerosis", "what does ms mean", "what does multiple sclerosis do",
+        "how does ms work", "what causes ms", "what causes multiple sclerosis", "is ms curable",
+        "define multiple sclerosis", "i want to know about ms", "info on multiple sclerosis",
+        "what is m.s.", "describe ms", "what happens in ms",
+    ],
+    HELP: [
+        "can you assist me", "i need assistance", "assist me please", "i need some support",
+        "what do you do", "how do you work", "what are you able to do", "how can you assist",
+        "i don't know where to start", "where do i start", "what should i do first",
+        "what are your features", "how does this work", "how do i use this", "can you support me",
+        "i need advice", "helpp", "pls assist", "what can i ask you", "how can you be useful",
+    ],
+    NO_INTENT: [
+        "35 male", "42, female", "i am 28 and a woman", "age 51, man", "i'm 62 years old",
+        "female, 45", "i'm a 30 year old man", "non-binary, 27", "i am 35 years old and female",
+        "i feel tired all the time", "my hands are numb", "this is my first time here",
+        "they told me i might have it", "i have blurry vision", "my legs are weak",
+        "i had an mri which showed lesions", "my blood test was normal", "i am taking copaxone",
+        "i eat a mediterranean diet", "i go to the gym", "yes", "no", "ok", "thanks",
+        "i keep forgetting things", "pins and needles in my feet", "i feel depressed",
+        "my doctor thinks it could be something else", "i was diagnosed last year",
+        "nothing much to report today", "my mother has it", "sometimes i feel dizzy",
+        "the weather is cold", "whatever", "i walk every day", "this morning i felt numb",
+        "i do yoga", "i do some stretching", "i do a lot of walking", "i work as a nurse",
+        "i use a cane", "i can't sleep", "i do not smoke", "my work is stressful",
+    ],
+}
+
+
+def _bucket(feature: str) -> int:
+    return zlib.crc32(feature.encode("utf-8")) & ((1 << FEATURE_BITS) - 1)
+
+
+@lru_cache(maxsize=65536)
+def _token_features(token: str) -> Tuple[int, ...]:
+    padded = f"<{token}>"
+    return (_bucket("w:" + token),) + tuple(
+        _bucket("c:" + padded[i:i + 3]) for i in range(len(padded) - 2)
+    )
+
+
+def features(tokens: Sequence[str]) -> List[int]:
+    """Distinct hashed feature indexes of a token sequence: words, word pairs and character trigrams."""
+    indexes: List[int] = []
+    for i, token in enumerate(tokens):
+        indexes.extend(_token_features(token))
+        if i:
+            indexes.append(_bucket(f"b:{tokens[i - 1]} {token}"))
+    return list(dict.fromkeys(indexes))
+
+
+class PhraseTrie:
+    """Trie over token sequences mapping exact phrases to intents."""
+    _END = None
+
+    def __init__(self, phrases: Dict[str, List[str]]):
+        self.root: Dict = {}
+        for intent, intent_phrases in phrases.items():
+            for phrase in intent_phrases:
+                node = self.root
+                for token in phrase.split():
+                    node = node.setdefault(token, {})
+                node.setdefault(self._END, intent)
+        self.priority = {intent: index for index, intent in enumerate(phrases)}
+
+    def match(self, tokens: Sequence[str]) -> Optional[str]:
+        """Highest-priority intent of any phrase occurring in `tokens`."""
+        best = None
+        for start in range(len(tokens)):
+            node = self.root
+            for token in tokens[start:]:
+                node = node.get(token)
+                if node is None:
+                    break
+                intent = node.get(self._END)
+                if intent is not None and (best is None or self.priority[intent] < self.priority[best]):
+                    best = intent
+                    if self.priority[best] == 0:
+                        return best
+        return best
+
+
+class IntentRouter:
+    """Classifies initial-stage messages into one of INTENTS, or None."""
+    def __init__(self, phrases: Dict[str, List[str]] = INTENT_PHRASES,
+                 examples: Dict[str, List[str]] = TRAINING_EXAMPLES,
+                 min_confidence: float = 0.6):
+        self.trie = PhraseTrie(phrases)
+        self.phrases = phrases
+        self.labels = list(phrases) + [NO_INTENT]
+        self.examples = examples
+        self.min_confidence = min_confidence
+        self._weights: Optional[np.ndarray] = None
+        self._bias: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    def _tokens(self, message: Union[str, ParsedMessage]) -> List[str]:
+        return [token.text for token in ParsedMessage.of(message).tokens]
+
+    def _train(self, iterations: int = 500, learning_rate: float = 1.0, l2: float = 1e-4) -> None:
+        """Fit the multinomial logistic regression on the examples and exact phrases."""
+        samples: List[Tuple[List[int], int]] = []
+        for label, messages in self.examples.items():
+            for message in list(messages) + list(self.phrases.get(label, [])):
+                samples.append((features(self._tokens(message)), self.labels.index(label)))
+
+        # Train on the feature columns that occur, then scatter into the full weight matrix
+        columns = sorted({index for indexes, _ in samples for index in indexes})
+        position = {column: i for i, column in enumerate(columns)}
+        x = np.zeros((len(samples), len(columns)), dtype=np.float32)
+        for row, (indexes, _) in enumerate(samples):
+            x[row, [position[index] for index in indexes]] = 1.0
+        x /= np.sqrt(np.maximum(x.sum(axis=1, keepdims=True), 1.0))
+        y = np.zeros((len(samples), len(self.labels)), dtype=np.float32)
+        y[np.arange(len(samples)), [label for _, label in samples]] = 1.0
+
+        w = np.zeros((len(columns), len(self.labels)), dtype=np.float32)
+        b = np.zeros(len(self.labels), dtype=np.float32)
+        for _ in range(iterations):
+            p = _softmax(x @ w + b)
+            gradient = (p - y) / len(samples)
+            w -= learning_rate * (x.T @ gradient + l2 * w)
+            b -= learning_rate * gradient.sum(axis=0)
+
+        weights = np.zeros((1 << FEATURE_BITS, len(self.labels)), dtype=np.float32)
+        weights[columns] = w
+        self._weights, self._bias = weights, b
+
+    def _model(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._weights is None:
+            with self._lock:
+                if self._weights is None:
+                    self._train()
+        return self._weights, self._bias
+
+    def _scores(self, feature_lists: List[List[int]]) -> np.ndarray:
+        """Class probabilities of each feature list, as one (messages, classes) array."""
+        weights, bias = self._model()
+        lengths = np.fromiter((len(indexes) for indexes in feature_lists), dtype=np.intp, count=len(feature_lists))
+        rows = np.repeat(np.arange(len(feature_lists)), lengths)
+        columns = np.fromiter((index for indexes in feature_lists for index in indexes),
+                              dtype=np.intp, count=len(rows))
+        scores = np.zeros((len(feature_lists), len(self.labels)), dtype=np.float32)
+        np.add.at(scores, rows, weights[columns])
+        # Binary features, L2-normalized per message as in training
+        return _softmax(scores / np.sqrt(np.maximum(lengths, 1))[:, None] + bias)
+
+    def _decide(self, probabilities: np.ndarray) -> Optional[str]:
+        best = int(probabilities.argmax())
+        label = self.labels[best]
+        if label == NO_INTENT or probabilities[best] < self.min_confidence:
+            return None
+        return label
+
+    def classify(self, message: Union[str, ParsedMessage]) -> Optional[str]:
+        """The intent of one message, or None."""
+        tokens = self._tokens(message)
+        intent = self.trie.match(tokens)
+        if intent is not None or not tokens:
+            return intent
+        # A single message skips the scatter-add of the batch path
+        weights, bias = self._model()
+        indexes = features(tokens)
+        scores = weights[indexes].sum(axis=0) / np.sqrt(len(indexes)) + bias
+        return self._decide(_softmax(scores))
+
+    def classify_batch(self, messages: Sequence[Union[str, ParsedMessage]]) -> List[Optional[str]]:
+        """The intents of many messages; model scoring is one vectorized pass over the misses."""
+        results: List[Optional[str]] = [None] * len(messages)
+        pending: List[int] = []
+        feature_lists: List[List[int]] = []
+        for i, message in enumerate(messages):
+            tokens = self._tokens(message)
+            results[i] = self.trie.match(tokens)
+            if results[i] is None and tokens:
+                pending.append(i)
+                feature_lists.append(features(tokens))
+        if pending:
+            for i, probabilities in zip(pending, self._scores(feature_lists)):
+                results[i] = self._decide(probabilities)
+        return results
+
+
+def _softmax(scores: np.ndarray) -> np.ndarray:
+    exp = np.exp(scores - scores.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+router = IntentRouter()
+
+
+def classify(message: Union[str, ParsedMessage]) -> Optional[str]:
+    return router.classify(message)
@@ -0,0 +1,89 @@
+"""
+Single-pass preprocessing of a user message.
+
+A ParsedMessage is built once per turn and handed to every MSHealthAI
+parser and stage handler, so the message is lowercased, tokenized and
+scanned for numbers once rather than by each parser in turn. Keyword
+checks keep the parsers' substring semantics and run against `text`; the
+token and number views carry character offsets into `text` for parsers
+that need positions.
+"""
+import re
+from typing import Iterable, NamedTuple, Optional, Tuple, Union
+
+TOKEN_PATTERN = re.compile(r"\w+(?:'\w+)*")
+NUMBER_PATTERN = re.compile(r"(\d+\.?\d*)")
+
+# Tried in order; the first match with a plausible age wins
+AGE_PATTERNS = tuple(re.compile(pattern) for pattern in (
+    r'\b(\d{1,2})\b',  # Any 1-2 digit number
+    r'i am (\d+)', r'i\'m (\d+)', r'age (\d+)',
+    r'(\d+) years', r'(\d+) year', r'(\d+) y/o',
+    r'(\d+) years old', r'(\d+) year old'
+))
+
+
+class Token(NamedTuple):
+    text: str
+    start: int
+    end: int
+
+
+class Number(NamedTuple):
+    value: float
+    start: int
+    end: int
+
+
+class ParsedMessage:
+    """
+    A user message preprocessed once: normalized text, tokens and numbers.
+    The token and number views are computed on first use and then kept, so
+    parsers that only match keywords pay for the lowercasing alone.
+    """
+    __slots__ = ("raw", "text", "_tokens", "_numbers")
+
+    def __init__(self, raw: str):
+        self.raw = raw
+        self.text = raw.lower()
+        self._tokens: Optional[Tuple[Token, ...]] = None
+        self._numbers: Optional[Tuple[Number, ...]] = None
+
+    @property
+    def tokens(self) -> Tuple[Token, ...]:
+        if self._tokens is None:
+            self._tokens = tuple(
+                Token(match.group(), match.start(), match.end()) for match in TOKEN_PATTERN.finditer(self.text)
+            )
+        return self._tokens
+
+    @property
+    def numbers(self) -> Tuple[Number, ...]:
+        if self._numbers is None:
+            self._numbers = tuple(
+                Number(float(match.group(1)), match.start(), match.end())
+                for match in NUMBER_PATTERN.finditer(self.text)
+            )
+        return self._numbers
+
+    @classmethod
+    def of(cls, message: Union[str, "ParsedMessage"]) -> "ParsedMessage":
+        """`message` itself if already parsed, else a new ParsedMessage of it."""
+        return message if isinstance(message, cls) else cls(message)
+
+    def contains_any(self, terms: Iterable[str]) -> bool:
+        """Whether any of the lowercase `terms` occurs in the text."""
+        text = self.text
+        for term in terms:
+            if term in text:
+                return True
+        return False
+
+    def first_number(self) -> Optional[float]:
+        return self.numbers[0].value if self.numbers else None
+
+    def __str__(self) -> str:
+        return self.raw
+
+    def __repr__(self) -> str:
+        return f"ParsedMessage({self.raw!r})"
@@ -0,0 +1,166 @@
+"""
+In-process metrics for the database connection pools and session state updates.
+
+Each engine's pool is an InstrumentedQueuePool that times every checkout.
+The time covers waiting for a free connection plus connecting or pinging it.
+Pool events count connects, invalidations and timeouts and track overflow
+usage. Snapshots are served by GET /metrics/db_pool.
+
+Optimistic session state updates count version conflicts, retries and
+turns that gave up; see GET /metrics/state_updates.
+"""
+import time
+import bisect
+import threading
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+# Upper bounds (ms) of the checkout time histogram buckets; the last bucket is unbounded
+CHECKOUT_BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000]
+
+
+class PoolMetrics:
+    """Thread-safe counters and a checkout time histogram for one pool."""
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.checkout_time_total = 0.0
+        self.checkout_time_max = 0.0
+        self.checkout_buckets = [0] * (len(CHECKOUT_BUCKETS_MS) + 1)
+        self.connects = 0
+        self.invalidations = 0
+        self.soft_invalidations = 0
+        self.ping_failures = 0
+        self.overflow_peak = 0
+
+    def observe_checkout(self, seconds: float) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_time_total += seconds
+            self.checkout_time_max = max(self.checkout_time_max, seconds)
+            self.checkout_buckets[bisect.bisect_left(CHECKOUT_BUCKETS_MS, seconds * 1000)] += 1
+
+    def increment(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def observe_overflow(self, overflow: int) -> None:
+        if overflow > self.overflow_peak:
+            with self._lock:
+                self.overflow_peak = max(self.overflow_peak, overflow)
+
+    def snapshot(self, pool: Optional[QueuePool] = None) -> Dict[str, Any]:
+        with self._lock:
+            data: Dict[str, Any] = {
+                "checkouts": self.checkouts,
+                "checkout_timeouts": self.checkout_timeouts,
+                "checkout_ms_mean": round(self.checkout_time_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "checkout_ms_max": round(self.checkout_time_max * 1000, 3),
+                "checkout_ms_buckets": {
+                    **{f"le_{bound}": count for bound, count in zip(CHECKOUT_BUCKETS_MS, self.checkout_buckets)},
+                    "inf": self.checkout_buckets[-1],
+                },
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "soft_invalidations": self.soft_invalidations,
+                "ping_failures": self.ping_failures,
+                "overflow_peak": self.overflow_peak,
+            }
+        if isinstance(pool, QueuePool):
+            data.update({
+                "pool_size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow": max(0, pool.overflow()),
+            })
+        return data
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout takes in `metrics`."""
+    metrics: Optional[PoolMetrics] = None
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            if self.metrics is not None:
+                self.metrics.increment("checkout_timeouts")
+            raise
+        if self.metrics is not None:
+            self.metrics.observe_checkout(time.perf_counter() - started)
+        return connection
+
+    def recreate(self) -> "InstrumentedQueuePool":
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+def instrument_engine(engine, name: str) -> PoolMetrics:
+    """Attach a PoolMetrics to an engine's pool and count its pool events."""
+    metrics = PoolMetrics(name)
+    engine.pool.metrics = metrics
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        metrics.increment("connects")
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        pool = engine.pool
+        if isinstance(pool, QueuePool):
+            metrics.observe_overflow(pool.overflow())
+
+    @event.listens_for(engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        metrics.increment("invalidations")
+
+    @event.listens_for(engine, "soft_invalidate")
+    def on_soft_invalidate(dbapi_connection, connection_record, exception):
+        metrics.increment("soft_invalidations")
+
+    registry.append((metrics, engine))
+    return metrics
+
+
+# (metrics, engine) for every instrumented engine
+registry: List[tuple] = []
+
+
+def pool_snapshot() -> Dict[str, Any]:
+    """Current metrics of every instrumented pool, by name."""
+    return {metrics.name: metrics.snapshot(engine.pool) for metrics, engine in registry}
+
+
+class StateUpdateMetrics:
+    """Outcomes of optimistic (version-checked) session state updates."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.updates = 0
+        self.conflicts = 0
+        self.retries = 0
+        self.failures = 0
+
+    def increment(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            attempts = self.updates + self.conflicts
+            return {
+                "updates": self.updates,
+                "conflicts": self.conflicts,
+                "retries": self.retries,
+                "failures": self.failures,
+                "conflict_rate": round(self.conflicts / attempts, 6) if attempts else 0.0,
+            }
+
+
+state_updates = StateUpdateMetrics()
@@ -1,12 +1,35 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, JSON, UniqueConstraint, Text
+from sqlalchemy import Column, Integer, BigInteger, String, Date, DateTime, ForeignKey, Boolean, JSON, UniqueConstraint, Text, Uuid, Index, LargeBinary
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.types import TypeDecorator
 from datetime import datetime
+from dotenv import load_dotenv
+import os
 import uuid
+from app.ownership import new_session_id
+
+load_dotenv()
+
+# Range-partition chat_messages by month on PostgreSQL (see app/partitions.py).
+# Only takes effect when the table is created.
+CHAT_MESSAGES_PARTITIONED = os.getenv("CHAT_MESSAGES_PARTITIONED", "False").lower() == "true"
 
 Base = declarative_base()
 
+class UUID(TypeDecorator):
+    """
+    UUID column stored natively on PostgreSQL and as CHAR(32) elsewhere (SQLite).
+    Session ids arrive as strings from the API, so they are coerced before binding.
+    """
+    impl = Uuid
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is not None and not isinstance(value, uuid.UUID):
+            value = uuid.UUID(str(value))
+        return value
+
 class User(Base):
     __tablename__ = "users"
     
@@ -22,26 +45,145 @@ class User(Base):
 class Session(Base):
     __tablename__ = "sessions"
     
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    email = Column(String, ForeignKey("users.email"))
+    # In cluster mode, new ids hash to the creating worker (see app/ownership.py)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=new_session_id)
+    email = Column(String, ForeignKey("users.email"), index=True)
     stage = Column(String, default="initial")
     analysis_complete = Column(Boolean, default=False)
-    ai_state = Column(JSON, default={})
+    ai_state = Column(JSON().with_variant(JSONB(), "postgresql"), default={})
     created_at = Column(DateTime, default=datetime.utcnow)
-    last_updated = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    last_updated = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     title = Column(String, default="New MS Consultation")
+    # Incremented by every ai_state update; updates compare-and-swap on it
+    version = Column(Integer, nullable=False, default=0, server_default="0")
     
     user = relationship("User", back_populates="sessions")
     messages = relationship("ChatMessage", back_populates="session", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Serves containment/jsonpath queries over ai_state (e.g. sessions with a given symptom)
+        Index(
+            "ix_sessions_ai_state_gin", "ai_state",
+            postgresql_using="gin", postgresql_ops={"ai_state": "jsonb_path_ops"}
+        ).ddl_if(dialect="postgresql"),
+    )
+
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    session_id = Column(UUID(as_uuid=True), ForeignKey("sessions.id"))
+    session_id = Column(UUID(as_uuid=True), ForeignKey("sessions.id"), index=True)
     message = Column(Text)
+    # Inline response of messages stored before chat_responses; new messages reference it by hash
     response = Column(Text)
+    response_hash = Column(LargeBinary, ForeignKey("chat_responses.hash"), index=True)
     stage = Column(String)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    # A partitioned table's primary key must include the partition key
+    timestamp = Column(DateTime, default=datetime.utcnow, primary_key=CHAT_MESSAGES_PARTITIONED)
     
-    session = relationship("Session", back_populates="messages")
\ No newline at end of file
+    session = relationship("Session", back_populates="messages")
+
+    __table_args__ = (
+        {"postgresql_partition_by": "RANGE (timestamp)"} if CHAT_MESSAGES_PARTITIONED else {}
+    )
+
+class ChatResponse(Base):
+    """An assistant response stored once and referenced by every chat message that sent it (see app/response_store.py)"""
+    __tablename__ = "chat_responses"
+
+    hash = Column(LargeBinary, primary_key=True)
+    # The response as text, or compressed in `data` with `codec`
+    text = Column(Text)
+    data = Column(LargeBinary)
+    codec = Column(String)
+
+class SessionReport(Base):
+    """A session's report, materialized when its analysis completes (see app/reports.py)"""
+    __tablename__ = "session_reports"
+
+    session_id = Column(UUID(as_uuid=True), ForeignKey("sessions.id"), primary_key=True)
+    # The session version whose turn produced the report
+    version = Column(Integer, nullable=False)
+    etag = Column(String, nullable=False)
+    body = Column(LargeBinary, nullable=False)
+    body_gzip = Column(LargeBinary, nullable=False)
+    body_br = Column(LargeBinary)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class ChatMessageArchive(Base):
+    """A chat_messages partition moved out of the database into a compressed file"""
+    __tablename__ = "chat_message_archives"
+
+    partition = Column(String, primary_key=True)
+    range_start = Column(DateTime)
+    range_end = Column(DateTime)
+    path = Column(String)
+    format = Column(String)
+    row_count = Column(Integer)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+class ChatMessageArchiveSession(Base):
+    """Where one session's messages are in an archive file"""
+    __tablename__ = "chat_message_archive_sessions"
+
+    session_id = Column(UUID(as_uuid=True), primary_key=True)
+    partition = Column(String, ForeignKey("chat_message_archives.partition"), primary_key=True)
+    # Byte range of the session's gzip member in a JSONL archive; unused for Parquet
+    byte_offset = Column(BigInteger)
+    byte_length = Column(BigInteger)
+
+class IdempotencyKey(Base):
+    """Stored /chat response for a client-supplied idempotency key, replayed on retries"""
+    __tablename__ = "idempotency_keys"
+
+    email = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    request_hash = Column(String)
+    session_id = Column(UUID(as_uuid=True), index=True)
+    response = Column(JSON().with_variant(JSONB(), "postgresql"))
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class AnalyticsCounter(Base):
+    """Per-day count of an analytics event, e.g. sessions entering a stage or reporting a symptom"""
+    __tablename__ = "analytics_counters"
+
+    day = Column(Date, primary_key=True)
+    metric = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
+
+class AnalyticsSketch(Base):
+    """Per-day HyperLogLog registers estimating the distinct users of an analytics event"""
+    __tablename__ = "analytics_sketches"
+
+    day = Column(Date, primary_key=True)
+    metric = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    registers = Column(LargeBinary, nullable=False)
+
+class Observation(Base):
+    """A symptom, test, finding or treatment first extracted from one of a user's sessions, appended per turn"""
+    __tablename__ = "observations"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    email = Column(String, nullable=False)
+    session_id = Column(UUID(as_uuid=True), index=True)
+    observed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    kind = Column(String, nullable=False)
+    key = Column(String, nullable=False)
+
+    __table_args__ = (
+        # Timeline range queries read one user's rows in time order
+        Index("ix_observations_email_observed_at", "email", "observed_at"),
+    )
+
+class ObservationRollup(Base):
+    """Count of a user's observations of one term per day, week (from Monday) or month"""
+    __tablename__ = "observation_rollups"
+
+    email = Column(String, primary_key=True)
+    resolution = Column(String, primary_key=True)
+    period_start = Column(Date, primary_key=True)
+    kind = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
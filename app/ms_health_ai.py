@@ -1,38 +1,94 @@
-from typing import Dict, List, Optional, Any, Union
+from typing import Callable, Dict, List, NamedTuple, Optional, Any, Tuple, Union
 from datetime import datetime
+import os
+import sys
+import time
+import uuid
+import random
 import logging
-from pydantic import EmailStr, BaseModel
-from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from dataclasses import dataclass, fields
+from pydantic import EmailStr
+from sqlalchemy import inspect, select
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
 from app.models import Session as DBSession, ChatMessage, User
+from app.message_parsing import AGE_PATTERNS, ParsedMessage
+from app.compact_state import (
+    SYMPTOM_LEXICON, TREATMENT_LEXICON, LIFESTYLE_LEXICON, ChatHistory, TermLists, TestResults
+)
+from app.profiling import profiled
+from app import analytics, cohort_index, intent_router, metrics, pattern_scoring, reports, state_store, timeline, write_behind
+from app.session_state import StaleStateError, save_session_state
+from app.state_codec import STATE_SCHEMA_VERSION, state_defaults, migrate_state, dumps, loads
+from app.vocabulary import (
+    SYMPTOM_KEYWORDS, GENDER_KEYWORDS, MRI_TERMS, BLOOD_TEST_TERMS, LESION_TERMS,
+    NORMAL_TERMS, MS_MEDICATIONS, GENERIC_TREATMENT_TERMS, LIFESTYLE_KEYWORDS
+)
+
+load_dotenv()
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class ConversationState(BaseModel):
-    """Model for conversation state"""
+# Times a turn is redone after losing a concurrent update of its session
+STATE_UPDATE_RETRIES = int(os.getenv("STATE_UPDATE_RETRIES", "3"))
+# Upper bound (seconds) of the random delay before the first retry; doubles per retry
+STATE_UPDATE_BACKOFF = float(os.getenv("STATE_UPDATE_BACKOFF", "0.005"))
+
+@dataclass(slots=True, eq=False)
+class ConversationState:
+    """
+    Conversation state of one session
+    
+    Symptoms, treatments, lifestyle details, diagnostic tests and chat history
+    are held in the compact containers of app.compact_state, which keep the
+    dict/list interfaces of the stored format. Plain dicts and lists passed
+    in are converted; to_dict produces the stored (and API) format.
+    """
     stage: str
     demographics: Dict[str, Any]
-    symptoms: Dict[str, List[str]]
-    diagnostic_tests: Dict[str, Dict[str, Any]]
-    treatments: Dict[str, List[str]]
-    lifestyle: Dict[str, List[str]]
-    chat_history: List[Dict[str, str]]
+    symptoms: TermLists
+    diagnostic_tests: TestResults
+    treatments: TermLists
+    lifestyle: TermLists
+    chat_history: ChatHistory
     title: str
     analysis_complete: bool = False
-    analysis: Optional[Dict[str, Any]] = None
-    recommendations: Optional[Dict[str, Any]] = None
+    analysis: Optional[Union[str, Dict[str, Any]]] = None
+    recommendations: Optional[Union[str, Dict[str, Any]]] = None
+
+    def __post_init__(self):
+        if not isinstance(self.stage, str) or not isinstance(self.title, str):
+            raise TypeError("stage and title must be strings")
+        if not isinstance(self.demographics, dict):
+            raise TypeError("demographics must be a dict")
+        self.stage = sys.intern(self.stage)
+        self.analysis_complete = bool(self.analysis_complete)
+        if not isinstance(self.symptoms, TermLists):
+            self.symptoms = TermLists(SYMPTOM_LEXICON, self.symptoms)
+        if not isinstance(self.diagnostic_tests, TestResults):
+            self.diagnostic_tests = TestResults(self.diagnostic_tests)
+        if not isinstance(self.treatments, TermLists):
+            self.treatments = TermLists(TREATMENT_LEXICON, self.treatments)
+        if not isinstance(self.lifestyle, TermLists):
+            self.lifestyle = TermLists(LIFESTYLE_LEXICON, self.lifestyle)
+        if not isinstance(self.chat_history, ChatHistory):
+            self.chat_history = ChatHistory(self.chat_history)
 
     def to_dict(self) -> Dict[str, Any]:
         """Convert state to dictionary for database storage"""
         return {
+            "schema_version": STATE_SCHEMA_VERSION,
             "stage": self.stage,
-            "demographics": self.demographics,
-            "symptoms": self.symptoms,
-            "diagnostic_tests": self.diagnostic_tests,
-            "treatments": self.treatments,
-            "lifestyle": self.lifestyle,
-            "chat_history": self.chat_history,
+            "demographics": dict(self.demographics),
+            "symptoms": self.symptoms.to_dict(),
+            "diagnostic_tests": self.diagnostic_tests.to_dict(),
+            "treatments": self.treatments.to_dict(),
+            "lifestyle": self.lifestyle.to_dict(),
+            "chat_history": self.chat_history.to_list(),
             "title": self.title,
             "analysis_complete": self.analysis_complete,
             "analysis": self.analysis or {},
@@ -40,26 +96,34 @@ class ConversationState(BaseModel):
         }
 
     @classmethod
-    def from_dict(cls, data: Dict[str, Any]) -> 'ConversationState':
-        """Create state from dictionary"""
-        # Ensure all required fields are present
-        required_fields = {
-            "stage": "initial",
-            "demographics": {},
-            "symptoms": {},
-            "diagnostic_tests": {},
-            "treatments": {},
-            "lifestyle": {},
-            "chat_history": [],
-            "title": "New MS Consultation",
-            "analysis_complete": False,
-            "analysis": {},
-            "recommendations": {}
-        }
+    def from_dict(cls, data: Dict[str, Any], fresh: bool = False) -> 'ConversationState':
+        """
+        Create state from dictionary
         
-        # Update with provided data
-        state_data = {**required_fields, **data}
-        return cls(**state_data)
+        The state is built from copies of `data`'s contents, so mutating it
+        never alters the caller's dict (e.g. a loaded Session.ai_state);
+        `fresh` only spares copying the demographics and analysis values of
+        a just-decoded blob. Older blobs are migrated first.
+        """
+        if data.get("schema_version") != STATE_SCHEMA_VERSION:
+            data = migrate_state(dict(data))
+        if not fresh:
+            data = {**data, **loads(dumps({key: data[key] for key in _COPIED_FIELDS if key in data}))}
+        state_data = {**state_defaults(), **data}
+        return cls(**{name: state_data[name] for name in _STATE_FIELDS})
+
+_STATE_FIELDS = tuple(field.name for field in fields(ConversationState))
+# Fields kept as given rather than converted into compact containers
+_COPIED_FIELDS = ("demographics", "analysis", "recommendations")
+
+class TurnResult(NamedTuple):
+    """Outcome of one processed message"""
+    response: str
+    stage: str
+    analysis_complete: bool
+
+# Write-behind persistence of processed turns (see MSHealthAI.process_messages)
+Journal = Callable[[Dict[str, Any], int, List[TurnResult], List[Dict[str, Any]], bool], None]
 
 class MSHealthAIError(Exception):
     """Base exception for MS Health AI errors"""
@@ -73,6 +137,10 @@ class StateError(MSHealthAIError):
     """Raised when there's an issue with conversation state"""
     pass
 
+class ConcurrentUpdateError(StateError):
+    """Raised when concurrent updates of a session kept conflicting"""
+    pass
+
 class InvalidStateError(MSHealthAIError):
     """Raised when the conversation state is invalid"""
     pass
@@ -81,23 +149,89 @@ class ParsingError(MSHealthAIError):
     """Raised when there's an error parsing user input"""
     pass
 
+def _indexed_parts(state: ConversationState) -> Dict[str, Any]:
+    """The parts of a state cohort_index.state_terms reads."""
+    return {"symptoms": state.symptoms, "diagnostic_tests": state.diagnostic_tests, "treatments": state.treatments}
+
 class StateManager:
-    """Manages conversation state persistence in database"""
+    """Manages conversation state persistence in database, fronted by the configured state store"""
     def __init__(self, db: Session):
         self.db = db
 
-    def get_session_state(self, session_id: str) -> Optional[Dict[str, Any]]:
-        """Get session state from database"""
+    def load_session(self, session_id: str) -> Tuple[Optional[DBSession], Optional[Dict[str, Any]]]:
+        """
+        Load a session row and its state document.
+        
+        When the state store holds the session's current document, the
+        ai_state column is not loaded from the database at all.
+        """
+        store = state_store.store
+        cached = store.get(session_id) if store is not None else None
+        if cached is not None:
+            session = self._attach_cached(session_id, cached)
+            if session is not None:
+                return session, cached.state
         session = self.db.query(DBSession).filter(DBSession.id == session_id).first()
         if not session:
+            return None, None
+        state = session.ai_state
+        if store is not None and state:
+            store.put(session_id, session.version or 0, state)
+        return session, state
+
+    def _attach_cached(self, session_id: str, cached: state_store.StoredState) -> Optional[DBSession]:
+        """
+        The session as a persistent object holding `cached`'s state (also the
+        base that save_session_state diffs against), if the row is still at
+        the entry's version. A session this database session already loaded is
+        reused as is; otherwise only the version column is read and the other
+        columns load on first access.
+        """
+        try:
+            key = uuid.UUID(str(session_id))
+        except ValueError:
+            return None
+        session = self.db.identity_map.get(identity_key(DBSession, key))
+        if session is not None:
+            # Already loaded by this database session (the endpoints load it with ai_state deferred)
+            if "ai_state" not in inspect(session).unloaded or (session.version or 0) != cached.version:
+                return None
+            set_committed_value(session, "ai_state", cached.state)
+            return session
+        row = self.db.execute(select(DBSession.version).where(DBSession.id == key)).first()
+        if row is None or (row.version or 0) != cached.version:
             return None
-        return session.ai_state
+        session = DBSession(id=key, version=row.version, ai_state=cached.state)
+        make_transient_to_detached(session)
+        self.db.add(session)
+        return session
+
+    def save_session_state(self, session: DBSession, state: Dict[str, Any],
+                           expected_version: Optional[int] = None, **values: Any) -> int:
+        """
+        Write a session's state and column `values` if the session is still at
+        `expected_version` (default: the loaded version); the store is updated
+        once the caller commits. Returns the new version.
+        """
+        values.setdefault("last_updated", datetime.utcnow())
+        version = save_session_state(self.db, session, state, expected_version, **values)
+        state_store.publish_after_commit(self.db, str(session.id), version, state)
+        cohort_index.index_after_commit(self.db, str(session.id), state)
+        return version
+
+    def get_session_state(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Get session state from the state store or database"""
+        return self.load_session(session_id)[1]
 
     def update_session_state(self, session_id: str, state: Dict[str, Any]) -> None:
         """Update session state in database"""
-        session = self.db.query(DBSession).filter(DBSession.id == session_id).first()
+        session, _ = self.load_session(session_id)
         if session:
-            session.ai_state = state
+            version = self.save_session_state(session, state)
+            if state.get("analysis_complete"):
+                reports.save(self.db, session_id, version, state)
+            else:
+                reports.delete_sessions(self.db, [session.id])
             self.db.commit()
 
 class MSHealthAI:
@@ -113,6 +247,8 @@ class MSHealthAI:
             self.db = db
             self.knowledge_base: Dict[str, Any] = self._load_knowledge_base()
             self.conversation_state: Dict[str, ConversationState] = {}
+            # Session version each conversation_state entry was loaded at
+            self.state_versions: Dict[str, int] = {}
             self.state_manager = StateManager(db)
         except Exception as e:
             logger.error(f"Error initializing MSHealthAI: {str(e)}")
@@ -397,6 +533,7 @@ class MSHealthAI:
             logger.error(f"Error loading knowledge base: {str(e)}")
             raise MSHealthAIError("Failed to load knowledge base")
     
+    @profiled
     def process_message(self, session_id: str, message: str, email: EmailStr) -> str:
         """
         Process a user message and generate a response.
@@ -414,61 +551,122 @@ class MSHealthAI:
             StateError: If there's an issue with conversation state
             MSHealthAIError: For other AI-related errors
         """
+        return self.process_messages(session_id, [message], email)[0].response
+
+    @profiled
+    def process_messages(self, session_id: str, messages: List[str], email: EmailStr,
+                         commit: bool = True, save: bool = True,
+                         journal: Optional[Journal] = None) -> List[TurnResult]:
+        """
+        Process several user messages for one session, in order.
+        
+        The session is loaded once and its state is written back with a
+        single UPDATE after the last message. The UPDATE only succeeds if
+        the session is still at the version its state was loaded at; when a
+        concurrent request got there first, the transaction is rolled back
+        and the messages are processed again from the new state, up to
+        STATE_UPDATE_RETRIES times.
+        
+        Args:
+            session_id: Unique identifier for the conversation session
+            messages: User's messages, oldest first
+            email: User's email address
+            commit: Commit the session update; pass False to leave it to the caller
+            save: Write the updated state to the session row; pass False when the
+                caller persists self.conversation_state itself
+            journal: Persist the new state instead of the session UPDATE (write-behind);
+                called with the state dict, its new version, the turn results,
+                the new timeline observations and whether the turns changed the
+                session's report, and may raise StaleStateError to have the turns
+                retried
+            
+        Returns:
+            List[TurnResult]: AI's response and the resulting stage for each message
+            
+        Raises:
+            ValidationError: If required parameters are missing or invalid
+            StateError: If there's an issue with conversation state
+            ConcurrentUpdateError: If every retry conflicted with another update
+            MSHealthAIError: For other AI-related errors
+        """
         try:
             # Validate input parameters
             if not session_id or not isinstance(session_id, str):
                 raise ValidationError("Invalid session ID")
-            if not message or not isinstance(message, str):
+            if not messages or not all(message and isinstance(message, str) for message in messages):
                 raise ValidationError("Invalid message")
             if not email or not isinstance(email, str):
                 raise ValidationError("Invalid email")
 
-            # Get or create session
-            session = self.db.query(DBSession).filter(DBSession.id == session_id).first()
-            if not session:
-                # Create new user if needed
-                user = self.db.query(User).filter(User.email == email).first()
-                print(user)
-                if not user:
-                    user = User(email=email)
-                    self.db.add(user)
-                    self.db.commit()
-                
-                # Create new session
-                session = DBSession(
-                    id=session_id,
-                    email=email,
-                    stage="initial",
-                    analysis_complete=False,
-                    ai_state={}
-                )
-                self.db.add(session)
+            for attempt in range(STATE_UPDATE_RETRIES + 1):
+                try:
+                    results = self._process_turns(session_id, messages, email, commit, save, journal)
+                    if save or journal is not None:
+                        metrics.state_updates.increment("updates")
+                    return results
+                except StaleStateError as e:
+                    # Another request updated the session first: reload its state and redo the turns
+                    metrics.state_updates.increment("conflicts")
+                    self.db.rollback()
+                    self.conversation_state.pop(session_id, None)
+                    if attempt == STATE_UPDATE_RETRIES:
+                        metrics.state_updates.increment("failures")
+                        raise ConcurrentUpdateError(f"Gave up after {attempt + 1} conflicting updates: {str(e)}")
+                    metrics.state_updates.increment("retries")
+                    time.sleep(random.uniform(0, STATE_UPDATE_BACKOFF * 2 ** attempt))
+            
+        except ValidationError as e:
+            logger.error(f"Validation error: {str(e)}")
+            raise
+        except StateError as e:
+            logger.error(f"State error: {str(e)}")
+            raise
+        except write_behind.QueueFullError:
+            raise
+        except Exception as e:
+            logger.error(f"Error processing message: {str(e)}")
+            raise MSHealthAIError(f"Failed to process message: {str(e)}")
+
+    def _process_turns(self, session_id: str, messages: List[str], email: EmailStr, commit: bool, save: bool,
+                       journal: Optional[Journal]) -> List[TurnResult]:
+        """One attempt at process_messages; raises StaleStateError if the session changed meanwhile."""
+        # Get or create session
+        session, stored_state = self.state_manager.load_session(session_id)
+        if not session:
+            # Create new user if needed
+            user = self.db.query(User).filter(User.email == email).first()
+            print(user)
+            if not user:
+                user = User(email=email)
+                self.db.add(user)
                 self.db.commit()
+            
+            # Create new session
+            session = DBSession(
+                id=session_id,
+                email=email,
+                stage="initial",
+                analysis_complete=False,
+                ai_state={}
+            )
+            self.db.add(session)
+            self.db.commit()
 
-            # Initialize or get conversation state
-            if session_id not in self.conversation_state:
-                # Try to load existing state from database
-                if session.ai_state:
-                    try:
-                        self.conversation_state[session_id] = ConversationState.from_dict(session.ai_state)
-                    except Exception as e:
-                        logger.error(f"Error loading state from database: {str(e)}")
-                        # If loading fails, create new state
-                        self.conversation_state[session_id] = ConversationState(
-                            stage="initial",
-                            demographics={},
-                            symptoms={},
-                            diagnostic_tests={},
-                            treatments={},
-                            lifestyle={},
-                            chat_history=[],
-                            title="New MS Consultation",
-                            analysis_complete=False,
-                            analysis={},
-                            recommendations={}
-                        )
-                else:
-                    # Create new state
+        # Initialize or get conversation state
+        if session_id not in self.conversation_state:
+            # Try to load existing state, preferring turns not yet written behind
+            pending = write_behind.pending_entry(session_id)
+            if pending is not None:
+                stored_state = pending[0]
+                self.state_versions[session_id] = pending[1] if pending[1] is not None else session.version or 0
+            else:
+                self.state_versions[session_id] = session.version or 0
+            if stored_state:
+                try:
+                    self.conversation_state[session_id] = ConversationState.from_dict(stored_state)
+                except Exception as e:
+                    logger.error(f"Error loading state from database: {str(e)}")
+                    # If loading fails, create new state
                     self.conversation_state[session_id] = ConversationState(
                         stage="initial",
                         demographics={},
@@ -482,41 +680,81 @@ class MSHealthAI:
                         analysis={},
                         recommendations={}
                     )
+            else:
+                # Create new state
+                self.conversation_state[session_id] = ConversationState(
+                    stage="initial",
+                    demographics={},
+                    symptoms={},
+                    diagnostic_tests={},
+                    treatments={},
+                    lifestyle={},
+                    chat_history=[],
+                    title="New MS Consultation",
+                    analysis_complete=False,
+                    analysis={},
+                    recommendations={}
+                )
 
-            state = self.conversation_state[session_id]
-            
+        state = self.conversation_state[session_id]
+        
+        # For analytics: stages entered and terms extracted by these turns
+        stages_entered = [] if state.chat_history else [state.stage]
+        terms_before = cohort_index.state_terms(_indexed_parts(state))
+        report_before = (state.analysis, state.recommendations)
+        results: List[TurnResult] = []
+        for message in messages:
             # Add message to chat history
             state.chat_history.append({"role": "user", "content": message})
             
             # Process message and get response
+            stage = state.stage
             response = self._get_stage_response(state, message)
             state.chat_history.append({"role": "assistant", "content": response})
-            
+            results.append(TurnResult(response, state.stage, state.analysis_complete))
+            stages_entered += analytics.stages_entered(stage, state.stage)
+        events = analytics.TurnEvents(
+            email, len(messages), stages_entered, cohort_index.state_terms(_indexed_parts(state)) - terms_before
+        )
+        
+        now = datetime.utcnow()
+        observations = timeline.observations(email, session_id, events.terms, now)
+        # The report is materialized with the turn that completes (or changes) the analysis
+        report_changed = state.analysis_complete and (state.analysis, state.recommendations) != report_before
+        
+        # The version the state was loaded at, which the update must still find
+        expected_version = self.state_versions.get(session_id, session.version or 0)
+        if journal is not None:
+            state_dict = state.to_dict()
+            journal(state_dict, expected_version + 1, results, observations, report_changed)
+            self.state_versions[session_id] = expected_version + 1
+            cohort_index.index_state(session_id, state_dict)
+            analytics.record(events)
+        elif save:
             # Convert state to dict for database storage
             state_dict = state.to_dict()
             
-            # Update session in database
-            session.stage = state.stage
-            session.analysis_complete = state.analysis_complete
-            session.ai_state = state_dict
-            session.last_updated = datetime.utcnow()
-            self.db.commit()
-            
-            return response
-            
-        except ValidationError as e:
-            logger.error(f"Validation error: {str(e)}")
-            raise
-        except StateError as e:
-            logger.error(f"State error: {str(e)}")
-            raise
-        except Exception as e:
-            logger.error(f"Error processing message: {str(e)}")
-            raise MSHealthAIError(f"Failed to process message: {str(e)}")
+            # Update session in database, writing only the changed parts of ai_state
+            self.state_versions[session_id] = self.state_manager.save_session_state(
+                session, state_dict, expected_version,
+                stage=state.stage,
+                analysis_complete=state.analysis_complete,
+                last_updated=now
+            )
+            timeline.append(self.db, observations)
+            if report_changed:
+                reports.save(self.db, session_id, self.state_versions[session_id], state_dict)
+            analytics.record_after_commit(self.db, events)
+            if commit:
+                self.db.commit()
+        
+        return results
 
-    def _get_stage_response(self, state: ConversationState, message: str) -> str:
+    def _get_stage_response(self, state: ConversationState, message: Union[str, ParsedMessage]) -> str:
         """Get the appropriate response based on the current stage."""
         current_stage = state.stage
+        # Preprocessed once here and shared by the stage handlers and parsers
+        message = ParsedMessage.of(message)
         
         if current_stage == "initial":
             return self._handle_initial_stage(state, message)
@@ -561,17 +799,16 @@ class MSHealthAI:
         
         state["title"] = title
 
-    def _handle_initial_stage(self, state: ConversationState, message: str) -> str:
+    def _handle_initial_stage(self, state: ConversationState, message: ParsedMessage) -> str:
         """Handle the initial stage of the conversation."""
-        message = message.lower().strip()
-        
         # Check if this is a follow-up question about previous analysis
         if state.analysis_complete:
             return self._handle_analysis_stage(state, message)
         
+        intent = intent_router.classify(message)
+        
         # Handle greetings and casual conversation
-        greetings = ["hi", "hello", "hey", "greetings", "good morning", "good afternoon", "good evening"]
-        if any(greeting in message for greeting in greetings):
+        if intent == intent_router.GREETING:
             # Check if we have previous conversation
             if state.chat_history:
                 return "Hello again! How can I help you today? Would you like to continue our previous discussion or start a new assessment?"
@@ -580,20 +817,18 @@ class MSHealthAI:
             return "Hello! I'm your MS Health Assistant. I'm here to help you understand and manage your condition better. To get started, could you tell me your age and gender?"
         
         # Handle questions about MS
-        ms_questions = ["what is ms", "what is multiple sclerosis", "tell me about ms", "explain ms"]
-        if any(q in message for q in ms_questions):
+        if intent == intent_router.MS_QUESTION:
             return "Multiple Sclerosis (MS) is a chronic disease affecting the central nervous system. It occurs when the immune system attacks the protective covering of nerve fibers, causing communication problems between the brain and the rest of the body. Would you like to start an assessment to better understand your specific situation?"
         
         # Handle requests for help or guidance
-        help_requests = ["help", "guide", "what can you do", "how can you help"]
-        if any(req in message for req in help_requests):
+        if intent == intent_router.HELP:
             return "I can help you in several ways:\n1. Assess your symptoms and provide personalized insights\n2. Track your condition over time\n3. Provide information about treatments and lifestyle management\n4. Answer your questions about MS\n\nWould you like to start with an assessment? If so, please share your age and gender."
         
         # If it's not a greeting or specific question, move to demographics and try to parse
         state.stage = "demographics"
         return self._handle_demographics_stage(state, message)
 
-    def _handle_demographics_stage(self, state: ConversationState, message: str) -> str:
+    def _handle_demographics_stage(self, state: ConversationState, message: ParsedMessage) -> str:
         """Handle the demographics stage of the conversation."""
         try:
             # Check if we already have demographics
@@ -631,11 +866,11 @@ class MSHealthAI:
             logger.error(f"Error in demographics stage: {str(e)}")
             return "I'm having trouble understanding. Could you please provide your age and gender? For example: 'I am 35 years old and male'."
 
-    def _handle_symptoms_stage(self, state: ConversationState, message: str) -> str:
+    def _handle_symptoms_stage(self, state: ConversationState, message: ParsedMessage) -> str:
         """Handle the symptoms stage of the conversation."""
         try:
             # Check if user is asking about previous symptoms
-            if "what symptoms" in message.lower() or "what did i say" in message.lower():
+            if "what symptoms" in message.text or "what did i say" in message.text:
                 if state.symptoms:
                     response = "Here are the symptoms you've mentioned so far:\n"
                     for category in ["physical", "cognitive", "emotional"]:
@@ -658,22 +893,21 @@ class MSHealthAI:
                         state.symptoms[category] = []
                     # Add only new symptoms
                     for symptom in symptom_list:
-                        if symptom not in state.symptoms[category]:
-                            state.symptoms[category].append(symptom)
+                        state.symptoms[category].add(symptom)
             
             # Generate response based on symptoms mentioned
             response = "Thank you for sharing these symptoms. "
             
             # Add specific responses for common symptoms
-            if "fatigue" in message.lower() or "tired" in message.lower():
+            if "fatigue" in message.text or "tired" in message.text:
                 response += "I understand you're experiencing significant fatigue. This is a common symptom in MS that can be quite debilitating. "
-            if "numb" in message.lower() or "tingling" in message.lower():
+            if "numb" in message.text or "tingling" in message.text:
                 response += "The numbness and tingling sensations you're experiencing could be related to nerve damage. "
-            if "forgetful" in message.lower() or "memory" in message.lower():
+            if "forgetful" in message.text or "memory" in message.text:
                 response += "The cognitive changes you're noticing, including forgetfulness, are also common in MS. "
-            if "blurry" in message.lower() or "vision" in message.lower():
+            if "blurry" in message.text or "vision" in message.text:
                 response += "Even mild vision changes can be significant. "
-            if "mood" in message.lower() or "depressed" in message.lower() or "blah" in message.lower():
+            if "mood" in message.text or "depressed" in message.text or "blah" in message.text:
                 response += "The mood changes you're experiencing could be related to both the physical symptoms and the impact of MS on your life. "
             
             # Check if we have enough symptom information
@@ -706,11 +940,11 @@ class MSHealthAI:
             logger.error(f"Error in symptoms stage: {str(e)}")
             return "I'm having trouble understanding your symptoms. Could you please describe them in more detail? For example: 'I experience fatigue and numbness in my hands'."
 
-    def _handle_diagnostic_tests_stage(self, state: ConversationState, message: str) -> str:
+    def _handle_diagnostic_tests_stage(self, state: ConversationState, message: ParsedMessage) -> str:
         """Handle the diagnostic tests stage of the conversation."""
         try:
             # Check if user is asking about previous tests
-            if "what tests" in message.lower() or "what did i say" in message.lower():
+            if "what tests" in message.text or "what did i say" in message.text:
                 if state.diagnostic_tests:
                     response = "Here are the tests you've mentioned so far:\n"
                     for test_name, test_info in state.diagnostic_tests.items():
@@ -733,7 +967,7 @@ class MSHealthAI:
             has_tests = len(state.diagnostic_tests) > 0 and "none" not in state.diagnostic_tests
             
             if not has_tests:
-                if "no" in message.lower() or "none" in message.lower():
+                if "no" in message.text or "none" in message.text:
                     # User hasn't had tests
                     state.diagnostic_tests["none"] = {"name": "No tests performed", "findings": []}
                     state.stage = "treatments"
@@ -771,11 +1005,11 @@ class MSHealthAI:
             logger.error(f"Error in diagnostic tests stage: {str(e)}")
             return "I'm having trouble understanding the test information. Could you please provide more details about any tests you've had, or say 'none' if you haven't had any tests?"
 
-    def _handle_treatments_stage(self, state: ConversationState, message: str) -> str:
+    def _handle_treatments_stage(self, state: ConversationState, message: ParsedMessage) -> str:
         """Handle the treatments stage of the conversation."""
         try:
             # Check if user is asking about previous treatments
-            if "what treatments" in message.lower() or "what medications" in message.lower():
+            if "what treatments" in message.text or "what medications" in message.text:
                 if state.treatments:
                     response = "Here are the treatments you've mentioned so far:\n"
                     if state.treatments.get("current"):
@@ -799,25 +1033,23 @@ class MSHealthAI:
                 if "current" not in state.treatments:
                     state.treatments["current"] = []
                 for treatment in treatments["current"]:
-                    if treatment not in state.treatments["current"]:
-                        state.treatments["current"].append(treatment)
+                    state.treatments["current"].add(treatment)
             
             if treatments.get("past"):
                 if "past" not in state.treatments:
                     state.treatments["past"] = []
                 for treatment in treatments["past"]:
-                    if treatment not in state.treatments["past"]:
-                        state.treatments["past"].append(treatment)
+                    state.treatments["past"].add(treatment)
             
             # Check if we have treatment information
             has_treatments = (state.treatments.get("current") and len(state.treatments["current"]) > 0) or \
-                           "no" in message.lower() or "none" in message.lower()
+                           "no" in message.text or "none" in message.text
             
             if not has_treatments:
                 return "Could you tell me what medications you're currently taking for MS or your symptoms? If you're not taking any, please say 'none'."
             
             # If no treatments, record that
-            if "no" in message.lower() or "none" in message.lower():
+            if "no" in message.text or "none" in message.text:
                 state.treatments["current"] = ["None"]
             
             # Move to lifestyle stage
@@ -837,11 +1069,11 @@ class MSHealthAI:
             logger.error(f"Error in treatments stage: {str(e)}")
             return "I'm having trouble understanding your treatment information. Could you please tell me about any medications you're taking, or say 'none' if you're not taking any?"
 
-    def _handle_lifestyle_stage(self, state: ConversationState, message: str) -> str:
+    def _handle_lifestyle_stage(self, state: ConversationState, message: ParsedMessage) -> str:
         """Handle the lifestyle stage of the conversation."""
         try:
             # Check if user is asking about previous lifestyle information
-            if "what lifestyle" in message.lower() or "what did i say" in message.lower():
+            if "what lifestyle" in message.text or "what did i say" in message.text:
                 if state.lifestyle:
                     response = "Here's what you've told me about your lifestyle:\n"
                     for category, details in state.lifestyle.items():
@@ -862,8 +1094,7 @@ class MSHealthAI:
                 if category not in state.lifestyle:
                     state.lifestyle[category] = []
                 for detail in details:
-                    if detail not in state.lifestyle[category]:
-                        state.lifestyle[category].append(detail)
+                    state.lifestyle[category].add(detail)
             
             # Check if we have lifestyle information
             has_lifestyle = len(state.lifestyle) > 0 and "general" not in state.lifestyle
@@ -893,7 +1124,7 @@ class MSHealthAI:
             logger.error(f"Error in lifestyle stage: {str(e)}")
             return "I'm having trouble understanding your lifestyle information. Could you please provide more details about your diet, exercise, and stress management?"
 
-    def _handle_analysis_stage(self, state: ConversationState, message: str) -> str:
+    def _handle_analysis_stage(self, state: ConversationState, message: ParsedMessage) -> str:
         """Handle the analysis stage of the conversation."""
         if not state.analysis:
             state.analysis = self._generate_analysis(state)
@@ -922,13 +1153,12 @@ class MSHealthAI:
         # Try to get state from memory first
         if session_id in self.conversation_state:
             return self.conversation_state[session_id].to_dict()
+        pending = write_behind.pending_state(session_id)
+        if pending:
+            return pending
             
-        # If not in memory, try to get from database
-        session = self.db.query(DBSession).filter(DBSession.id == session_id).first()
-        if session and session.ai_state:
-            return session.ai_state
-            
-        return None
+        # If not in memory, try the state store, then the database
+        return self.state_manager.get_session_state(session_id) or None
 
     def clear_session(self, session_id: str) -> None:
         """
@@ -951,9 +1181,12 @@ class MSHealthAI:
         session = self.db.query(DBSession).filter(DBSession.id == session_id).first()
         if session:
             session.ai_state = {}
+            session.version = (session.version or 0) + 1
             session.stage = "initial"
             session.analysis_complete = False
             session.last_updated = datetime.utcnow()
+            cohort_index.index_after_commit(self.db, session_id, session.ai_state)
+            reports.delete_sessions(self.db, [session.id])
             self.db.commit()
 
     def _validate_state(self, state: ConversationState) -> None:
@@ -978,19 +1211,19 @@ class MSHealthAI:
         if not isinstance(state.demographics, dict):
             raise StateError("Invalid demographics")
             
-        if not isinstance(state.symptoms, dict):
+        if not isinstance(state.symptoms, TermLists):
             raise StateError("Invalid symptoms")
             
-        if not isinstance(state.diagnostic_tests, dict):
+        if not isinstance(state.diagnostic_tests, TestResults):
             raise StateError("Invalid diagnostic tests")
             
-        if not isinstance(state.treatments, dict):
+        if not isinstance(state.treatments, TermLists):
             raise StateError("Invalid treatments")
             
-        if not isinstance(state.lifestyle, dict):
+        if not isinstance(state.lifestyle, TermLists):
             raise StateError("Invalid lifestyle")
             
-        if not isinstance(state.chat_history, list):
+        if not isinstance(state.chat_history, ChatHistory):
             raise StateError("Invalid chat history")
             
         if not isinstance(state.title, str):
@@ -1020,27 +1253,19 @@ class MSHealthAI:
             session.stage = state.stage
             session.analysis_complete = state.analysis_complete
             session.ai_state = state.to_dict()
+            session.version = (session.version or 0) + 1
             session.last_updated = datetime.utcnow()
+            cohort_index.index_after_commit(self.db, session_id, session.ai_state)
             self.db.commit()
 
-    def _parse_demographics(self, message: str) -> Dict:
+    def _parse_demographics(self, message: Union[str, ParsedMessage]) -> Dict:
         try:
             demographics = {}
-            message = message.lower().strip()
+            message = ParsedMessage.of(message)
             
             # Extract age - more flexible patterns
-            import re
-            
-            # Try different age patterns
-            age_patterns = [
-                r'\b(\d{1,2})\b',  # Any 1-2 digit number
-                r'i am (\d+)', r'i\'m (\d+)', r'age (\d+)',
-                r'(\d+) years', r'(\d+) year', r'(\d+) y/o',
-                r'(\d+) years old', r'(\d+) year old'
-            ]
-            
-            for pattern in age_patterns:
-                match = re.search(pattern, message)
+            for pattern in AGE_PATTERNS:
+                match = pattern.search(message.text)
                 if match:
                     age = int(match.group(1))
                     if 1 <= age <= 120:  # Reasonable age range
@@ -1048,102 +1273,57 @@ class MSHealthAI:
                         break
             
             # Extract gender - more flexible matching
-            if any(word in message for word in ["male", "man", "boy", "m"]):
-                demographics["gender"] = "male"
-            elif any(word in message for word in ["female", "woman", "girl", "f"]):
-                demographics["gender"] = "female"
-            elif any(word in message for word in ["non-binary", "nonbinary", "other", "nb"]):
-                demographics["gender"] = "non-binary"
+            for gender, keywords in GENDER_KEYWORDS.items():
+                if message.contains_any(keywords):
+                    demographics["gender"] = gender
+                    break
             
             return demographics
         except Exception as e:
             logger.error(f"Error parsing demographics: {str(e)}")
             return {}
 
-    def _parse_symptoms(self, message: str) -> Dict:
+    def _parse_symptoms(self, message: Union[str, ParsedMessage]) -> Dict:
         try:
             symptoms = {"physical": [], "cognitive": [], "emotional": []}
-            message = message.lower()
-            
-            # Check physical symptoms
-            physical_keywords = {
-                "fatigue": ["fatigue", "tired", "exhausted", "energy", "wiped out"],
-                "numbness": ["numbness", "numb", "tingling", "pins and needles"],
-                "muscle weakness": ["weakness", "weak", "muscle", "strength"],
-                "vision problems": ["vision", "sight", "eye", "blurry", "blurred"],
-                "balance problems": ["balance", "unsteady", "dizzy", "vertigo"],
-                "pain": ["pain", "ache", "hurt", "sore"],
-                "walking difficulties": ["walking", "walk", "mobility", "gait"],
-                "coordination problems": ["coordination", "clumsy", "uncoordinated"],
-                "tremors": ["tremor", "shaking", "trembling"],
-                "spasticity": ["spasticity", "stiff", "rigid", "tight"],
-                "bladder problems": ["bladder", "urination", "incontinence"],
-                "bowel problems": ["bowel", "constipation", "diarrhea"],
-                "sexual dysfunction": ["sexual", "libido", "erection", "orgasm"]
-            }
+            message = ParsedMessage.of(message)
             
-            for symptom, keywords in physical_keywords.items():
-                if any(keyword in message for keyword in keywords):
-                    symptoms["physical"].append(symptom)
-            
-            # Check cognitive symptoms
-            cognitive_keywords = {
-                "memory problems": ["memory", "forget", "remember", "recall"],
-                "difficulty concentrating": ["concentration", "focus", "attention", "distracted"],
-                "brain fog": ["fog", "cloudy", "confused", "fuzzy"],
-                "information processing": ["processing", "slow", "thinking", "thought"],
-                "executive function": ["planning", "organization", "decision", "judgment"],
-                "visual-spatial problems": ["spatial", "depth", "distance", "judge"]
-            }
-            
-            for symptom, keywords in cognitive_keywords.items():
-                if any(keyword in message for keyword in keywords):
-                    symptoms["cognitive"].append(symptom)
-            
-            # Check emotional symptoms
-            emotional_keywords = {
-                "depression": ["depression", "depressed", "sad", "down", "low"],
-                "anxiety": ["anxiety", "anxious", "worry", "nervous", "stress"],
-                "mood swings": ["mood", "irritable", "emotional", "moody"],
-                "emotional lability": ["lability", "emotional", "mood changes"],
-                "stress": ["stress", "stressed", "overwhelmed"],
-                "irritability": ["irritable", "irritated", "angry", "frustrated"]
-            }
-            
-            for symptom, keywords in emotional_keywords.items():
-                if any(keyword in message for keyword in keywords):
-                    symptoms["emotional"].append(symptom)
+            # Check physical, cognitive and emotional symptoms
+            for category, category_keywords in SYMPTOM_KEYWORDS.items():
+                for symptom, keywords in category_keywords.items():
+                    if message.contains_any(keywords):
+                        symptoms[category].append(symptom)
             
             return symptoms
         except Exception as e:
             logger.error(f"Error parsing symptoms: {str(e)}")
             return {"physical": [], "cognitive": [], "emotional": []}
 
-    def _parse_diagnostic_tests(self, message: str) -> Dict:
+    def _parse_diagnostic_tests(self, message: Union[str, ParsedMessage]) -> Dict:
         try:
             tests = {}
-            message = message.lower()
+            message = ParsedMessage.of(message)
             
             # Check for MRI
-            if "mri" in message:
+            if message.contains_any(MRI_TERMS):
                 tests["mri"] = {
                     "name": "Magnetic Resonance Imaging (MRI)",
                     "findings": []
                 }
-                if "lesion" in message:
+                if message.contains_any(LESION_TERMS):
                     tests["mri"]["findings"].append("Lesions detected")
-                elif "normal" in message:
+                elif message.contains_any(NORMAL_TERMS):
                     tests["mri"]["findings"].append("Normal")
                 else:
                     tests["mri"]["findings"].append("Results mentioned")
             
             # Check for blood tests
-            if any(term in message for term in ["blood test", "blood work", "blood"]):
+            if message.contains_any(BLOOD_TEST_TERMS):
                 tests["blood_tests"] = {
                     "name": "Blood Tests",
                     "findings": []
                 }
-                if "normal" in message:
+                if message.contains_any(NORMAL_TERMS):
                     tests["blood_tests"]["findings"].append("Normal")
                 else:
                     tests["blood_tests"]["findings"].append("Results mentioned")
@@ -1153,23 +1333,18 @@ class MSHealthAI:
             logger.error(f"Error parsing diagnostic tests: {str(e)}")
             return {}
 
-    def _parse_treatments(self, message: str) -> Dict:
+    def _parse_treatments(self, message: Union[str, ParsedMessage]) -> Dict:
         try:
             treatments = {"current": [], "past": []}
-            message = message.lower()
+            message = ParsedMessage.of(message)
             
             # Check for common MS medications
-            ms_medications = [
-                "interferon", "copaxone", "glatiramer", "tecfidera", "dimethyl fumarate",
-                "gilenya", "fingolimod", "tysabri", "natalizumab", "ocrevus", "ocrelizumab"
-            ]
-            
-            for med in ms_medications:
-                if med in message:
+            for med in MS_MEDICATIONS:
+                if med in message.text:
                     treatments["current"].append(med.title())
             
             # If no specific medications found but treatment mentioned
-            if not treatments["current"] and any(word in message for word in ["medication", "drug", "treatment", "taking"]):
+            if not treatments["current"] and message.contains_any(GENERIC_TREATMENT_TERMS):
                 treatments["current"].append("Unspecified medication")
             
             return treatments
@@ -1177,24 +1352,19 @@ class MSHealthAI:
             logger.error(f"Error parsing treatments: {str(e)}")
             return {"current": [], "past": []}
 
-    def _parse_lifestyle(self, message: str) -> Dict:
+    def _parse_lifestyle(self, message: Union[str, ParsedMessage]) -> Dict:
         try:
             lifestyle = {}
-            message = message.lower()
+            message = ParsedMessage.of(message)
             
-            # Diet keywords
-            diet_keywords = ["diet", "eat", "food", "nutrition"]
-            if any(keyword in message for keyword in diet_keywords):
+            # Diet, exercise and stress management keywords
+            if message.contains_any(LIFESTYLE_KEYWORDS["diet"]):
                 lifestyle["diet"] = ["Diet mentioned"]
             
-            # Exercise keywords
-            exercise_keywords = ["exercise", "workout", "gym", "walk", "run", "sport"]
-            if any(keyword in message for keyword in exercise_keywords):
+            if message.contains_any(LIFESTYLE_KEYWORDS["exercise"]):
                 lifestyle["exercise"] = ["Exercise mentioned"]
             
-            # Stress management keywords
-            stress_keywords = ["stress", "relax", "meditation", "yoga"]
-            if any(keyword in message for keyword in stress_keywords):
+            if message.contains_any(LIFESTYLE_KEYWORDS["stress_management"]):
                 lifestyle["stress_management"] = ["Stress management mentioned"]
             
             # If nothing specific mentioned, assume basic lifestyle
@@ -1206,31 +1376,39 @@ class MSHealthAI:
             logger.error(f"Error parsing lifestyle: {str(e)}")
             return {"general": ["Basic lifestyle"]}
 
-    def _generate_analysis(self, state: Dict) -> str:
+    def _generate_analysis(self, state: ConversationState) -> str:
         try:
             analysis = "Based on the information provided, here's my analysis:\n\n"
             
             # Demographics
-            if state["demographics"]:
+            if state.demographics:
                 analysis += "Patient Profile:\n"
-                if "age" in state["demographics"]:
-                    analysis += f"- Age: {state['demographics']['age']}\n"
-                if "gender" in state["demographics"]:
-                    analysis += f"- Gender: {state['demographics']['gender'].title()}\n"
+                if "age" in state.demographics:
+                    analysis += f"- Age: {state.demographics['age']}\n"
+                if "gender" in state.demographics:
+                    analysis += f"- Gender: {state.demographics['gender'].title()}\n"
                 analysis += "\n"
             
             # Symptoms
-            if state["symptoms"]:
+            if state.symptoms:
                 analysis += "Symptom Analysis:\n"
                 for category in ["physical", "cognitive", "emotional"]:
-                    if state["symptoms"].get(category):
-                        analysis += f"- {category.title()} symptoms: {', '.join(state['symptoms'][category])}\n"
+                    if state.symptoms.get(category):
+                        analysis += f"- {category.title()} symptoms: {', '.join(state.symptoms[category])}\n"
                 analysis += "\n"
+                
+                # Similarity to the typical symptom profiles of each MS course
+                matches = [match for match in pattern_scoring.scorer.rank(state.symptoms) if match.score > 0]
+                if matches:
+                    analysis += "Symptom Pattern Comparison:\n"
+                    for match in matches[:3]:
+                        analysis += f"- {match.name} ({match.score:.0%} similarity): {match.description}\n"
+                    analysis += "Only a neurologist can determine the course of MS; this compares your symptoms with typical presentations.\n\n"
             
             # Diagnostic tests
-            if state["diagnostic_tests"]:
+            if state.diagnostic_tests:
                 analysis += "Diagnostic Information:\n"
-                for test_name, test_info in state["diagnostic_tests"].items():
+                for test_name, test_info in state.diagnostic_tests.items():
                     if test_name != "none":
                         analysis += f"- {test_info['name']}: {', '.join(test_info.get('findings', ['Performed']))}\n"
                     else:
@@ -1238,13 +1416,13 @@ class MSHealthAI:
                 analysis += "\n"
             
             # Current treatments
-            if state["treatments"]:
+            if state.treatments:
                 analysis += "Treatment Status:\n"
-                if state["treatments"].get("current"):
-                    if "None" in state["treatments"]["current"]:
+                if state.treatments.get("current"):
+                    if "None" in state.treatments["current"]:
                         analysis += "- No current treatments\n"
                     else:
-                        analysis += f"- Current treatments: {', '.join(state['treatments']['current'])}\n"
+                        analysis += f"- Current treatments: {', '.join(state.treatments['current'])}\n"
                 analysis += "\n"
             
             return analysis
@@ -1252,7 +1430,7 @@ class MSHealthAI:
             logger.error(f"Error generating analysis: {str(e)}")
             return "Analysis could not be generated due to an error."
 
-    def _generate_recommendations(self, state: Dict) -> str:
+    def _generate_recommendations(self, state: ConversationState) -> str:
         try:
             recommendations = "\n"
             
@@ -1262,30 +1440,30 @@ class MSHealthAI:
             recommendations += "3. Consider joining an MS support group for emotional support\n"
             
             # Specific recommendations based on symptoms
-            if state["symptoms"]:
+            if state.symptoms:
                 recommendations += "\nSymptom-specific recommendations:\n"
                 
                 # Physical symptoms
-                if state["symptoms"].get("physical"):
+                if state.symptoms.get("physical"):
                     recommendations += "- For physical symptoms: Consider physical therapy and regular low-impact exercise\n"
                 
                 # Cognitive symptoms
-                if state["symptoms"].get("cognitive"):
+                if state.symptoms.get("cognitive"):
                     recommendations += "- For cognitive symptoms: Practice mental exercises and consider cognitive rehabilitation\n"
                 
                 # Emotional symptoms
-                if state["symptoms"].get("emotional"):
+                if state.symptoms.get("emotional"):
                     recommendations += "- For emotional symptoms: Consider counseling or therapy support\n"
             
             # Diagnostic recommendations
-            if not state["diagnostic_tests"] or "none" in state["diagnostic_tests"]:
+            if not state.diagnostic_tests or "none" in state.diagnostic_tests:
                 recommendations += "\nDiagnostic recommendations:\n"
                 recommendations += "- Consider getting an MRI scan to evaluate for MS lesions\n"
                 recommendations += "- Blood tests to rule out other conditions\n"
                 recommendations += "- Consultation with a neurologist for comprehensive evaluation\n"
             
             # Treatment recommendations
-            if not state["treatments"].get("current") or "None" in state["treatments"].get("current", []):
+            if not state.treatments.get("current") or "None" in state.treatments.get("current", []):
                 recommendations += "\nTreatment considerations:\n"
                 recommendations += "- Discuss disease-modifying therapies with your neurologist\n"
                 recommendations += "- Consider symptom management strategies\n"
@@ -1303,21 +1481,19 @@ class MSHealthAI:
             logger.error(f"Error generating recommendations: {str(e)}")
             return "Recommendations could not be generated due to an error."
 
-    def _parse_mycotoxin_tests(self, message: str) -> Dict:
+    def _parse_mycotoxin_tests(self, message: Union[str, ParsedMessage]) -> Dict:
         """Parse mycotoxin test results from user message."""
         try:
             tests = {}
-            message = message.lower()
+            message = ParsedMessage.of(message)
             
             # Check for each mycotoxin test
             for test_key, test_info in self.knowledge_base["mycotoxin_tests"].items():
                 test_name = test_info["name"].lower()
-                if test_name in message:
+                if test_name in message.text:
                     # Extract the value
-                    import re
-                    value_match = re.search(r'(\d+\.?\d*)', message)
-                    if value_match:
-                        value = float(value_match.group(1))
+                    value = message.first_number()
+                    if value is not None:
                         # Determine result category
                         if value < float(test_info["reference_ranges"]["not_present"].replace("<", "")):
                             result = "not_present"
@@ -1404,11 +1580,12 @@ class MSHealthAI:
             logger.error(f"Error analyzing mycotoxin results: {str(e)}")
             return "Error analyzing mycotoxin test results."
 
-    def _handle_mycotoxin_stage(self, state: Dict, message: str) -> str:
+    def _handle_mycotoxin_stage(self, state: Dict, message: Union[str, ParsedMessage]) -> str:
         """Handle the mycotoxin testing stage of the conversation."""
         try:
+            message = ParsedMessage.of(message)
             # Check if user is asking about previous test results
-            if "what tests" in message.lower() or "what results" in message.lower():
+            if "what tests" in message.text or "what results" in message.text:
                 if state.get("mycotoxin_tests"):
                     response = "Here are your mycotoxin test results:\n\n"
                     for test_name, test_info in state["mycotoxin_tests"].items():
@@ -0,0 +1,63 @@
+"""
+Which worker owns a session in cluster mode (see app/cluster.py).
+
+Session ids are placed on a consistent-hash ring over the workers. This
+module has no application imports, so models.py can use new_session_id as
+the primary key default without pulling in the cluster supervisor and router.
+"""
+import os
+import uuid
+import bisect
+import hashlib
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Set by the supervisor in each worker's environment
+CLUSTER_WORKERS = int(os.getenv("CLUSTER_WORKERS", "1"))
+CLUSTER_WORKER_INDEX = int(os.getenv("CLUSTER_WORKER_INDEX", "0"))
+
+
+class HashRing:
+    """Consistent-hash ring mapping keys to node indexes through virtual nodes."""
+    def __init__(self, nodes: int, replicas: int = 64):
+        points = sorted(
+            (self._hash(f"{node}:{replica}"), node)
+            for node in range(nodes)
+            for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def node_for(self, key: str) -> int:
+        index = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+def routing_key(session_id: str) -> str:
+    """Canonical form of a session id, so any spelling of a UUID routes the same way."""
+    try:
+        return str(uuid.UUID(str(session_id)))
+    except ValueError:
+        return str(session_id)
+
+
+_ring = HashRing(CLUSTER_WORKERS) if CLUSTER_WORKERS > 1 else None
+
+
+def new_session_id() -> uuid.UUID:
+    """A fresh session id owned by this worker (any uuid4 outside cluster mode)."""
+    while True:
+        session_id = uuid.uuid4()
+        if _ring is None or _ring.node_for(str(session_id)) == CLUSTER_WORKER_INDEX:
+            return session_id
+
+
+def owns(session_id: str) -> bool:
+    """Whether this worker owns a session (always outside cluster mode)."""
+    return _ring is None or _ring.node_for(routing_key(session_id)) == CLUSTER_WORKER_INDEX
@@ -0,0 +1,339 @@
+"""
+Monthly partitions of chat_messages and their archival (PostgreSQL).
+
+With CHAT_MESSAGES_PARTITIONED=true, chat_messages is created as a table
+range-partitioned by timestamp, with one partition per calendar month named
+chat_messages_yYYYYmMM. Partitions are created CHAT_PARTITION_MONTHS_AHEAD
+months in advance.
+
+Partitions older than CHAT_ARCHIVE_AFTER_MONTHS are written to compressed
+files in CHAT_ARCHIVE_DIR and then detached and dropped, which keeps the
+live table and its indexes bounded in size. A manifest table records each
+archive file, and for each session, where its messages are in that file.
+get_session_chats reads archived messages back transparently.
+
+Archives are gzipped JSONL by default. Each session's messages form a
+separate gzip member, so one session can be read with a single seek. The
+whole file is still an ordinary .jsonl.gz. With CHAT_ARCHIVE_FORMAT=parquet
+(requires pyarrow), archives are zstd-compressed Parquet sorted by session.
+"""
+import os
+import re
+import gzip
+import logging
+import threading
+import itertools
+import collections
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import insert, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app import response_store
+from app.models import CHAT_MESSAGES_PARTITIONED, ChatMessageArchive, ChatMessageArchiveSession
+from app.state_codec import dumps, loads
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CHAT_PARTITION_MONTHS_AHEAD = int(os.getenv("CHAT_PARTITION_MONTHS_AHEAD", "2"))
+# 0 disables archival
+CHAT_ARCHIVE_AFTER_MONTHS = int(os.getenv("CHAT_ARCHIVE_AFTER_MONTHS", "0"))
+CHAT_ARCHIVE_DIR = os.getenv("CHAT_ARCHIVE_DIR", "archive")
+CHAT_ARCHIVE_FORMAT = os.getenv("CHAT_ARCHIVE_FORMAT", "jsonl").lower()
+CHAT_PARTITION_MAINTENANCE_INTERVAL = float(os.getenv("CHAT_PARTITION_MAINTENANCE_INTERVAL", "86400"))
+
+PARENT_TABLE = "chat_messages"
+PARTITION_NAME = re.compile(r"^chat_messages_y(\d{4})m(\d{2})$")
+ARCHIVE_COLUMNS = ["id", "session_id", "message", "response", "stage", "timestamp"]
+
+ArchiveRow = collections.namedtuple("ArchiveRow", ARCHIVE_COLUMNS)
+
+# Archive files hold the response text: messages reference chat_responses, which outlives the partition
+_ARCHIVE_SELECT = (
+    "SELECT m.id, m.session_id, m.message, m.response, m.response_hash, r.text, r.data, r.codec, "
+    "m.stage, m.timestamp FROM {name} m LEFT JOIN chat_responses r ON r.hash = m.response_hash "
+    "ORDER BY m.session_id, m.timestamp"
+)
+
+
+def partitioning_enabled(engine: Engine) -> bool:
+    return CHAT_MESSAGES_PARTITIONED and engine.dialect.name == "postgresql"
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    """First day of the month `months` after the month containing `month`."""
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"{PARENT_TABLE}_y{month.year:04d}m{month.month:02d}"
+
+
+def list_partitions(conn) -> Dict[str, datetime]:
+    """Attached monthly partitions, mapped to the first day of their month."""
+    names = conn.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = :parent"
+    ), {"parent": PARENT_TABLE}).scalars()
+    partitions = {}
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions[name] = datetime(int(match.group(1)), int(match.group(2)), 1)
+    return partitions
+
+
+def ensure_partitions(engine: Engine, months_ahead: int = CHAT_PARTITION_MONTHS_AHEAD) -> List[str]:
+    """Create the partitions for this month and the next `months_ahead` months; returns those created."""
+    if not partitioning_enabled(engine):
+        return []
+    current = add_months(datetime.utcnow(), 0)
+    created = []
+    with engine.begin() as conn:
+        existing = list_partitions(conn)
+        for offset in range(months_ahead + 1):
+            start = add_months(current, offset)
+            name = partition_name(start)
+            if name in existing:
+                continue
+            conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT_TABLE} "
+                f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{add_months(start, 1):%Y-%m-%d}')"
+            ))
+            created.append(name)
+    if created:
+        logger.info(f"Created chat_messages partitions: {', '.join(created)}")
+    return created
+
+
+def _archive_rows(rows, response_hashes: set):
+    """Partition rows with their responses resolved, collecting the hashes they reference."""
+    for row in rows:
+        response = row.response
+        if response is None and row.response_hash is not None:
+            response_hashes.add(row.response_hash)
+            response = response_store.decode(row.text, row.data, row.codec)
+        yield ArchiveRow(row.id, row.session_id, row.message, response, row.stage, row.timestamp)
+
+
+def _write_jsonl(path: str, rows) -> List[Dict[str, Any]]:
+    """Write rows (sorted by session) as one gzip member per session; returns the session index."""
+    index = []
+    with open(path, "wb") as f:
+        for session_id, group in itertools.groupby(rows, key=lambda row: row.session_id):
+            payload = b"".join(
+                dumps({
+                    "id": str(row.id),
+                    "session_id": str(row.session_id),
+                    "message": row.message,
+                    "response": row.response,
+                    "stage": row.stage,
+                    "timestamp": row.timestamp.isoformat(),
+                }) + b"\n"
+                for row in group
+            )
+            member = gzip.compress(payload, compresslevel=6)
+            index.append({"session_id": session_id, "byte_offset": f.tell(), "byte_length": len(member)})
+            f.write(member)
+        f.flush()
+        os.fsync(f.fileno())
+    return index
+
+
+def _write_parquet(path: str, rows, chunk_size: int = 50000) -> List[Dict[str, Any]]:
+    """Write rows (sorted by session) to zstd Parquet; returns the session index."""
+    if pyarrow is None:
+        raise RuntimeError("CHAT_ARCHIVE_FORMAT=parquet requires pyarrow")
+    schema = pyarrow.schema([
+        ("id", pyarrow.string()),
+        ("session_id", pyarrow.string()),
+        ("message", pyarrow.string()),
+        ("response", pyarrow.string()),
+        ("stage", pyarrow.string()),
+        ("timestamp", pyarrow.timestamp("us")),
+    ])
+    sessions = []
+    with pyarrow.parquet.ParquetWriter(path, schema, compression="zstd") as writer:
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            writer.write_table(pyarrow.Table.from_pylist([
+                {
+                    "id": str(row.id),
+                    "session_id": str(row.session_id),
+                    "message": row.message,
+                    "response": row.response,
+                    "stage": row.stage,
+                    "timestamp": row.timestamp,
+                }
+                for row in chunk
+            ], schema=schema))
+            for row in chunk:
+                if not sessions or sessions[-1] != row.session_id:
+                    sessions.append(row.session_id)
+    return [{"session_id": session_id, "byte_offset": None, "byte_length": None} for session_id in sessions]
+
+
+def archive_partition(engine: Engine, name: str, month: datetime,
+                      directory: str = CHAT_ARCHIVE_DIR, archive_format: str = CHAT_ARCHIVE_FORMAT) -> int:
+    """
+    Archive one partition to a file, record it in the manifest, then detach and drop it
+    along with the stored responses no other message references.
+
+    The file is written completely before the manifest transaction; a failed
+    run leaves the partition attached and is simply retried. Returns the
+    number of rows archived.
+    """
+    os.makedirs(directory, exist_ok=True)
+    extension = "parquet" if archive_format == "parquet" else "jsonl.gz"
+    path = os.path.join(directory, f"{name}.{extension}")
+    tmp_path = path + ".tmp"
+
+    response_hashes: set = set()
+    with engine.connect() as conn:
+        rows = _archive_rows(
+            conn.execution_options(stream_results=True, yield_per=10000).execute(
+                text(_ARCHIVE_SELECT.format(name=name))
+            ),
+            response_hashes,
+        )
+        if archive_format == "parquet":
+            index = _write_parquet(tmp_path, rows)
+        else:
+            index = _write_jsonl(tmp_path, rows)
+    os.replace(tmp_path, path)
+
+    with engine.begin() as conn:
+        row_count = conn.execute(text(f"SELECT count(*) FROM {name}")).scalar()
+        conn.execute(insert(ChatMessageArchive).values(
+            partition=name,
+            range_start=month,
+            range_end=add_months(month, 1),
+            path=path,
+            format=archive_format,
+            row_count=row_count,
+            archived_at=datetime.utcnow()
+        ))
+        if index:
+            conn.execute(insert(ChatMessageArchiveSession), [{**entry, "partition": name} for entry in index])
+        conn.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+        conn.execute(text(f"DROP TABLE {name}"))
+        response_store.purge(conn, response_hashes)
+    logger.info(f"Archived {row_count} chat messages from {name} to {path}")
+    return row_count
+
+
+def archive_partitions(engine: Engine, after_months: int = CHAT_ARCHIVE_AFTER_MONTHS) -> List[str]:
+    """Archive every partition whose month ended more than `after_months` months ago."""
+    if not partitioning_enabled(engine) or after_months <= 0:
+        return []
+    cutoff = add_months(datetime.utcnow(), -after_months)
+    with engine.connect() as conn:
+        partitions = list_partitions(conn)
+    archived = []
+    for name, month in sorted(partitions.items(), key=lambda item: item[1]):
+        if add_months(month, 1) <= cutoff:
+            archive_partition(engine, name, month)
+            archived.append(name)
+    return archived
+
+
+def read_archived_messages(db: Session, session_id: str) -> List[Dict[str, Any]]:
+    """A session's archived chat messages, oldest first."""
+    entries = db.execute(
+        select(
+            ChatMessageArchive.path, ChatMessageArchive.format,
+            ChatMessageArchiveSession.byte_offset, ChatMessageArchiveSession.byte_length
+        )
+        .join(ChatMessageArchiveSession, ChatMessageArchiveSession.partition == ChatMessageArchive.partition)
+        .where(ChatMessageArchiveSession.session_id == session_id)
+        .order_by(ChatMessageArchive.range_start)
+    ).all()
+
+    messages = []
+    for path, archive_format, byte_offset, byte_length in entries:
+        if archive_format == "parquet":
+            if pyarrow is None:
+                raise RuntimeError(f"Reading {path} requires pyarrow")
+            table = pyarrow.parquet.read_table(path, filters=[("session_id", "=", str(session_id))])
+            messages.extend(table.sort_by("timestamp").to_pylist())
+        else:
+            with open(path, "rb") as f:
+                f.seek(byte_offset)
+                payload = gzip.decompress(f.read(byte_length))
+            for line in payload.splitlines():
+                message = loads(line)
+                message["timestamp"] = datetime.fromisoformat(message["timestamp"])
+                messages.append(message)
+    return messages
+
+
+class PartitionWorker:
+    """Background thread creating upcoming partitions and archiving old ones."""
+    def __init__(self, engine: Engine, interval: float = CHAT_PARTITION_MAINTENANCE_INTERVAL):
+        self.engine = engine
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="partitions", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                ensure_partitions(self.engine)
+                archive_partitions(self.engine)
+            except Exception as e:
+                logger.error(f"Partition maintenance failed: {str(e)}")
+
+
+worker: Optional[PartitionWorker] = None
+
+
+def start(engine: Engine) -> Optional[PartitionWorker]:
+    """
+    Create the current partitions (inserts fail without them), archive due
+    partitions, and start periodic maintenance.
+    """
+    global worker
+    if not partitioning_enabled(engine):
+        return None
+    ensure_partitions(engine)
+    try:
+        archive_partitions(engine)
+    except Exception as e:
+        logger.error(f"Partition archival failed: {str(e)}")
+    worker = PartitionWorker(engine)
+    worker.start()
+    return worker
+
+
+def stop() -> None:
+    global worker
+    if worker is not None:
+        worker.stop()
+        worker = None
@@ -0,0 +1,137 @@
+"""
+Scoring of sessions' symptoms against the MS course patterns in
+app/data/ms_symptoms.json.
+
+Each pattern's `symptom_weights` is a vector over SYMPTOM_LEXICON; the
+pattern vectors form one L2-normalized matrix. A session's symptoms become
+a binary vector over the same lexicon, and its cosine similarity to every
+pattern is one matrix product. score_batch stacks many sessions into one
+matrix for cohort reports. The weights describe typical presentations of
+each course; a similarity is a talking point, not a classification.
+"""
+import os
+import json
+import logging
+from typing import Any, Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from app.compact_state import SYMPTOM_LEXICON, Lexicon, TermList
+
+logger = logging.getLogger(__name__)
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), "data", "ms_symptoms.json")
+
+
+class PatternMatch(NamedTuple):
+    name: str
+    description: str
+    score: float
+
+
+class PatternScorer:
+    """Cosine similarity of symptom sets to a fixed set of weighted symptom patterns."""
+    def __init__(self, patterns: Sequence[Mapping], lexicon: Lexicon = SYMPTOM_LEXICON):
+        self.lexicon = lexicon
+        self.names = [pattern["name"] for pattern in patterns]
+        self.descriptions = [pattern.get("description", "") for pattern in patterns]
+        for pattern in patterns:
+            for symptom in pattern.get("symptom_weights", {}):
+                lexicon.id(symptom)
+        # Symptoms interned after this point are in no pattern and are ignored
+        self.width = len(lexicon)
+        matrix = np.zeros((len(patterns), self.width), dtype=np.float32)
+        for row, pattern in enumerate(patterns):
+            for symptom, weight in pattern.get("symptom_weights", {}).items():
+                matrix[row, lexicon.id(symptom)] = weight
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.matrix = matrix / np.where(norms > 0, norms, 1.0)
+
+    @classmethod
+    def from_file(cls, path: str = DATA_PATH) -> "PatternScorer":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f).get("symptom_patterns", []))
+
+    def symptom_ids(self, symptoms: Mapping[str, Iterable[str]]) -> List[int]:
+        """Distinct lexicon ids of a state's symptoms (compact TermLists or the stored dict of lists)."""
+        ids = set()
+        for terms in symptoms.values():
+            if isinstance(terms, TermList) and terms.lexicon is self.lexicon:
+                ids.update(terms.ids())
+            else:
+                ids.update(term_id for term_id in map(self.lexicon.get, terms) if term_id is not None)
+        return [term_id for term_id in ids if term_id < self.width]
+
+    def score_batch(self, id_lists: Sequence[Sequence[int]]) -> np.ndarray:
+        """(sessions, patterns) cosine similarities of many sessions' symptom id lists."""
+        vectors = np.zeros((len(id_lists), self.width), dtype=np.float32)
+        rows = np.repeat(np.arange(len(id_lists)), [len(ids) for ids in id_lists])
+        columns = np.fromiter((i for ids in id_lists for i in ids), dtype=np.intp, count=len(rows))
+        vectors[rows, columns] = 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return (vectors / np.where(norms > 0, norms, 1.0)) @ self.matrix.T
+
+    def rank(self, symptoms: Mapping[str, Iterable[str]]) -> List[PatternMatch]:
+        """Patterns ordered by similarity to one state's symptoms, best first."""
+        scores = self.score_batch([self.symptom_ids(symptoms)])[0]
+        return sorted(
+            (PatternMatch(name, description, round(float(score), 4))
+             for name, description, score in zip(self.names, self.descriptions, scores)),
+            key=lambda match: -match.score
+        )
+
+
+try:
+    scorer = PatternScorer.from_file()
+except (OSError, ValueError, KeyError) as e:
+    logger.error(f"Error loading symptom patterns: {str(e)}")
+    scorer = PatternScorer([])
+
+
+def cohort_report(symptom_sets: Iterable[Mapping[str, Iterable[str]]], chunk_size: int = 5000,
+                  pattern_scorer: Optional[PatternScorer] = None) -> Dict[str, Any]:
+    """
+    Pattern similarities aggregated over many sessions' symptoms, scored
+    `chunk_size` sessions per matrix product: sessions seen and scored (those
+    with any known symptom), and per pattern the mean similarity over scored
+    sessions and the number of sessions it is the best match for.
+    """
+    pattern_scorer = pattern_scorer or scorer
+    patterns = len(pattern_scorer.names)
+    totals = np.zeros(patterns, dtype=np.float64)
+    best = np.zeros(patterns, dtype=np.int64)
+    seen = scored = 0
+
+    def flush(chunk: List[List[int]]) -> None:
+        nonlocal scored
+        if not chunk or not patterns:
+            return
+        scores = pattern_scorer.score_batch(chunk)
+        totals[:] += scores.sum(axis=0)
+        matched = scores.max(axis=1) > 0
+        best[:] += np.bincount(scores[matched].argmax(axis=1), minlength=patterns)
+        scored += len(chunk)
+
+    chunk: List[List[int]] = []
+    for symptoms in symptom_sets:
+        seen += 1
+        ids = pattern_scorer.symptom_ids(symptoms)
+        if ids:
+            chunk.append(ids)
+            if len(chunk) >= chunk_size:
+                flush(chunk)
+                chunk = []
+    flush(chunk)
+
+    return {
+        "sessions": seen,
+        "scored_sessions": scored,
+        "patterns": [
+            {
+                "name": name,
+                "mean_similarity": round(float(totals[i] / scored), 4) if scored else 0.0,
+                "best_match_sessions": int(best[i]),
+            }
+            for i, name in enumerate(pattern_scorer.names)
+        ],
+    }
@@ -0,0 +1,175 @@
+import os
+import sys
+import time
+import uuid
+import random
+import logging
+import threading
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, Optional, Tuple
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Profiling configuration. The middleware is only installed when PROFILING_ENABLED
+# is set, so a disabled profiler adds no per-request work at all.
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "False").lower() == "true"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.0"))
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "X-Debug-Profile")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_PATHS = tuple(p for p in os.getenv("PROFILE_PATHS", "/chat").split(",") if p)
+
+# Set by the middleware for requests selected for profiling
+_profile_request: ContextVar[Optional[str]] = ContextVar("profile_request", default=None)
+
+
+class StackProfiler:
+    """
+    Deterministic call-stack profiler producing collapsed stacks.
+
+    Every Python call made by the profiled thread is recorded with its full
+    stack, and self time (in microseconds) is accumulated per unique stack.
+    The result is written in the "collapsed" format understood by
+    flamegraph.pl, speedscope and inferno: one "frame;frame;frame <count>"
+    line per stack.
+    """
+    def __init__(self):
+        self.stacks: Dict[Tuple[str, ...], float] = {}
+        self._stack: list = []
+        self._last = 0.0
+
+    @staticmethod
+    def _frame_label(frame, arg=None, c_call: bool = False) -> str:
+        if c_call:
+            module = getattr(arg, "__module__", None) or "builtins"
+            return f"{module}.{getattr(arg, '__qualname__', getattr(arg, '__name__', '?'))}"
+        code = frame.f_code
+        module = frame.f_globals.get("__name__", "?")
+        return f"{module}.{getattr(code, 'co_qualname', code.co_name)}"
+
+    def _charge(self, now: float) -> None:
+        if self._stack:
+            key = tuple(self._stack)
+            self.stacks[key] = self.stacks.get(key, 0.0) + (now - self._last)
+        self._last = now
+
+    def _callback(self, frame, event, arg):
+        now = time.perf_counter()
+        if event == "call":
+            self._charge(now)
+            self._stack.append(self._frame_label(frame))
+        elif event == "c_call":
+            self._charge(now)
+            self._stack.append(self._frame_label(frame, arg, c_call=True))
+        elif event in ("return", "c_return", "c_exception"):
+            self._charge(now)
+            if self._stack:
+                self._stack.pop()
+
+    def __enter__(self) -> "StackProfiler":
+        self._last = time.perf_counter()
+        sys.setprofile(self._callback)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        sys.setprofile(None)
+        self._charge(time.perf_counter())
+        # Drop the frames of the profiler's own exit
+        own = f"{__name__}.{type(self).__qualname__}"
+        self.stacks = {k: v for k, v in self.stacks.items() if not k[0].startswith(own)}
+
+    def collapsed(self) -> str:
+        """Return the recorded stacks in collapsed format (self time in microseconds)."""
+        lines = []
+        for stack, seconds in self.stacks.items():
+            micros = int(seconds * 1_000_000)
+            if micros > 0:
+                lines.append(f"{';'.join(stack)} {micros}")
+        return "\n".join(sorted(lines)) + "\n"
+
+
+def write_profile(profile_id: str, name: str, profiler: StackProfiler) -> str:
+    """Write a collapsed-stack file for a captured profile and return its path."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    timestamp = time.strftime("%Y%m%d%H%M%S")
+    path = os.path.join(PROFILE_DIR, f"{timestamp}_{name}_{profile_id}.collapsed")
+    with open(path, "w") as f:
+        f.write(profiler.collapsed())
+    return path
+
+
+def profiled(func):
+    """
+    Profile a call when the current request was selected by ProfilingMiddleware.
+
+    Outside of a selected request the wrapper costs a single ContextVar lookup.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        profile_id = _profile_request.get()
+        if profile_id is None or sys.getprofile() is not None:
+            return func(*args, **kwargs)
+        profiler = StackProfiler()
+        try:
+            with profiler:
+                return func(*args, **kwargs)
+        finally:
+            try:
+                path = write_profile(profile_id, func.__name__, profiler)
+                logger.info(f"Wrote profile {profile_id} for {func.__qualname__} to {path}")
+            except Exception as e:
+                logger.error(f"Failed to write profile {profile_id}: {str(e)}")
+    return wrapper
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware selecting requests for profiling.
+
+    A request is profiled when its path is one of PROFILE_PATHS and either it
+    carries the PROFILE_HEADER header or it is picked by PROFILE_SAMPLE_RATE.
+    Selected requests get an X-Profile-Id response header naming the profile.
+    """
+    def __init__(self, app, sample_rate: float = PROFILE_SAMPLE_RATE,
+                 header: str = PROFILE_HEADER, paths: Tuple[str, ...] = PROFILE_PATHS):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.header = header.lower().encode("latin-1")
+        self.paths = tuple(p.rstrip("/") or "/" for p in paths)
+        self._random = random.Random()
+        self._lock = threading.Lock()
+
+    def _selected(self, scope) -> bool:
+        if scope["path"].rstrip("/") not in self.paths:
+            return False
+        for name, value in scope.get("headers", ()):
+            if name == self.header and value.lower() not in (b"", b"0", b"false"):
+                return True
+        if self.sample_rate <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._selected(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex[:12]
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-id", profile_id.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        token = _profile_request.set(profile_id)
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            _profile_request.reset(token)
@@ -0,0 +1,203 @@
+"""
+Materialized session reports.
+
+A session's report (its analysis and recommendations) only changes when a
+turn completes the analysis, so it is built once, in the transaction that
+writes that turn (or the write-behind flush that applies it), and stored in
+session_reports with the session version that produced it. The stored row
+holds the JSON body ready to send, gzip- and, when the brotli package is
+installed, brotli-compressed copies, and an ETag derived from the body.
+
+GET /generate_report answers a poll whose If-None-Match matches from the
+ETag column alone. Bodies are cached in-process by ETag; an ETag always
+names the same bytes, so entries never go stale. Sessions completed before
+reports were materialized, or whose completing turn is still in the
+write-behind journal, have no row; their report is built from the state on
+each request, with the same ETag the stored one will have.
+"""
+import os
+import gzip
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, NamedTuple, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import DateTime, LargeBinary, bindparam, delete, select, text
+from sqlalchemy.orm import Session
+
+from app.models import SessionReport
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+load_dotenv()
+
+REPORT_CACHE_SIZE = int(os.getenv("REPORT_CACHE_SIZE", "1024"))
+
+IDENTITY = "identity"
+GZIP = "gzip"
+BROTLI = "br"
+# Compressed encodings reports are stored in, preferred first
+ENCODINGS = (BROTLI, GZIP) if brotli is not None else (GZIP,)
+
+
+class Report(NamedTuple):
+    """A report ready to send: its ETag and its body in each content encoding"""
+    etag: str
+    bodies: Dict[str, bytes]
+
+
+def content(session_id: str, state: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "session_id": session_id,
+        "analysis": state["analysis"],
+        "recommendations": state["recommendations"],
+    }
+
+
+def build(session_id: str, state: Dict[str, Any]) -> Report:
+    """The report of a session whose analysis is complete."""
+    # Keys sorted, so a state read back from JSONB (which reorders them) gives the same bytes and ETag
+    body = json.dumps(content(session_id, state), sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    bodies = {IDENTITY: body, GZIP: gzip.compress(body, compresslevel=6, mtime=0)}
+    if brotli is not None:
+        bodies[BROTLI] = brotli.compress(body)
+    return Report('"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"', bodies)
+
+
+# The same statement on PostgreSQL and SQLite, built with text() so it is compiled once. A
+# report is only replaced by one from a later version (write-behind replays apply old turns again)
+_UPSERT = text(
+    "INSERT INTO session_reports (session_id, version, etag, body, body_gzip, body_br, created_at) "
+    "VALUES (:session_id, :version, :etag, :body, :body_gzip, :body_br, :created_at) "
+    "ON CONFLICT (session_id) DO UPDATE SET version = excluded.version, etag = excluded.etag, "
+    "body = excluded.body, body_gzip = excluded.body_gzip, body_br = excluded.body_br, "
+    "created_at = excluded.created_at "
+    "WHERE session_reports.version < excluded.version"
+).bindparams(
+    bindparam("session_id", type_=SessionReport.__table__.c.session_id.type),
+    bindparam("body", type_=LargeBinary), bindparam("body_gzip", type_=LargeBinary),
+    bindparam("body_br", type_=LargeBinary), bindparam("created_at", type_=DateTime),
+)
+
+
+def save(db: Session, session_id: str, version: int, state: Dict[str, Any]) -> Report:
+    """Store the report of `state`, written at session `version`. Does not commit."""
+    report = build(session_id, state)
+    db.execute(_UPSERT, {
+        "session_id": session_id, "version": version, "etag": report.etag,
+        "body": report.bodies[IDENTITY], "body_gzip": report.bodies[GZIP], "body_br": report.bodies.get(BROTLI),
+        "created_at": datetime.utcnow(),
+    })
+    cache.put(report)
+    return report
+
+
+def delete_sessions(db: Session, session_ids) -> None:
+    """Delete the reports of sessions (a list of ids or a select of them). Does not commit."""
+    db.execute(
+        delete(SessionReport).where(SessionReport.session_id.in_(session_ids))
+        .execution_options(synchronize_session=False)
+    )
+
+
+class ReportCache:
+    """LRU of report bodies by ETag."""
+    def __init__(self, max_entries: int = REPORT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Report]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, etag: str) -> Optional[Report]:
+        with self._lock:
+            report = self._entries.get(etag)
+            if report is not None:
+                self._entries.move_to_end(etag)
+            return report
+
+    def put(self, report: Report) -> None:
+        with self._lock:
+            self._entries[report.etag] = report
+            self._entries.move_to_end(report.etag)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+cache = ReportCache()
+
+
+def stored_etag(db: Session, session_id: str) -> Optional[str]:
+    """The ETag of a session's stored report, if it has one."""
+    return db.scalar(select(SessionReport.etag).where(SessionReport.session_id == session_id))
+
+
+def load(db: Session, session_id: str, etag: Optional[str] = None) -> Optional[Report]:
+    """A session's stored report, from the cache when its ETag is known."""
+    report = cache.get(etag) if etag else None
+    if report is not None:
+        return report
+    row = db.execute(
+        select(SessionReport.etag, SessionReport.body, SessionReport.body_gzip, SessionReport.body_br)
+        .where(SessionReport.session_id == session_id)
+    ).first()
+    if row is None:
+        return None
+    bodies = {IDENTITY: row.body, GZIP: row.body_gzip}
+    if row.body_br is not None:
+        bodies[BROTLI] = row.body_br
+    report = Report(row.etag, bodies)
+    cache.put(report)
+    return report
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Whether an If-None-Match header matches `etag` (weak comparison). The
+    ETags sent with compressed bodies carry the encoding as a suffix, which
+    is ignored.
+    """
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        for encoding in (GZIP, BROTLI):
+            if tag.endswith(f'-{encoding}"'):
+                tag = tag[:-len(encoding) - 2] + '"'
+        if tag == etag:
+            return True
+    return False
+
+
+def negotiate(accept_encoding: Optional[str], encodings=ENCODINGS) -> str:
+    """The first of `encodings` an Accept-Encoding header accepts, else identity."""
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        coding, *params = [item.strip() for item in part.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding and quality > 0:
+            accepted.add(coding.lower())
+    for encoding in encodings:
+        if encoding in accepted or "*" in accepted:
+            return encoding
+    return IDENTITY
+
+
+def representation_etag(etag: str, encoding: str) -> str:
+    """The ETag of one encoding of a report; each representation needs its own."""
+    return etag if encoding == IDENTITY else etag[:-1] + f'-{encoding}"'
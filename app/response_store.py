@@ -0,0 +1,226 @@
+"""
+Content-addressed storage of assistant responses.
+
+Most responses are the same few stage prompts, so chat_messages no longer
+stores the text of each one: a message references a chat_responses row by
+the BLAKE2b-128 hash of the response's UTF-8 bytes, and each distinct
+response is stored once. Storing a response that already exists is an
+INSERT ... ON CONFLICT DO NOTHING that only probes the primary key.
+
+With RESPONSE_COMPRESSION=zstd (requires the zstandard package), responses
+of at least RESPONSE_COMPRESSION_MIN_BYTES are stored zstd-compressed when
+that is smaller. Compressed responses are not matched by chat search, and
+PostgreSQL already compresses long text values itself, so the default is
+"none".
+
+Reads resolve hashes through an in-process LRU of decoded responses; a hash
+always names the same text, so entries never go stale. Messages stored
+before this table keep their inline `response` and are read as they are.
+
+Only chat_messages references responses this way; the chat_history in a
+session's ai_state still holds each response's text.
+
+Responses are deleted with the last message referencing them (see
+purge()). On PostgreSQL a turn that reuses a response at the moment it is
+purged fails the foreign key check and can be retried.
+"""
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import LargeBinary, bindparam, delete, exists, select, text, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.models import ChatMessage, ChatResponse
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_COMPRESSION = os.getenv("RESPONSE_COMPRESSION", "none").lower()
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", "512"))
+RESPONSE_COMPRESSION_LEVEL = int(os.getenv("RESPONSE_COMPRESSION_LEVEL", "3"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2048"))
+
+ZSTD = "zstd"
+
+# Hashes per statement when looking up or purging responses
+_CHUNK_SIZE = 500
+
+# The same statement on PostgreSQL and SQLite, built with text() so it is compiled once
+_INSERT = text(
+    "INSERT INTO chat_responses (hash, text, data, codec) VALUES (:hash, :text, :data, :codec) "
+    "ON CONFLICT (hash) DO NOTHING"
+).bindparams(bindparam("hash", type_=LargeBinary), bindparam("data", type_=LargeBinary))
+
+_local = threading.local()
+
+
+def _zstd():
+    """This thread's zstd compressor and decompressor; neither is safe to share between threads."""
+    if zstandard is None:
+        raise RuntimeError("Compressed responses require the zstandard package")
+    if not hasattr(_local, "zstd"):
+        _local.zstd = (zstandard.ZstdCompressor(level=RESPONSE_COMPRESSION_LEVEL), zstandard.ZstdDecompressor())
+    return _local.zstd
+
+
+def encode(response: str, compression: str = RESPONSE_COMPRESSION) -> Dict[str, Any]:
+    """The chat_responses row storing `response`."""
+    raw = response.encode("utf-8")
+    row = {"hash": hashlib.blake2b(raw, digest_size=16).digest(), "text": response, "data": None, "codec": None}
+    if compression == ZSTD and len(raw) >= RESPONSE_COMPRESSION_MIN_BYTES:
+        compressed = _zstd()[0].compress(raw)
+        if len(compressed) < len(raw):
+            row.update(text=None, data=compressed, codec=ZSTD)
+    elif compression not in (ZSTD, "none"):
+        raise ValueError(f"Unknown RESPONSE_COMPRESSION: {compression}")
+    return row
+
+
+def decode(response_text: Optional[str], data: Optional[bytes], codec: Optional[str]) -> str:
+    if codec is None:
+        return response_text
+    if codec == ZSTD:
+        return _zstd()[1].decompress(data).decode("utf-8")
+    raise ValueError(f"Unknown response codec: {codec}")
+
+
+class ResponseCache:
+    """LRU of decoded responses by hash."""
+    def __init__(self, max_entries: int = RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[bytes, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: bytes) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: bytes, value: str) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+cache = ResponseCache()
+
+
+def store(db: Session, responses: Iterable[str]) -> List[bytes]:
+    """Store responses that are not stored yet and return the hash of each. Does not commit."""
+    rows = {}
+    hashes = []
+    for response in responses:
+        row = encode(response)
+        rows.setdefault(row["hash"], row)
+        hashes.append(row["hash"])
+        cache.put(row["hash"], response)
+    if rows:
+        # In hash order, so concurrent transactions storing the same new responses cannot deadlock
+        db.execute(_INSERT, [rows[key] for key in sorted(rows)])
+    return hashes
+
+
+def reference(db: Session, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """chat_messages rows for message dicts with a `response`, referencing it by hash. Does not commit."""
+    hashes = store(db, [message["response"] for message in messages])
+    return [
+        {**{k: v for k, v in message.items() if k != "response"}, "response_hash": response_hash}
+        for message, response_hash in zip(messages, hashes)
+    ]
+
+
+def texts(db: Session, hashes: Iterable[bytes]) -> Dict[bytes, str]:
+    """The responses stored under `hashes`."""
+    found = {}
+    missing = []
+    for key in set(hashes):
+        value = cache.get(key)
+        if value is None:
+            missing.append(key)
+        else:
+            found[key] = value
+    for offset in range(0, len(missing), _CHUNK_SIZE):
+        rows = db.execute(
+            select(ChatResponse.hash, ChatResponse.text, ChatResponse.data, ChatResponse.codec)
+            .where(ChatResponse.hash.in_(missing[offset:offset + _CHUNK_SIZE]))
+        )
+        for key, response_text, data, codec in rows:
+            found[key] = decode(response_text, data, codec)
+            cache.put(key, found[key])
+    return found
+
+
+def resolve(db: Session, messages: List[ChatMessage]) -> List[Optional[str]]:
+    """The response of each message, inline or stored by hash."""
+    stored = texts(db, [message.response_hash for message in messages
+                        if message.response is None and message.response_hash is not None])
+    return [
+        message.response if message.response is not None else stored.get(message.response_hash)
+        for message in messages
+    ]
+
+
+def purge(db: Session, hashes: Iterable[Optional[bytes]]) -> int:
+    """Delete the responses among `hashes` that no message references any more. Does not commit."""
+    hashes = sorted({key for key in hashes if key is not None})
+    deleted = 0
+    for offset in range(0, len(hashes), _CHUNK_SIZE):
+        result = db.execute(
+            delete(ChatResponse)
+            .where(
+                ChatResponse.hash.in_(hashes[offset:offset + _CHUNK_SIZE]),
+                ~exists().where(ChatMessage.response_hash == ChatResponse.hash),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        deleted += result.rowcount
+    return deleted
+
+
+def backfill(engine: Engine, batch_size: int = 1000) -> int:
+    """
+    Move the inline responses of messages stored before chat_responses into
+    it, `batch_size` messages per transaction. Returns the number of messages
+    moved.
+    """
+    total = 0
+    while True:
+        with Session(engine) as db:
+            rows = db.execute(
+                select(ChatMessage.id, ChatMessage.response)
+                .where(ChatMessage.response.is_not(None))
+                .limit(batch_size)
+            ).all()
+            if rows:
+                hashes = store(db, [response for _, response in rows])
+                table = ChatMessage.__table__
+                db.execute(
+                    update(table)
+                    .where(table.c.id == bindparam("message_id"))
+                    .values(response=None, response_hash=bindparam("response_hash")),
+                    [{"message_id": message_id, "response_hash": response_hash}
+                     for (message_id, _), response_hash in zip(rows, hashes)]
+                )
+            db.commit()
+        total += len(rows)
+        if len(rows) < batch_size:
+            break
+    if total:
+        logger.info(f"Moved {total} inline chat responses to chat_responses")
+    return total
@@ -0,0 +1,249 @@
+"""
+Session deletion and retention.
+
+Sessions are deleted with set-based DELETE statements (chat messages and
+the stored responses no other message references, idempotency records,
+archive manifest entries, timeline observations, reports, then the
+sessions) rather
+than ORM cascades, which would load every ChatMessage of a session first.
+
+With SESSION_RETENTION_DAYS set, a background worker purges sessions with
+no activity for that many days. It works in batches of
+SESSION_RETENTION_BATCH_SIZE sessions, each in its own short transaction
+with a pause in between, so large purges never hold locks on the live
+tables for long. Expired idempotency records are purged the same way.
+"""
+import os
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.orm import Session
+
+from app import cluster, cohort_index, idempotency, reports, response_store, state_store, timeline, write_behind
+from app.models import Session as DBSession, ChatMessage, ChatMessageArchiveSession, IdempotencyKey
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 0 disables the retention worker
+SESSION_RETENTION_DAYS = float(os.getenv("SESSION_RETENTION_DAYS", "0"))
+SESSION_RETENTION_BATCH_SIZE = int(os.getenv("SESSION_RETENTION_BATCH_SIZE", "500"))
+SESSION_RETENTION_INTERVAL = float(os.getenv("SESSION_RETENTION_INTERVAL", "3600"))
+SESSION_RETENTION_PAUSE = float(os.getenv("SESSION_RETENTION_PAUSE", "0.1"))
+
+
+def delete_sessions(db: Session, session_ids: Iterable) -> int:
+    """
+    Delete sessions with their chat messages, idempotency records, timeline observations and reports.
+
+    Does not commit; call forget_sessions() once the transaction has committed.
+    Returns the number of sessions deleted.
+    """
+    ids = [session_id if isinstance(session_id, uuid.UUID) else uuid.UUID(str(session_id))
+           for session_id in session_ids]
+    if not ids:
+        return 0
+    response_hashes = db.scalars(
+        delete(ChatMessage).where(ChatMessage.session_id.in_(ids))
+        .returning(ChatMessage.response_hash)
+        .execution_options(synchronize_session=False)
+    ).all()
+    response_store.purge(db, response_hashes)
+    db.execute(
+        delete(IdempotencyKey).where(IdempotencyKey.session_id.in_(ids))
+        .execution_options(synchronize_session=False)
+    )
+    # Archived messages stay in their archive files but are no longer reachable
+    db.execute(
+        delete(ChatMessageArchiveSession).where(ChatMessageArchiveSession.session_id.in_(ids))
+        .execution_options(synchronize_session=False)
+    )
+    timeline.delete_sessions(db, ids)
+    reports.delete_sessions(db, ids)
+    result = db.execute(
+        delete(DBSession).where(DBSession.id.in_(ids))
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def delete_user_sessions(db: Session, email: str) -> List[str]:
+    """
+    Delete all of a user's sessions. Does not commit.
+
+    Returns the deleted session ids, for forget_sessions().
+    """
+    user_sessions = select(DBSession.id).where(DBSession.email == email)
+    session_ids = [str(session_id) for session_id in db.scalars(user_sessions)]
+    if not session_ids:
+        return []
+    response_hashes = db.scalars(
+        delete(ChatMessage).where(ChatMessage.session_id.in_(user_sessions))
+        .returning(ChatMessage.response_hash)
+        .execution_options(synchronize_session=False)
+    ).all()
+    response_store.purge(db, response_hashes)
+    db.execute(
+        delete(IdempotencyKey).where(IdempotencyKey.email == email)
+        .execution_options(synchronize_session=False)
+    )
+    db.execute(
+        delete(ChatMessageArchiveSession).where(ChatMessageArchiveSession.session_id.in_(user_sessions))
+        .execution_options(synchronize_session=False)
+    )
+    timeline.delete_user(db, email)
+    reports.delete_sessions(db, user_sessions)
+    db.execute(
+        delete(DBSession).where(DBSession.email == email)
+        .execution_options(synchronize_session=False)
+    )
+    return session_ids
+
+
+def forget_sessions(session_ids: Iterable, peers: bool = True) -> None:
+    """
+    Drop copies of deleted sessions: queued write-behind turns, cached
+    responses, stored state and index entries, in this process and (unless
+    `peers` is False) in the other cluster workers.
+    """
+    session_ids = {str(session_id) for session_id in session_ids}
+    if session_ids:
+        write_behind.discard(session_ids)
+        idempotency.cache.discard_sessions(session_ids)
+        state_store.discard(session_ids)
+        cohort_index.discard(session_ids)
+        if peers:
+            cluster.forget_on_peers(session_ids)
+
+
+def purge_expired_sessions(session_factory: Callable, days: float,
+                           batch_size: int = SESSION_RETENTION_BATCH_SIZE,
+                           pause: float = SESSION_RETENTION_PAUSE,
+                           stop: Optional[threading.Event] = None) -> int:
+    """
+    Delete sessions last updated more than `days` ago, `batch_size` at a time.
+
+    Each batch is a separate transaction. Rows locked by live requests are
+    skipped (PostgreSQL) and picked up by a later sweep. Returns the number
+    of sessions deleted.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    total = 0
+    while stop is None or not stop.is_set():
+        db = session_factory()
+        try:
+            session_ids = list(db.scalars(
+                select(DBSession.id)
+                .where(DBSession.last_updated < cutoff)
+                .order_by(DBSession.last_updated)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            ))
+            delete_sessions(db, session_ids)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        forget_sessions(session_ids)
+        total += len(session_ids)
+        if len(session_ids) < batch_size:
+            break
+        time.sleep(pause)
+    return total
+
+
+def purge_expired_idempotency_keys(session_factory: Callable,
+                                   batch_size: int = SESSION_RETENTION_BATCH_SIZE,
+                                   pause: float = SESSION_RETENTION_PAUSE) -> int:
+    """Delete idempotency records older than IDEMPOTENCY_TTL_HOURS, `batch_size` at a time."""
+    cutoff = datetime.utcnow() - timedelta(hours=idempotency.IDEMPOTENCY_TTL_HOURS)
+    total = 0
+    while True:
+        db = session_factory()
+        try:
+            keys = db.execute(
+                select(IdempotencyKey.email, IdempotencyKey.key)
+                .where(IdempotencyKey.created_at < cutoff)
+                .limit(batch_size)
+            ).all()
+            if keys:
+                db.execute(
+                    delete(IdempotencyKey)
+                    .where(tuple_(IdempotencyKey.email, IdempotencyKey.key).in_([tuple(k) for k in keys]))
+                    .execution_options(synchronize_session=False)
+                )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        total += len(keys)
+        if len(keys) < batch_size:
+            break
+        time.sleep(pause)
+    return total
+
+
+class RetentionWorker:
+    """Background thread running a retention sweep every SESSION_RETENTION_INTERVAL seconds."""
+    def __init__(self, session_factory: Callable, days: float = SESSION_RETENTION_DAYS,
+                 interval: float = SESSION_RETENTION_INTERVAL):
+        self.session_factory = session_factory
+        self.days = days
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def sweep(self) -> int:
+        sessions = purge_expired_sessions(self.session_factory, self.days, stop=self._stop)
+        keys = purge_expired_idempotency_keys(self.session_factory)
+        if sessions or keys:
+            logger.info(f"Retention sweep deleted {sessions} sessions and {keys} idempotency records")
+        return sessions
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Retention sweep failed: {str(e)}")
+            self._stop.wait(self.interval)
+
+
+worker: Optional[RetentionWorker] = None
+
+
+def start(session_factory: Callable) -> RetentionWorker:
+    """Start the process-wide retention worker."""
+    global worker
+    worker = RetentionWorker(session_factory)
+    worker.start()
+    return worker
+
+
+def stop() -> None:
+    global worker
+    if worker is not None:
+        worker.stop()
+        worker = None
@@ -118,6 +118,8 @@ class ChatMessageRequest(BaseModel):
     message: str
     email: EmailStr
     stage: Optional[str] = None
+    # Retries carrying the same key get the stored response instead of a new turn
+    idempotency_key: Optional[str] = Field(default=None, max_length=255)
 
 
 class ChatMessageResponse(BaseModel):
@@ -139,11 +141,43 @@ class ChatMessageResponse(BaseModel):
         return super().from_orm(obj)
 
 
+class ChatBatchItem(BaseModel):
+    """Schema for one message in a chat batch"""
+    session_id: str
+    message: str
+
+
+class ChatBatchRequest(BaseModel):
+    """Schema for chat batch request"""
+    email: EmailStr
+    items: List[ChatBatchItem]
+
+
+class ChatBatchResult(BaseModel):
+    """Schema for the result of one chat batch item"""
+    session_id: str
+    message: str
+    response: Optional[str] = None
+    analysis_complete: bool = False
+    timestamp: Optional[datetime] = None
+    error: Optional[str] = None
+
+
+class ChatBatchResponse(BaseModel):
+    """Schema for chat batch response, one result per item in request order"""
+    results: List[ChatBatchResult]
+
+
 class SessionTitleUpdate(BaseModel):
     """Schema for updating session title"""
     title: str
 
 
+class ForgetSessionsRequest(BaseModel):
+    """Schema for the sessions another cluster worker deleted"""
+    session_ids: List[str]
+
+
 class ChatSessionCreate(BaseModel):
     """Schema for creating a new chat session"""
     title: Optional[str] = None
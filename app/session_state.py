@@ -0,0 +1,132 @@
+"""
+SQL helpers for Session.ai_state.
+
+Turns persist only the parts of the state document that changed: changed
+top-level keys are replaced with jsonb_set (json_set on SQLite) and lists
+that only grew, such as chat_history, get the new items appended, so the
+whole document is not re-sent and re-parsed on every turn.
+
+Updates are optimistic: each one checks and increments Session.version, so
+concurrent turns on one session cannot silently overwrite each other.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import Text, cast, func, literal, or_, text, update
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.models import Session as DBSession
+from app.state_codec import json_serializer
+from app.vocabulary import SYMPTOM_KEYWORDS
+
+
+def diff_state(old: Dict[str, Any], new: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, List[Any]], List[str]]:
+    """
+    Compare two state documents key by key.
+
+    Returns (changed, appended, removed): keys whose value must be replaced,
+    list keys whose new value only extends the old one (mapped to the new
+    items), and keys no longer present.
+    """
+    changed: Dict[str, Any] = {}
+    appended: Dict[str, List[Any]] = {}
+    for key, value in new.items():
+        if key not in old:
+            changed[key] = value
+            continue
+        old_value = old[key]
+        if old_value == value:
+            continue
+        if (isinstance(value, list) and isinstance(old_value, list)
+                and len(value) > len(old_value) and value[:len(old_value)] == old_value):
+            appended[key] = value[len(old_value):]
+        else:
+            changed[key] = value
+    removed = [key for key in old if key not in new]
+    return changed, appended, removed
+
+
+def _patched_document(dialect: str, old: Dict[str, Any], new: Dict[str, Any]):
+    """Return a SQL expression producing `new` from the stored document, or None to replace it."""
+    if not old or dialect not in ("postgresql", "sqlite"):
+        return None
+    changed, appended, removed = diff_state(old, new)
+    if removed:
+        return None
+
+    column = DBSession.__table__.c.ai_state
+    if dialect == "postgresql":
+        document = cast(column, JSONB)
+        for key, value in changed.items():
+            document = func.jsonb_set(document, literal([key], ARRAY(Text)), literal(value, JSONB))
+        for key, items in appended.items():
+            document = func.jsonb_set(
+                document, literal([key], ARRAY(Text)),
+                cast(column, JSONB)[key].op("||")(literal(items, JSONB))
+            )
+        return document
+
+    document = column
+    for key, value in changed.items():
+        document = func.json_set(document, f'$."{key}"', func.json(json_serializer(value)))
+    for key, items in appended.items():
+        for item in items:
+            document = func.json_insert(document, f'$."{key}"[#]', func.json(json_serializer(item)))
+    return document
+
+
+class StaleStateError(Exception):
+    """The session's state was updated by someone else since it was loaded"""
+    pass
+
+
+def save_session_state(db: Session, session: DBSession, state: Dict[str, Any],
+                       expected_version: Optional[int] = None, **values: Any) -> int:
+    """
+    Persist a session's state document, along with other column `values`, in one UPDATE.
+
+    The UPDATE is a compare-and-swap on `expected_version` (default: the
+    version the session was loaded at) and raises StaleStateError when
+    another writer got there first.
+    Only the changed parts of ai_state are written where the dialect allows
+    it. The loaded `session` is updated in place without being marked dirty.
+    Does not commit. Returns the new version.
+    """
+    dialect = db.get_bind().dialect.name
+    document = _patched_document(dialect, session.ai_state or {}, state)
+    expected = expected_version if expected_version is not None else session.version or 0
+    result = db.execute(
+        update(DBSession)
+        .where(DBSession.id == session.id, DBSession.version == expected)
+        .values(ai_state=document if document is not None else state, version=expected + 1, **values)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        raise StaleStateError(f"Session {session.id} changed since version {expected}")
+    set_committed_value(session, "ai_state", state)
+    set_committed_value(session, "version", expected + 1)
+    for key, value in values.items():
+        set_committed_value(session, key, value)
+    return expected + 1
+
+
+def sessions_with_symptom(symptom: str, dialect: str):
+    """
+    Return a WHERE clause matching sessions whose extracted symptoms include `symptom`.
+
+    On PostgreSQL this is a containment test per symptom category, served by
+    the jsonb_path_ops GIN index on ai_state (which cannot serve a jsonpath
+    with a .* accessor).
+    """
+    if dialect == "postgresql":
+        categories = [category for category, names in SYMPTOM_KEYWORDS.items() if symptom in names]
+        document = cast(DBSession.__table__.c.ai_state, JSONB)
+        return or_(*(
+            document.contains(cast(literal(json_serializer({"symptoms": {category: [symptom]}}), Text), JSONB))
+            for category in categories or SYMPTOM_KEYWORDS
+        ))
+    return text(
+        "EXISTS (SELECT 1 FROM json_each(sessions.ai_state, '$.symptoms') AS category, "
+        "json_each(category.value) AS entry WHERE entry.value = :symptom)"
+    ).bindparams(symptom=symptom)
@@ -0,0 +1,100 @@
+"""
+Codec for conversation state blobs.
+
+State is stored as a JSON document carrying a `schema_version` field. Blobs
+written by older versions are migrated lazily when they are read, so no
+bulk rewrite of the sessions table is needed when the schema changes.
+orjson is used for encoding/decoding when installed, with the standard
+library json module as a fallback.
+"""
+import json
+from typing import Any, Callable, Dict, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Version 1: unversioned blobs written by ConversationState.to_dict before versioning
+# Version 2: adds schema_version; analysis/recommendations may be text
+STATE_SCHEMA_VERSION = 2
+
+
+def state_defaults() -> Dict[str, Any]:
+    """Return a new dictionary of default values for every state field."""
+    return {
+        "stage": "initial",
+        "demographics": {},
+        "symptoms": {},
+        "diagnostic_tests": {},
+        "treatments": {},
+        "lifestyle": {},
+        "chat_history": [],
+        "title": "New MS Consultation",
+        "analysis_complete": False,
+        "analysis": {},
+        "recommendations": {}
+    }
+
+
+if orjson is not None:
+    def dumps(obj: Any) -> bytes:
+        """Encode an object to compact JSON bytes."""
+        return orjson.dumps(obj)
+
+    def loads(data: Union[bytes, str]) -> Any:
+        """Decode JSON bytes or text."""
+        return orjson.loads(data)
+else:
+    def dumps(obj: Any) -> bytes:
+        """Encode an object to compact JSON bytes."""
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+    def loads(data: Union[bytes, str]) -> Any:
+        """Decode JSON bytes or text."""
+        return json.loads(data)
+
+
+def json_serializer(obj: Any) -> str:
+    """JSON serializer for SQLAlchemy JSON columns (create_engine(json_serializer=...))."""
+    return dumps(obj).decode("utf-8")
+
+
+def _migrate_v1(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Version 1 blobs may lack fields added later; fill them with defaults."""
+    return {**state_defaults(), **data}
+
+
+# Migration from version N to N + 1
+_MIGRATIONS: Dict[int, Callable[[Dict[str, Any]], Dict[str, Any]]] = {
+    1: _migrate_v1,
+}
+
+
+def migrate_state(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Bring a stored state blob up to STATE_SCHEMA_VERSION.
+
+    Returns the blob unchanged when it is already current.
+    """
+    version = data.get("schema_version", 1)
+    if version == STATE_SCHEMA_VERSION:
+        return data
+    if version > STATE_SCHEMA_VERSION:
+        raise ValueError(f"State schema version {version} is newer than supported {STATE_SCHEMA_VERSION}")
+    while version < STATE_SCHEMA_VERSION:
+        data = _MIGRATIONS[version](data)
+        version += 1
+    data["schema_version"] = STATE_SCHEMA_VERSION
+    return data
+
+
+def encode_state(state) -> bytes:
+    """Encode a ConversationState to versioned JSON bytes."""
+    return dumps(state.to_dict())
+
+
+def decode_state(blob: Union[bytes, str]):
+    """Decode versioned JSON bytes into a ConversationState, migrating old blobs."""
+    from app.ms_health_ai import ConversationState
+    return ConversationState.from_dict(loads(blob), fresh=True)
@@ -0,0 +1,204 @@
+"""
+Conversation state stores fronting Session.ai_state.
+
+The database row stays the source of truth. A state store keeps copies of
+recently used state documents so a turn can skip loading (and decoding)
+the ai_state column. STATE_STORE selects the backend:
+
+- "database" (default): no store, state is always read from the session row
+- "memory": an in-process LRU of STATE_STORE_MAX_ENTRIES decoded documents
+- "redis": a Redis-protocol server at STATE_STORE_URL, shared by every worker;
+  entries expire after STATE_STORE_TTL seconds
+
+Each entry carries the session version it was stored at. A reader only
+uses an entry whose version matches the session row (read on its own, see
+StateManager.load_session), so an entry left behind by a failed commit, a concurrent writer or another
+worker is ignored rather than trusted. Entries are published only after the
+database transaction (or write-behind journal append) that made them current.
+"""
+import os
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, NamedTuple, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.state_codec import dumps, loads
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+STATE_STORE = os.getenv("STATE_STORE", "database").lower()
+STATE_STORE_URL = os.getenv("STATE_STORE_URL", "redis://localhost:6379/0")
+STATE_STORE_MAX_ENTRIES = int(os.getenv("STATE_STORE_MAX_ENTRIES", "10000"))
+STATE_STORE_TTL = int(os.getenv("STATE_STORE_TTL", "86400"))
+
+# Session.info key holding states to publish once the transaction commits
+PENDING_KEY = "state_store_pending"
+
+
+class StoredState(NamedTuple):
+    version: int
+    state: Dict[str, Any]
+
+
+def encode(version: int, state: Dict[str, Any]) -> bytes:
+    return dumps({"version": version, "state": state})
+
+
+def decode(raw: Optional[bytes]) -> Optional[StoredState]:
+    if raw is None:
+        return None
+    try:
+        entry = loads(raw)
+        return StoredState(entry["version"], entry["state"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+class StateStore(ABC):
+    """
+    Interface of a state store, keyed by session id. The states it returns
+    may be shared with other readers and must not be modified
+    (ConversationState.from_dict copies what it keeps).
+    """
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[StoredState]:
+        ...
+
+    def put(self, session_id: str, version: int, state: Dict[str, Any]) -> None:
+        self._put(session_id, encode(version, state))
+
+    @abstractmethod
+    def discard(self, session_ids: Iterable[str]) -> None:
+        ...
+
+    @abstractmethod
+    def _put(self, session_id: str, raw: bytes) -> None:
+        """Store an encoded entry (see encode)."""
+        ...
+
+
+class LRUStateStore(StateStore):
+    """
+    In-process store holding the `max_entries` most recently used documents,
+    decoded once when stored rather than on every read.
+    """
+    def __init__(self, max_entries: int = STATE_STORE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, StoredState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Optional[StoredState]:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                self._entries.move_to_end(session_id)
+            return entry
+
+    def _put(self, session_id: str, raw: bytes) -> None:
+        # Decoded from the encoded copy, so the entry shares nothing with the caller's state
+        entry = decode(raw)
+        if entry is None:
+            return
+        with self._lock:
+            self._entries[session_id] = entry
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, session_ids: Iterable[str]) -> None:
+        with self._lock:
+            for session_id in session_ids:
+                self._entries.pop(session_id, None)
+
+
+class RedisStateStore(StateStore):
+    """
+    Store on a Redis-protocol server, shared by every API process.
+
+    `client` needs get, set(ex=) and delete; server errors are logged and
+    treated as misses, so an unavailable store only costs database reads.
+    """
+    def __init__(self, client, ttl: int = STATE_STORE_TTL, prefix: str = "ms:state:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, session_id: str) -> Optional[StoredState]:
+        try:
+            raw = self.client.get(self.prefix + session_id)
+        except Exception as e:
+            logger.error(f"State store read failed: {str(e)}")
+            return None
+        return decode(raw)
+
+    def _put(self, session_id: str, raw: bytes) -> None:
+        try:
+            self.client.set(self.prefix + session_id, raw, ex=self.ttl)
+        except Exception as e:
+            logger.error(f"State store write failed: {str(e)}")
+
+    def discard(self, session_ids: Iterable[str]) -> None:
+        keys = [self.prefix + session_id for session_id in session_ids]
+        if not keys:
+            return
+        try:
+            self.client.delete(*keys)
+        except Exception as e:
+            logger.error(f"State store delete failed: {str(e)}")
+
+
+def create_store(backend: str = STATE_STORE) -> Optional[StateStore]:
+    if backend == "database":
+        return None
+    if backend == "memory":
+        return LRUStateStore()
+    if backend == "redis":
+        if redis is None:
+            raise RuntimeError("STATE_STORE=redis requires the redis package")
+        return RedisStateStore(redis.Redis.from_url(STATE_STORE_URL))
+    raise ValueError(f"Unknown STATE_STORE: {backend}")
+
+
+store: Optional[StateStore] = create_store()
+
+
+def publish_after_commit(db: Session, session_id: str, version: int, state: Dict[str, Any]) -> None:
+    """Publish a state to the store once `db`'s current transaction commits."""
+    if store is not None:
+        # Encoded now, so later changes to `state` are not published
+        db.info.setdefault(PENDING_KEY, {})[session_id] = encode(version, state)
+
+
+def publish(session_id: str, version: int, state: Dict[str, Any]) -> None:
+    if store is not None:
+        store.put(session_id, version, state)
+
+
+def discard(session_ids: Iterable[str]) -> None:
+    if store is not None:
+        store.discard([str(session_id) for session_id in session_ids])
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed(db: Session) -> None:
+    pending = db.info.pop(PENDING_KEY, None)
+    if pending and store is not None:
+        for session_id, raw in pending.items():
+            store._put(session_id, raw)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_rolled_back(db: Session) -> None:
+    db.info.pop(PENDING_KEY, None)
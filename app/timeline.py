@@ -0,0 +1,209 @@
+"""
+Per-user timeline of extracted observations.
+
+Each turn that extracts a new symptom, test, finding or treatment (the
+cohort index terms) appends an Observation row for the user, in the same
+transaction as the session update (or in the write-behind flush that
+applies it). The same transaction increments the user's day, week and
+month ObservationRollup rows, so a timeline query reads at most
+TIMELINE_MAX_POINTS rows however long the history: raw observations for
+short ranges, otherwise the finest rollup with few enough periods.
+"""
+import os
+import uuid
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import Date, bindparam, delete, func, insert, select, text
+from sqlalchemy.orm import Session
+
+from app.models import Observation, ObservationRollup
+
+load_dotenv()
+
+TIMELINE_MAX_POINTS = int(os.getenv("TIMELINE_MAX_POINTS", "1000"))
+
+RAW = "raw"
+DAY = "day"
+WEEK = "week"
+MONTH = "month"
+RESOLUTIONS = (RAW, DAY, WEEK, MONTH)
+
+# Rollup resolutions with their approximate period length, finest first
+_PERIOD_DAYS = ((DAY, 1), (WEEK, 7), (MONTH, 30))
+
+
+def period_start(day: date, resolution: str) -> date:
+    if resolution == DAY:
+        return day
+    if resolution == WEEK:
+        return day - timedelta(days=day.weekday())
+    if resolution == MONTH:
+        return day.replace(day=1)
+    raise ValueError(f"Unknown resolution: {resolution}")
+
+
+def observations(email: str, session_id: str, terms: Iterable[str],
+                 observed_at: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """Observation rows for the "<kind>:<value>" terms a turn extracted."""
+    observed_at = observed_at or datetime.utcnow()
+    rows = []
+    for term in sorted(terms):
+        kind, _, key = term.partition(":")
+        rows.append({
+            "id": uuid.uuid4(), "email": email, "session_id": uuid.UUID(str(session_id)),
+            "observed_at": observed_at, "kind": kind, "key": key,
+        })
+    return rows
+
+
+def _rollup_counts(rows: Iterable[Dict[str, Any]]) -> Counter:
+    counts: Counter = Counter()
+    for row in rows:
+        day = row["observed_at"].date()
+        for resolution, _ in _PERIOD_DAYS:
+            counts[(row["email"], resolution, period_start(day, resolution), row["kind"], row["key"])] += 1
+    return counts
+
+
+# The same statement on PostgreSQL and SQLite. Built with text() because the dialects'
+# on_conflict_do_update() constructs are not cached and would be recompiled every turn
+_ROLLUP_UPSERT = text(
+    "INSERT INTO observation_rollups (email, resolution, period_start, kind, key, count) "
+    "VALUES (:email, :resolution, :period_start, :kind, :key, :count) "
+    "ON CONFLICT (email, resolution, period_start, kind, key) "
+    "DO UPDATE SET count = observation_rollups.count + excluded.count"
+).bindparams(bindparam("period_start", type_=Date))
+
+_ROLLUP_KEY = "email = :email AND resolution = :resolution AND period_start = :period_start AND kind = :kind AND key = :key"
+_ROLLUP_SUBTRACT = text(
+    f"UPDATE observation_rollups SET count = count - :count WHERE {_ROLLUP_KEY}"
+).bindparams(bindparam("period_start", type_=Date))
+_ROLLUP_PRUNE = text(
+    f"DELETE FROM observation_rollups WHERE {_ROLLUP_KEY} AND count <= 0"
+).bindparams(bindparam("period_start", type_=Date))
+
+
+def append(db: Session, rows: List[Dict[str, Any]]) -> None:
+    """Insert observations and add them to their rollups. Does not commit."""
+    if not rows:
+        return
+    db.execute(insert(Observation.__table__), rows)
+    db.execute(_ROLLUP_UPSERT, [
+        {"email": email, "resolution": resolution, "period_start": start, "kind": kind, "key": key, "count": count}
+        for (email, resolution, start, kind, key), count in _rollup_counts(rows).items()
+    ])
+
+
+def to_journal(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Observation rows in the JSON form of a write-behind record."""
+    return [
+        {**row, "id": str(row["id"]), "session_id": str(row["session_id"]), "observed_at": row["observed_at"].isoformat()}
+        for row in rows
+    ]
+
+
+def from_journal(rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [
+        {**row, "id": uuid.UUID(row["id"]), "session_id": uuid.UUID(row["session_id"]),
+         "observed_at": datetime.fromisoformat(row["observed_at"])}
+        for row in rows
+    ]
+
+
+def delete_sessions(db: Session, session_ids: List[uuid.UUID]) -> None:
+    """Delete the observations of sessions and take them out of the rollups. Does not commit."""
+    rows = [
+        {"email": email, "observed_at": observed_at, "kind": kind, "key": key}
+        for email, observed_at, kind, key in db.execute(
+            select(Observation.email, Observation.observed_at, Observation.kind, Observation.key)
+            .where(Observation.session_id.in_(session_ids))
+        )
+    ]
+    if not rows:
+        return
+    keys = [
+        ({"email": email, "resolution": resolution, "period_start": start, "kind": kind, "key": key}, count)
+        for (email, resolution, start, kind, key), count in _rollup_counts(rows).items()
+    ]
+    # One executemany each; only the rollups these observations counted towards can reach zero
+    db.execute(_ROLLUP_SUBTRACT, [{**key, "count": count} for key, count in keys])
+    db.execute(_ROLLUP_PRUNE, [key for key, _ in keys])
+    db.execute(
+        delete(Observation).where(Observation.session_id.in_(session_ids))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def delete_user(db: Session, email: str) -> None:
+    """Delete a user's whole timeline. Does not commit."""
+    db.execute(delete(Observation).where(Observation.email == email).execution_options(synchronize_session=False))
+    db.execute(
+        delete(ObservationRollup).where(ObservationRollup.email == email).execution_options(synchronize_session=False)
+    )
+
+
+def choose_resolution(db: Session, email: str, start: date, end: date, kind: Optional[str] = None) -> str:
+    """Raw if the range has at most TIMELINE_MAX_POINTS observations, else the finest rollup with few enough periods."""
+    query = select(Observation.id).where(
+        Observation.email == email,
+        Observation.observed_at >= datetime.combine(start, time.min),
+        Observation.observed_at < datetime.combine(end + timedelta(days=1), time.min),
+    )
+    if kind:
+        query = query.where(Observation.kind == kind)
+    # Counting stops at the limit, so this is bounded however many observations there are
+    limited = db.scalar(select(func.count()).select_from(query.limit(TIMELINE_MAX_POINTS + 1).subquery()))
+    if limited <= TIMELINE_MAX_POINTS:
+        return RAW
+    days = (end - start).days + 1
+    for resolution, period in _PERIOD_DAYS:
+        if days / period <= TIMELINE_MAX_POINTS:
+            return resolution
+    return MONTH
+
+
+def query(db: Session, email: str, start: date, end: date, resolution: str,
+          kind: Optional[str] = None) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    Timeline points between `start` and `end` (inclusive) at `resolution`,
+    oldest first, and whether they were cut off at TIMELINE_MAX_POINTS.
+    """
+    if resolution == RAW:
+        statement = (
+            select(Observation.observed_at, Observation.kind, Observation.key, Observation.session_id)
+            .where(
+                Observation.email == email,
+                Observation.observed_at >= datetime.combine(start, time.min),
+                Observation.observed_at < datetime.combine(end + timedelta(days=1), time.min),
+            )
+            .order_by(Observation.observed_at, Observation.kind, Observation.key)
+        )
+        if kind:
+            statement = statement.where(Observation.kind == kind)
+        rows = db.execute(statement.limit(TIMELINE_MAX_POINTS + 1)).all()
+        points = [
+            {"time": observed_at, "kind": row_kind, "key": key, "count": 1, "session_id": str(session_id)}
+            for observed_at, row_kind, key, session_id in rows[:TIMELINE_MAX_POINTS]
+        ]
+        return points, len(rows) > TIMELINE_MAX_POINTS
+
+    statement = (
+        select(ObservationRollup.period_start, ObservationRollup.kind, ObservationRollup.key, ObservationRollup.count)
+        .where(
+            ObservationRollup.email == email,
+            ObservationRollup.resolution == resolution,
+            ObservationRollup.period_start.between(period_start(start, resolution), end),
+        )
+        .order_by(ObservationRollup.period_start, ObservationRollup.kind, ObservationRollup.key)
+    )
+    if kind:
+        statement = statement.where(ObservationRollup.kind == kind)
+    rows = db.execute(statement.limit(TIMELINE_MAX_POINTS + 1)).all()
+    points = [
+        {"time": start_day, "kind": row_kind, "key": key, "count": int(count)}
+        for start_day, row_kind, key, count in rows[:TIMELINE_MAX_POINTS]
+    ]
+    return points, len(rows) > TIMELINE_MAX_POINTS
@@ -0,0 +1,80 @@
+"""
+Keyword vocabularies used by the MSHealthAI message parsers.
+
+Kept at module level so they are built once rather than on every parse, and
+so other components (benchmarks, corpus generation) share the exact terms
+the parsers match on.
+"""
+from typing import Dict, List
+
+# Symptom name -> keywords, per symptom category
+SYMPTOM_KEYWORDS: Dict[str, Dict[str, List[str]]] = {
+    "physical": {
+        "fatigue": ["fatigue", "tired", "exhausted", "energy", "wiped out"],
+        "numbness": ["numbness", "numb", "tingling", "pins and needles"],
+        "muscle weakness": ["weakness", "weak", "muscle", "strength"],
+        "vision problems": ["vision", "sight", "eye", "blurry", "blurred"],
+        "balance problems": ["balance", "unsteady", "dizzy", "vertigo"],
+        "pain": ["pain", "ache", "hurt", "sore"],
+        "walking difficulties": ["walking", "walk", "mobility", "gait"],
+        "coordination problems": ["coordination", "clumsy", "uncoordinated"],
+        "tremors": ["tremor", "shaking", "trembling"],
+        "spasticity": ["spasticity", "stiff", "rigid", "tight"],
+        "bladder problems": ["bladder", "urination", "incontinence"],
+        "bowel problems": ["bowel", "constipation", "diarrhea"],
+        "sexual dysfunction": ["sexual", "libido", "erection", "orgasm"]
+    },
+    "cognitive": {
+        "memory problems": ["memory", "forget", "remember", "recall"],
+        "difficulty concentrating": ["concentration", "focus", "attention", "distracted"],
+        "brain fog": ["fog", "cloudy", "confused", "fuzzy"],
+        "information processing": ["processing", "slow", "thinking", "thought"],
+        "executive function": ["planning", "organization", "decision", "judgment"],
+        "visual-spatial problems": ["spatial", "depth", "distance", "judge"]
+    },
+    "emotional": {
+        "depression": ["depression", "depressed", "sad", "down", "low"],
+        "anxiety": ["anxiety", "anxious", "worry", "nervous", "stress"],
+        "mood swings": ["mood", "irritable", "emotional", "moody"],
+        "emotional lability": ["lability", "emotional", "mood changes"],
+        "stress": ["stress", "stressed", "overwhelmed"],
+        "irritability": ["irritable", "irritated", "angry", "frustrated"]
+    }
+}
+
+SYMPTOM_CATEGORIES: List[str] = ["physical", "cognitive", "emotional"]
+
+# Gender -> keywords, checked in this order
+GENDER_KEYWORDS: Dict[str, List[str]] = {
+    "male": ["male", "man", "boy", "m"],
+    "female": ["female", "woman", "girl", "f"],
+    "non-binary": ["non-binary", "nonbinary", "other", "nb"]
+}
+
+# Diagnostic test terms
+MRI_TERMS: List[str] = ["mri"]
+BLOOD_TEST_TERMS: List[str] = ["blood test", "blood work", "blood"]
+LESION_TERMS: List[str] = ["lesion"]
+NORMAL_TERMS: List[str] = ["normal"]
+
+# Common MS medications, matched as substrings and reported title-cased
+MS_MEDICATIONS: List[str] = [
+    "interferon", "copaxone", "glatiramer", "tecfidera", "dimethyl fumarate",
+    "gilenya", "fingolimod", "tysabri", "natalizumab", "ocrevus", "ocrelizumab"
+]
+GENERIC_TREATMENT_TERMS: List[str] = ["medication", "drug", "treatment", "taking"]
+
+# Lifestyle category -> keywords
+LIFESTYLE_KEYWORDS: Dict[str, List[str]] = {
+    "diet": ["diet", "eat", "food", "nutrition"],
+    "exercise": ["exercise", "workout", "gym", "walk", "run", "sport"],
+    "stress_management": ["stress", "relax", "meditation", "yoga"]
+}
+
+# Initial-stage intent -> exact phrases, matched on whole tokens; earlier
+# intents win when a message contains phrases of several
+INTENT_PHRASES: Dict[str, List[str]] = {
+    "greeting": ["hi", "hello", "hey", "greetings", "good morning", "good afternoon", "good evening"],
+    "ms_question": ["what is ms", "what is multiple sclerosis", "tell me about ms", "explain ms"],
+    "help": ["help", "guide", "what can you do", "how can you help"]
+}
@@ -0,0 +1,516 @@
+"""
+Write-behind persistence for chat turns.
+
+With CHAT_WRITE_BEHIND=true, /chat returns as soon as a turn (the new
+session state plus its chat messages) has been appended to a local
+journal and fsynced. A background thread then drains the journal into the
+database: session updates are coalesced so each session is written once per
+flush with its latest state, and chat messages are bulk-inserted, referencing
+their responses in chat_responses (see app/response_store.py).
+
+The journal is a directory of append-only JSONL segments. Each flush
+rotates to a new segment and deletes the old ones once the database
+transaction has committed. On startup any segments left by a crash are
+replayed before requests are served; message and timeline observation ids
+are assigned when a turn is journaled, so a segment replayed after its flush
+already committed does not insert duplicates.
+
+Until a turn is flushed it is only visible in this process: the conversation
+engine and the read endpoints consult pending_state()/pending_messages()
+before the database.
+
+When the queue is full, enqueue waits up to WRITE_BEHIND_ENQUEUE_TIMEOUT
+seconds for the flush thread and then raises QueueFullError (a 503 from
+/chat). A batch that fails WRITE_BEHIND_MAX_ATTEMPTS flushes in a row is
+written one record at a time; records that still fail are appended to
+dead-letter.jsonl in the journal directory, logged, and dropped, so one bad
+record cannot stall the queue.
+
+Each record carries the session version it produces, and enqueue rejects a
+turn that does not follow the latest version queued by this process. The
+flush writes versions without checking them, so with several API processes
+a session's turns must all go to one process (see app/cluster.py).
+"""
+import os
+import glob
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from dotenv import load_dotenv
+from sqlalchemy import insert, update, select
+
+from app import reports, response_store, timeline
+from app.models import Session as DBSession, ChatMessage, IdempotencyKey, Observation
+from app.session_state import StaleStateError
+from app.state_codec import dumps, loads
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CHAT_WRITE_BEHIND = os.getenv("CHAT_WRITE_BEHIND", "False").lower() == "true"
+WRITE_BEHIND_DIR = os.getenv("WRITE_BEHIND_DIR", "write_behind")
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "0.05"))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000"))
+# Seconds enqueue waits for room in a full queue before giving up
+WRITE_BEHIND_ENQUEUE_TIMEOUT = float(os.getenv("WRITE_BEHIND_ENQUEUE_TIMEOUT", "5"))
+# Failed flushes of a batch before its records are written (or dead-lettered) one at a time
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", "5"))
+# fsync each journaled turn; false survives a process crash but not power loss
+WRITE_BEHIND_FSYNC = os.getenv("WRITE_BEHIND_FSYNC", "True").lower() == "true"
+
+SEGMENT_PATTERN = "segment-*.jsonl"
+DEAD_LETTER_FILE = "dead-letter.jsonl"
+
+
+class QueueFullError(Exception):
+    """The write-behind queue stayed full for the whole enqueue timeout"""
+    pass
+
+
+class PendingSession:
+    """Latest journaled but unflushed state of one session, with its unflushed messages"""
+    __slots__ = ("seq", "state", "version", "messages")
+
+    def __init__(self, seq: int, state: Dict[str, Any], version: Optional[int]):
+        self.seq = seq
+        self.state = state
+        self.version = version
+        self.messages: List[tuple] = []
+
+
+class WriteBehindQueue:
+    """Durable journal of chat turns drained into the database by a background thread."""
+    def __init__(self, session_factory: Callable, directory: str = WRITE_BEHIND_DIR,
+                 flush_interval: float = WRITE_BEHIND_FLUSH_INTERVAL,
+                 max_pending: int = WRITE_BEHIND_MAX_PENDING, fsync: bool = WRITE_BEHIND_FSYNC,
+                 enqueue_timeout: float = WRITE_BEHIND_ENQUEUE_TIMEOUT,
+                 max_attempts: int = WRITE_BEHIND_MAX_ATTEMPTS):
+        self.session_factory = session_factory
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.fsync = fsync
+        self.enqueue_timeout = enqueue_timeout
+        self.max_attempts = max_attempts
+
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self._seq = 0
+        # Consecutive failed flushes of the records at the head of the buffer
+        self._failures = 0
+        self._segment_index = 0
+        self._segment = None
+        self._closed_segments: List[str] = []
+        self._buffer: List[Dict[str, Any]] = []
+        self._pending: Dict[str, PendingSession] = {}
+        # Versions of recently flushed sessions, so turns racing a flush are still checked
+        self._flushed_versions: "OrderedDict[str, int]" = OrderedDict()
+        self._lock_file = None
+
+    # Lifecycle
+
+    def start(self) -> None:
+        """Replay segments left by a previous run, then start the flush thread."""
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_directory()
+        segments = sorted(glob.glob(os.path.join(self.directory, SEGMENT_PATTERN)))
+        if segments:
+            self._recover(segments)
+            self._segment_index = int(os.path.basename(segments[-1])[8:-6]) + 1
+        self._open_segment()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Flush everything still queued and stop the flush thread."""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        with self._lock:
+            if self._segment is not None:
+                self._segment.close()
+                self._segment = None
+                path = self._segment_path(self._segment_index)
+                if os.path.getsize(path) == 0:
+                    os.remove(path)
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    # Producer side
+
+    def enqueue(self, session_id: str, email: str, state: Dict[str, Any], stage: str,
+                analysis_complete: bool, messages: List[Dict[str, Any]],
+                idempotency: Optional[Dict[str, Any]] = None,
+                last_updated: Optional[datetime] = None,
+                version: Optional[int] = None,
+                observations: Optional[List[Dict[str, Any]]] = None,
+                report: bool = False) -> List[Dict[str, Any]]:
+        """
+        Journal one session's turn(s) and return once the record is durable.
+
+        `messages` are dicts with message, response, stage and timestamp;
+        each is given an id. The session's last_updated is set to
+        `last_updated` (default now). With `version`, the turn must follow
+        the latest version this queue knows of for the session, or
+        StaleStateError is raised and nothing is journaled. If the queue is
+        still full after enqueue_timeout seconds, QueueFullError is raised
+        and nothing is journaled. `observations`
+        are timeline rows (see timeline.observations) written with the turn.
+        With `report`, the session's report is materialized from `state`
+        when the turn is written (see app/reports.py). Returns the journaled
+        messages.
+        """
+        now = last_updated or datetime.utcnow()
+        messages = [
+            {**message, "id": str(uuid.uuid4()), "timestamp": (message.get("timestamp") or now).isoformat()}
+            for message in messages
+        ]
+        record = {
+            "session_id": session_id,
+            "email": email,
+            "state": state,
+            "stage": stage,
+            "analysis_complete": analysis_complete,
+            "last_updated": now.isoformat(),
+            "messages": messages,
+        }
+        if idempotency is not None:
+            record["idempotency"] = idempotency
+        if observations:
+            record["observations"] = timeline.to_journal(observations)
+        if report:
+            record["report"] = True
+
+        with self._cond:
+            # Backpressure: wait for the flush thread rather than grow without bound
+            deadline = time.monotonic() + self.enqueue_timeout
+            while len(self._buffer) >= self.max_pending and not self._stop.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise QueueFullError(f"Write-behind queue still full after {self.enqueue_timeout}s")
+                self._cond.notify_all()
+                self._cond.wait(min(self.flush_interval, remaining))
+            if version is not None:
+                pending = self._pending.get(session_id)
+                known = pending.version if pending is not None else self._flushed_versions.get(session_id)
+                if known is not None and known != version - 1:
+                    raise StaleStateError(f"Session {session_id} changed since version {version - 1}")
+                record["version"] = version
+            self._seq += 1
+            record["seq"] = self._seq
+            self._segment.write(dumps(record) + b"\n")
+            self._segment.flush()
+            if self.fsync:
+                os.fsync(self._segment.fileno())
+            self._buffer.append(record)
+
+            pending = self._pending.get(session_id)
+            if pending is None:
+                pending = self._pending[session_id] = PendingSession(self._seq, state, version)
+            pending.seq = self._seq
+            pending.state = state
+            pending.version = version
+            pending.messages.extend((self._seq, message) for message in messages)
+            self._cond.notify_all()
+        return messages
+
+    def pending_state(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            pending = self._pending.get(session_id)
+            return pending.state if pending is not None else None
+
+    def pending_entry(self, session_id: str) -> Optional[Tuple[Dict[str, Any], Optional[int]]]:
+        """Latest unflushed state of a session together with its version."""
+        with self._lock:
+            pending = self._pending.get(session_id)
+            return (pending.state, pending.version) if pending is not None else None
+
+    def pending_messages(self, session_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            pending = self._pending.get(session_id)
+            return [message for _, message in pending.messages] if pending is not None else []
+
+    def discard(self, session_ids) -> None:
+        """Forget queued turns of deleted sessions; flushes skip them too."""
+        session_ids = set(session_ids)
+        with self._cond:
+            self._buffer = [record for record in self._buffer if record["session_id"] not in session_ids]
+            for session_id in session_ids:
+                self._pending.pop(session_id, None)
+                self._flushed_versions.pop(session_id, None)
+            self._cond.notify_all()
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._buffer)
+
+    # Flushing
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            with self._cond:
+                # Let a batch accumulate for flush_interval, or until the queue is full
+                self._cond.wait_for(
+                    lambda: self._stop.is_set() or len(self._buffer) >= self.max_pending,
+                    timeout=self.flush_interval
+                )
+            if self._stop.is_set():
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Write-behind flush failed, retrying: {str(e)}")
+                self._stop.wait(1.0)
+
+    def flush(self) -> int:
+        """
+        Write all queued records to the database; returns the number of
+        records written. After max_attempts failures in a row the records
+        are written one at a time and those that still fail are dead-lettered.
+        """
+        with self._flush_lock:
+            with self._cond:
+                if not self._buffer:
+                    return 0
+                records, self._buffer = self._buffer, []
+                self._rotate_segment()
+                closed = list(self._closed_segments)
+            dead: List[Dict[str, Any]] = []
+            try:
+                if self._failures < self.max_attempts:
+                    self._apply(records)
+                else:
+                    dead = self._apply_each(records)
+            except Exception:
+                # Keep the records (and their segments) for the next attempt
+                self._failures += 1
+                with self._cond:
+                    self._buffer[:0] = records
+                raise
+            self._failures = 0
+            dead_sessions = {record["session_id"] for record in dead}
+
+            for path in closed:
+                os.remove(path)
+            flushed_seq = records[-1]["seq"]
+            with self._cond:
+                self._closed_segments = self._closed_segments[len(closed):]
+                for session_id in {record["session_id"] for record in records}:
+                    pending = self._pending.get(session_id)
+                    if pending is None:
+                        continue
+                    if pending.seq <= flushed_seq:
+                        del self._pending[session_id]
+                        if session_id in dead_sessions:
+                            # The database may be behind the journaled versions; check against it again
+                            self._flushed_versions.pop(session_id, None)
+                        elif pending.version is not None:
+                            self._flushed_versions[session_id] = pending.version
+                            self._flushed_versions.move_to_end(session_id)
+                            while len(self._flushed_versions) > self.max_pending:
+                                self._flushed_versions.popitem(last=False)
+                    else:
+                        pending.messages = [m for m in pending.messages if m[0] > flushed_seq]
+                self._cond.notify_all()
+            return len(records) - len(dead)
+
+    def _apply_each(self, records: List[Dict[str, Any]], skip_existing: bool = False) -> List[Dict[str, Any]]:
+        """Write records in separate transactions, dead-lettering those that fail; returns them."""
+        dead = []
+        for record in records:
+            try:
+                self._apply([record], skip_existing)
+            except Exception as e:
+                logger.error(f"Write-behind record {record['seq']} for session {record['session_id']} "
+                             f"failed, moving it to {DEAD_LETTER_FILE}: {str(e)}")
+                dead.append(record)
+        if dead:
+            with open(os.path.join(self.directory, DEAD_LETTER_FILE), "ab") as f:
+                for record in dead:
+                    f.write(dumps(record) + b"\n")
+                f.flush()
+                os.fsync(f.fileno())
+        return dead
+
+    def _apply(self, records: List[Dict[str, Any]], skip_existing: bool = False) -> None:
+        """Coalesce records into one transaction: bulk message insert plus one update per session."""
+        latest: Dict[str, Dict[str, Any]] = {}
+        for record in records:
+            latest[record["session_id"]] = record
+
+        db = self.session_factory()
+        try:
+            # Sessions deleted while their turns were queued are dropped
+            live = {
+                str(session_id) for session_id in db.scalars(
+                    select(DBSession.id).where(DBSession.id.in_([uuid.UUID(s) for s in latest]))
+                )
+            }
+            messages: List[Dict[str, Any]] = []
+            keys: List[Dict[str, Any]] = []
+            observations: List[Dict[str, Any]] = []
+            for record in records:
+                if record["session_id"] not in live:
+                    continue
+                if record.get("report"):
+                    reports.save(db, record["session_id"], record.get("version", 0), record["state"])
+                for message in record["messages"]:
+                    messages.append({
+                        "id": uuid.UUID(message["id"]),
+                        "session_id": uuid.UUID(record["session_id"]),
+                        "message": message["message"],
+                        "response": message["response"],
+                        "stage": message["stage"],
+                        "timestamp": datetime.fromisoformat(message["timestamp"]),
+                    })
+                if "idempotency" in record:
+                    keys.append(record["idempotency"])
+                observations.extend(timeline.from_journal(record.get("observations", ())))
+
+            if skip_existing and messages:
+                existing = set(db.scalars(
+                    select(ChatMessage.id).where(ChatMessage.id.in_([m["id"] for m in messages]))
+                ))
+                messages = [m for m in messages if m["id"] not in existing]
+            if messages:
+                db.execute(insert(ChatMessage), response_store.reference(db, messages))
+            if skip_existing and observations:
+                existing = set(db.scalars(
+                    select(Observation.id).where(Observation.id.in_([o["id"] for o in observations]))
+                ))
+                observations = [o for o in observations if o["id"] not in existing]
+            timeline.append(db, observations)
+            updates = [
+                {
+                    "id": uuid.UUID(session_id),
+                    "ai_state": record["state"],
+                    "stage": record["stage"],
+                    "analysis_complete": record["analysis_complete"],
+                    "last_updated": datetime.fromisoformat(record["last_updated"]),
+                    **({"version": record["version"]} if "version" in record else {}),
+                }
+                for session_id, record in latest.items() if session_id in live
+            ]
+            if updates:
+                db.execute(update(DBSession), updates)
+            for key in keys:
+                db.merge(IdempotencyKey(
+                    email=key["email"],
+                    key=key["key"],
+                    request_hash=key["request_hash"],
+                    session_id=key["session_id"],
+                    response=key["response"],
+                    created_at=datetime.fromisoformat(key["created_at"])
+                ))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    # Journal segments
+
+    def _lock_directory(self) -> None:
+        """Take an exclusive lock on the journal directory; each process needs its own."""
+        self._lock_file = open(os.path.join(self.directory, "lock"), "w")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._lock_file.close()
+                self._lock_file = None
+                raise RuntimeError(f"Write-behind journal {self.directory} is in use by another process")
+
+    def _segment_path(self, index: int) -> str:
+        return os.path.join(self.directory, f"segment-{index:012d}.jsonl")
+
+    def _open_segment(self) -> None:
+        self._segment = open(self._segment_path(self._segment_index), "ab")
+
+    def _rotate_segment(self) -> None:
+        """Close the active segment (its records are being flushed) and start a new one."""
+        self._segment.close()
+        self._closed_segments.append(self._segment_path(self._segment_index))
+        self._segment_index += 1
+        self._open_segment()
+
+    def _recover(self, segments: List[str]) -> None:
+        records: List[Dict[str, Any]] = []
+        for path in segments:
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        records.append(loads(line))
+                    except ValueError:
+                        # A torn final line from a crash mid-write was never acknowledged
+                        logger.warning(f"Skipping incomplete write-behind record in {path}")
+        if records:
+            logger.info(f"Replaying {len(records)} write-behind records from {len(segments)} segments")
+            try:
+                self._apply(records, skip_existing=True)
+            except Exception as e:
+                logger.error(f"Write-behind replay failed, replaying records one at a time: {str(e)}")
+                self._apply_each(records, skip_existing=True)
+        for path in segments:
+            os.remove(path)
+
+
+queue: Optional[WriteBehindQueue] = None
+
+
+def start(session_factory: Callable) -> WriteBehindQueue:
+    """Start the process-wide write-behind queue."""
+    global queue
+    queue = WriteBehindQueue(session_factory)
+    queue.start()
+    return queue
+
+
+def stop() -> None:
+    global queue
+    if queue is not None:
+        queue.stop()
+        queue = None
+
+
+def pending_state(session_id: str) -> Optional[Dict[str, Any]]:
+    """Latest unflushed state of a session, if write-behind is active and it has one."""
+    return queue.pending_state(session_id) if queue is not None else None
+
+
+def pending_entry(session_id: str) -> Optional[Tuple[Dict[str, Any], Optional[int]]]:
+    """Latest unflushed state of a session and its version, if write-behind is active and it has one."""
+    return queue.pending_entry(session_id) if queue is not None else None
+
+
+def discard(session_ids) -> None:
+    """Drop queued turns of deleted sessions, if write-behind is active."""
+    if queue is not None:
+        queue.discard(session_ids)
+
+
+def pending_messages(session_id: str) -> List[Dict[str, Any]]:
+    """Unflushed chat messages of a session, oldest first."""
+    return queue.pending_messages(session_id) if queue is not None else []
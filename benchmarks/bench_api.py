@@ -0,0 +1,187 @@
+"""
+In-process API load test: the FastAPI app driven through an async HTTP
+client over ASGI, without a network hop.
+"""
+import time
+import asyncio
+from typing import Any, Dict, List
+
+import httpx
+
+from .common import QueryCounter, summarize
+from .conversations import scripted_conversations
+
+
+async def _run_conversation(client: httpx.AsyncClient, email: str, script: List[str],
+                            latencies: List[float], errors: List[int]) -> None:
+    session_id = None
+    for message in script:
+        payload = {"email": email, "message": message}
+        if session_id:
+            payload["session_id"] = session_id
+        t0 = time.perf_counter()
+        response = await client.post("/chat", json=payload)
+        latencies.append(time.perf_counter() - t0)
+        if response.status_code != 200:
+            errors.append(response.status_code)
+            return
+        session_id = response.json()["session_id"]
+
+
+async def _load_test(conversations: int, concurrency: int) -> Dict[str, Any]:
+    from app.api import app
+    from app.database import engine
+
+    scripts = scripted_conversations(conversations)
+    latencies: List[float] = []
+    errors: List[int] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def worker(index: int, script: List[str]) -> None:
+        async with semaphore:
+            await _run_conversation(client, f"load{index % 20}@example.com", script, latencies, errors)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # Warm up routing, validation and the connection pool
+        await _run_conversation(client, "warmup@example.com", scripts[0], [], [])
+        with QueryCounter(engine) as counter:
+            started = time.perf_counter()
+            await asyncio.gather(*(worker(i, script) for i, script in enumerate(scripts)))
+            elapsed = time.perf_counter() - started
+
+    result = summarize(latencies, elapsed)
+    result["concurrency"] = concurrency
+    result["errors"] = len(errors)
+    result["queries_per_op"] = round(counter.count / max(1, len(latencies)), 2)
+    return result
+
+
+async def _batch_test(conversations: int, batch_size: int) -> Dict[str, Any]:
+    """Send whole conversations through /chat/batch, `batch_size` messages per request."""
+    from app.api import app
+    from app.database import engine
+
+    scripts = scripted_conversations(conversations)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60.0) as client:
+        email = f"batch{batch_size}@example.com"
+        session_ids = []
+        for _ in scripts:
+            response = await client.post("/session/create", json={"email": email})
+            session_ids.append(response.json()["session_id"])
+        # Interleave conversations turn by turn, as a replayed questionnaire feed would
+        items = [
+            {"session_id": session_id, "message": script[turn]}
+            for turn in range(max(len(script) for script in scripts))
+            for session_id, script in zip(session_ids, scripts)
+            if turn < len(script)
+        ]
+
+        latencies: List[float] = []
+        errors = 0
+        with QueryCounter(engine) as counter:
+            started = time.perf_counter()
+            for offset in range(0, len(items), batch_size):
+                t0 = time.perf_counter()
+                response = await client.post(
+                    "/chat/batch", json={"email": email, "items": items[offset:offset + batch_size]}
+                )
+                latencies.append(time.perf_counter() - t0)
+                if response.status_code != 200:
+                    errors += 1
+                else:
+                    errors += sum(1 for result in response.json()["results"] if result["error"])
+            elapsed = time.perf_counter() - started
+
+    # ops are messages; latencies are per batch request
+    result = summarize(latencies, elapsed, ops=len(items))
+    result["batch_size"] = batch_size
+    result["errors"] = errors
+    result["queries_per_op"] = round(counter.count / max(1, len(items)), 2)
+    return result
+
+
+async def _read_endpoints(requests: int) -> Dict[str, Any]:
+    from app.api import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        script = scripted_conversations(1)[0]
+        session_id = None
+        for message in script:
+            payload = {"email": "reader@example.com", "message": message}
+            if session_id:
+                payload["session_id"] = session_id
+            session_id = (await client.post("/chat", json=payload)).json()["session_id"]
+
+        results = {}
+        for name, path in [
+            ("session_chats", f"/session/{session_id}/chats"),
+            ("user_sessions", "/user/reader@example.com/sessions"),
+        ]:
+            latencies = []
+            started = time.perf_counter()
+            for _ in range(requests):
+                t0 = time.perf_counter()
+                await client.get(path)
+                latencies.append(time.perf_counter() - t0)
+            results[name] = summarize(latencies, time.perf_counter() - started)
+        return results
+
+
+def _write_behind_test(conversations: int, concurrency: int) -> Dict[str, Any]:
+    """The /chat load test with write-behind persistence; includes the final drain time."""
+    import tempfile
+    from app import write_behind
+    from app.database import SessionLocal
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_behind.queue = write_behind.WriteBehindQueue(SessionLocal, directory)
+        write_behind.queue.start()
+        try:
+            result = asyncio.run(_load_test(conversations, concurrency))
+        finally:
+            started = time.perf_counter()
+            write_behind.stop()
+            result["drain_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    return result
+
+
+def _response_storage() -> Dict[str, Any]:
+    """Bytes of the responses of every message written so far, against the bytes stored for them."""
+    from sqlalchemy import func, select
+    from app.database import engine
+    from app.models import ChatMessage, ChatResponse
+
+    with engine.connect() as conn:
+        references = dict(conn.execute(
+            select(ChatMessage.response_hash, func.count()).group_by(ChatMessage.response_hash)
+        ).all())
+        sizes = {
+            key: len(data) if data is not None else len(response.encode("utf-8"))
+            for key, response, data in conn.execute(select(ChatResponse.hash, ChatResponse.text, ChatResponse.data))
+        }
+    response_bytes = sum(size * references.get(key, 0) for key, size in sizes.items())
+    stored_bytes = sum(sizes.values())
+    return {
+        "messages": sum(references.values()),
+        "responses": len(sizes),
+        "response_bytes": response_bytes,
+        "stored_bytes": stored_bytes,
+        "dedup_ratio": round(response_bytes / max(1, stored_bytes), 1),
+    }
+
+
+def run(quick: bool = False) -> Dict[str, Any]:
+    scale = 5 if quick else 1
+    results = {}
+    for concurrency in (1, 8, 32):
+        results[f"chat_c{concurrency}"] = asyncio.run(_load_test(100 // scale, concurrency))
+    for concurrency in (1, 8, 32):
+        results[f"chat_write_behind_c{concurrency}"] = _write_behind_test(100 // scale, concurrency)
+    for batch_size in (1, 10, 50):
+        results[f"chat_batch_{batch_size}"] = asyncio.run(_batch_test(100 // scale, batch_size))
+    results.update(asyncio.run(_read_endpoints(500 // scale)))
+    results["response_storage"] = _response_storage()
+    return results
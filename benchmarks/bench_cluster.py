@@ -0,0 +1,134 @@
+"""
+Multi-worker load test: starts `main.py --workers N` for each worker count
+and drives /chat over real HTTP through the session-affinity router.
+
+    python -m benchmarks.bench_cluster --workers 1,2,4,8 --output cluster.json
+    python -m benchmarks.bench_cluster --database-url postgresql://... --write-behind
+
+A single worker runs uvicorn directly, without the router. SQLite admits one
+writer at a time, so use --database-url with PostgreSQL to measure scaling
+of the database-bound path.
+"""
+import os
+import sys
+import time
+import socket
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+import subprocess
+from typing import Any, Dict, List
+
+import httpx
+
+from .bench_api import _run_conversation
+from .common import configure_database, summarize, write_results
+from .conversations import scripted_conversations
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _wait_ready(url: str, timeout: float = 120.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url + "/metrics/db_pool", timeout=2.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not start")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _drive(url: str, conversations: int, concurrency: int) -> Dict[str, Any]:
+    scripts = scripted_conversations(conversations)
+    latencies: List[float] = []
+    errors: List[int] = []
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=120.0) as client:
+        async def worker(index: int, script: List[str]) -> None:
+            async with semaphore:
+                await _run_conversation(client, f"cluster{index % 50}@example.com", script, latencies, errors)
+
+        # Warm up each worker's imports and connection pool
+        await asyncio.gather(*(_run_conversation(client, f"warmup{i}@example.com", scripts[0], [], [])
+                               for i in range(8)))
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i, script) for i, script in enumerate(scripts)))
+        elapsed = time.perf_counter() - started
+
+    result = summarize(latencies, elapsed)
+    result["errors"] = len(errors)
+    return result
+
+
+def run_workers(workers: int, conversations: int, concurrency: int,
+                env: Dict[str, str], workdir: str) -> Dict[str, Any]:
+    port = _free_port()
+    env = dict(env, CLUSTER_BASE_PORT=str(_free_port()),
+               WRITE_BEHIND_DIR=os.path.join(workdir, f"write_behind-{workers}"))
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "main.py"), "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(workers)],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        url = f"http://127.0.0.1:{port}"
+        _wait_ready(url)
+        result = asyncio.run(_drive(url, conversations, concurrency))
+    finally:
+        server.terminate()
+        server.wait(60)
+    result.update({"workers": workers, "concurrency": concurrency})
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Multi-worker /chat load test")
+    parser.add_argument("--workers", default="1,2,4,8", help="Comma-separated worker counts")
+    parser.add_argument("--conversations", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--database-url", default=None,
+                        help="Database shared by the workers (default: a temporary SQLite file in WAL mode)")
+    parser.add_argument("--write-behind", action="store_true", help="Enable CHAT_WRITE_BEHIND in the workers")
+    parser.add_argument("--output", default=None, help="Optional JSON results file")
+    args = parser.parse_args(argv)
+    logging.disable(logging.INFO)
+
+    workdir = tempfile.mkdtemp(prefix="ms_cluster_")
+    env = dict(os.environ, CHAT_WRITE_BEHIND="true" if args.write_behind else "false")
+    try:
+        results = {}
+        for workers in [int(w) for w in args.workers.split(",") if w.strip()]:
+            if args.database_url:
+                env["DATABASE_URL"] = args.database_url
+            else:
+                env["DATABASE_URL"] = configure_database(os.path.join(workdir, f"cluster-{workers}.db"))
+                import sqlite3
+                with sqlite3.connect(os.path.join(workdir, f"cluster-{workers}.db")) as conn:
+                    conn.execute("PRAGMA journal_mode=WAL")
+            print(f"Running {workers} worker(s)...", file=sys.stderr)
+            results[f"chat_workers_{workers}"] = run_workers(
+                workers, args.conversations, args.concurrency, env, workdir
+            )
+            print(results[f"chat_workers_{workers}"], file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        write_results(args.output, {"cluster": results})
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
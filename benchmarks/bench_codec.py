@@ -0,0 +1,184 @@
+"""
+Session state serialization benchmarks: encode/decode time and stored size
+of 10-, 100- and 1000-turn sessions, legacy stdlib json versus the
+versioned state codec, and the time to load a
+session's state through each state store backend. Before timing the
+stores, checks how StateManager uses them (see _state_store_checks).
+"""
+import json
+from typing import Any, Dict
+
+from .common import bench
+from .corpus import ConversationGenerator
+from .fake_redis import InMemoryRedis
+
+
+def build_state(turns: int, seed: int = 0):
+    """Build a ConversationState whose chat history holds `turns` exchanges."""
+    from app.ms_health_ai import MSHealthAI, ConversationState
+
+    ai = MSHealthAI(db=None)
+    state = ConversationState.from_dict({})
+    generator = iter(ConversationGenerator(seed=seed))
+    messages = []
+    while len(messages) < turns:
+        messages.extend(next(generator)["messages"])
+    for message in messages[:turns]:
+        state.chat_history.append({"role": "user", "content": message})
+        state.chat_history.append({"role": "assistant", "content": ai._get_stage_response(state, message)})
+    return state
+
+
+def _state_load_test(turns: int, iterations: int) -> Dict[str, Any]:
+    """StateManager.load_session of one session, from the database and from each state store."""
+    from app import state_store
+    from app.database import SessionLocal, engine
+    from app.models import Session as DBSession, User
+    from app.ms_health_ai import StateManager
+
+    email = f"state{turns}@example.com"
+    db = SessionLocal()
+    try:
+        if db.query(User).filter(User.email == email).first() is None:
+            db.add(User(email=email))
+        session = DBSession(email=email, ai_state=build_state(turns).to_dict())
+        db.add(session)
+        db.commit()
+        session_id = str(session.id)
+    finally:
+        db.close()
+
+    def load() -> None:
+        db = SessionLocal()
+        try:
+            StateManager(db).load_session(session_id)
+        finally:
+            db.close()
+
+    backends = {
+        "database": None,
+        "memory": state_store.LRUStateStore(),
+        "fake_redis": state_store.RedisStateStore(InMemoryRedis()),
+    }
+    results = {}
+    previous = state_store.store
+    try:
+        for name, store in backends.items():
+            state_store.store = store
+            # The warmup load populates the store
+            results[name] = bench(load, iterations, warmup=2, engine=engine)
+    finally:
+        state_store.store = previous
+    return results
+
+
+def _state_store_checks() -> Dict[str, bool]:
+    """
+    StateManager against the Redis store on the in-memory fake: entries are
+    published only when the turn commits and only trusted at the session's
+    version, expired or evicted entries fall back to the database, and
+    server errors are misses. Raises RuntimeError when a check fails.
+    """
+    from app import state_store
+    from app.database import SessionLocal
+    from app.models import Session as DBSession, User
+    from app.ms_health_ai import StateManager
+
+    class Clock:
+        now = 0.0
+
+        def __call__(self) -> float:
+            return self.now
+
+    class Unavailable:
+        def get(self, *args, **kwargs):
+            raise ConnectionError("store down")
+
+        set = delete = get
+
+    clock = Clock()
+    store = state_store.RedisStateStore(InMemoryRedis(clock), ttl=60)
+    email = "state_store_checks@example.com"
+    checks: Dict[str, bool] = {}
+    previous = state_store.store
+    state_store.store = store
+    db = SessionLocal()
+    try:
+        if db.query(User).filter(User.email == email).first() is None:
+            db.add(User(email=email))
+        session = DBSession(email=email, ai_state={"stage": "initial"})
+        db.add(session)
+        db.commit()
+        session_id = str(session.id)
+        db.expunge_all()
+
+        manager = StateManager(db)
+        _, state = manager.load_session(session_id)
+        checks["miss_fills_store"] = store.get(session_id) == (0, {"stage": "initial"}) and state == {"stage": "initial"}
+
+        session, _ = manager.load_session(session_id)
+        manager.save_session_state(session, {"stage": "symptoms"})
+        checks["not_published_before_commit"] = store.get(session_id).version == 0
+        db.commit()
+        checks["published_after_commit"] = store.get(session_id) == (1, {"stage": "symptoms"})
+
+        session, _ = manager.load_session(session_id)
+        manager.save_session_state(session, {"stage": "tests"})
+        db.rollback()
+        db.expunge_all()
+        checks["rollback_not_published"] = store.get(session_id) == (1, {"stage": "symptoms"})
+
+        # Entries at any version but the row's are ignored and replaced
+        for name, version in [("older_version_ignored", 0), ("newer_version_ignored", 2)]:
+            store.put(session_id, version, {"stage": "stale"})
+            _, state = manager.load_session(session_id)
+            checks[name] = state == {"stage": "symptoms"} and store.get(session_id) == (1, {"stage": "symptoms"})
+            db.expunge_all()
+
+        clock.now += 61
+        checks["expired"] = store.get(session_id) is None
+        _, state = manager.load_session(session_id)
+        checks["expired_reads_database"] = state == {"stage": "symptoms"} and store.get(session_id) is not None
+        db.expunge_all()
+
+        state_store.discard([session_id])
+        checks["discarded"] = store.get(session_id) is None
+
+        lru = state_store.LRUStateStore(max_entries=2)
+        for key in ("a", "b", "a", "c"):
+            lru.put(key, 0, {})
+        checks["lru_evicts_least_recent"] = lru.get("b") is None and lru.get("a") is not None
+
+        state_store.store = state_store.RedisStateStore(Unavailable())
+        _, state = manager.load_session(session_id)
+        checks["unavailable_reads_database"] = state == {"stage": "symptoms"}
+    finally:
+        state_store.store = previous
+        db.close()
+    failed = [name for name, passed in checks.items() if not passed]
+    if failed:
+        raise RuntimeError(f"State store checks failed: {failed}")
+    return checks
+
+
+def run(quick: bool = False) -> Dict[str, Any]:
+    from app.ms_health_ai import ConversationState
+    from app.state_codec import encode_state, decode_state
+
+    results = {"state_store_checks": _state_store_checks()}
+    for turns in (10, 100, 1000):
+        state = build_state(turns)
+        iterations = max(10, (2000 if not quick else 400) // turns)
+
+        legacy_blob = json.dumps(state.to_dict())
+        codec_blob = encode_state(state)
+        results[f"turns_{turns}"] = {
+            "legacy_bytes": len(legacy_blob.encode("utf-8")),
+            "codec_bytes": len(codec_blob),
+            "legacy_encode": bench(lambda: json.dumps(state.to_dict()), iterations, warmup=2),
+            "legacy_decode": bench(lambda: ConversationState.from_dict(json.loads(legacy_blob), fresh=True), iterations, warmup=2),
+            "codec_encode": bench(lambda: encode_state(state), iterations, warmup=2),
+            "codec_decode": bench(lambda: decode_state(codec_blob), iterations, warmup=2),
+            "state_load": _state_load_test(turns, iterations),
+        }
+    return results
@@ -0,0 +1,178 @@
+"""
+Cohort search: boolean queries over N synthetic sessions (1M by default)
+answered by the cohort index's bitmaps versus a scan filtering every state
+document, plus the index's load time and posting size.
+
+"Sessions with symptom X" is also counted in SQL with
+session_state.sessions_with_symptom, over at most 200k of the sessions
+stored in a database (a temporary SQLite file, or --database-url, where
+PostgreSQL serves it from the GIN index on ai_state). The counts are
+checked against a scan of the same sessions.
+
+    python -m benchmarks.bench_cohort --sessions 1000000
+    python -m benchmarks.bench_cohort --database-url postgresql://...
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import logging
+import tempfile
+from typing import Any, Dict, List, Optional
+
+from .common import bench
+
+QUERIES = [
+    'symptom:numbness AND symptom:"vision problems" AND finding:"mri/lesions detected"',
+    "symptom:fatigue OR symptom:\"muscle weakness\"",
+    "test:mri AND NOT finding:\"mri/normal\"",
+    "treatment:copaxone AND (symptom:depression OR symptom:anxiety)",
+]
+SQL_SYMPTOMS = ["numbness", "vision problems", "depression"]
+SQL_MAX_SESSIONS = 200000
+
+
+def synthetic_states(sessions: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """State documents with a few symptoms, tests and treatments drawn from the parser vocabularies."""
+    from app.vocabulary import SYMPTOM_KEYWORDS, MS_MEDICATIONS
+
+    rng = random.Random(seed)
+    findings = ["Lesions detected", "Normal", "Results mentioned"]
+    states = []
+    for _ in range(sessions):
+        symptoms = {
+            category: rng.sample(list(names), rng.randint(0, min(2, len(names))))
+            for category, names in SYMPTOM_KEYWORDS.items()
+        }
+        tests = {}
+        if rng.random() < 0.5:
+            tests["mri"] = {"name": "Magnetic Resonance Imaging (MRI)", "findings": [rng.choice(findings)]}
+        if rng.random() < 0.3:
+            tests["blood_tests"] = {"name": "Blood Tests", "findings": [rng.choice(findings[1:])]}
+        treatments = {"current": [med.title() for med in rng.sample(MS_MEDICATIONS, rng.randint(0, 1))], "past": []}
+        states.append({"symptoms": symptoms, "diagnostic_tests": tests, "treatments": treatments})
+    return states
+
+
+def scan(states: List[Dict[str, Any]], query: str) -> int:
+    """Matching sessions by evaluating the query against every document's terms."""
+    from app.cohort_index import And, Not, Term, parse_query, state_terms
+
+    node = parse_query(query)
+
+    def matches(node, terms) -> bool:
+        if isinstance(node, Term):
+            return node.term in terms
+        if isinstance(node, Not):
+            return not matches(node.operand, terms)
+        if isinstance(node, And):
+            return all(matches(op, terms) for op in node.operands)
+        return any(matches(op, terms) for op in node.operands)
+
+    return sum(matches(node, state_terms(state)) for state in states)
+
+
+def sql(states: List[Dict[str, Any]], database_url: Optional[str] = None, quick: bool = False) -> Dict[str, Any]:
+    """Sessions with each of SQL_SYMPTOMS, counted in SQL over the states stored in a database."""
+    from sqlalchemy import create_engine, func, insert, select, text
+    from sqlalchemy.orm import Session
+    from app.models import Base, Session as DBSession
+    from app.session_state import sessions_with_symptom
+
+    path = None
+    if database_url is None:
+        path = os.path.join(tempfile.gettempdir(), "ms_bench_cohort.db")
+        if os.path.exists(path):
+            os.remove(path)
+        database_url = f"sqlite:///{path}"
+    engine = create_engine(database_url)
+    Base.metadata.create_all(bind=engine, tables=[DBSession.__table__])
+    results: Dict[str, Any] = {"dialect": engine.dialect.name, "sessions": len(states), "queries": {}}
+    with engine.connect() as conn:
+        if conn.scalar(select(func.count()).select_from(DBSession)):
+            engine.dispose()
+            raise RuntimeError("The SQL symptom counts need a database without sessions")
+    try:
+        with engine.begin() as conn:
+            for offset in range(0, len(states), 10000):
+                conn.execute(insert(DBSession), [
+                    {"id": uuid.uuid4(), "stage": "analysis", "ai_state": state}
+                    for state in states[offset:offset + 10000]
+                ])
+            if engine.dialect.name == "postgresql":
+                conn.execute(text("ANALYZE sessions"))
+        with Session(engine) as db:
+            for symptom in SQL_SYMPTOMS:
+                statement = select(func.count()).select_from(DBSession).where(
+                    sessions_with_symptom(symptom, engine.dialect.name))
+                count = db.scalar(statement)
+                expected = scan(states, f'symptom:"{symptom}"')
+                if count != expected:
+                    raise RuntimeError(f"sessions_with_symptom({symptom!r}) counted {count}, the scan {expected}")
+                timed = bench(lambda: db.scalar(statement), 3 if quick else 10, warmup=1)
+                results["queries"][symptom] = {"count": count, "sql_ms": timed["mean_ms"]}
+                if engine.dialect.name == "postgresql":
+                    plan = "\n".join(db.scalars(text("EXPLAIN " + str(statement.compile(
+                        engine, compile_kwargs={"literal_binds": True})))))
+                    results["queries"][symptom]["uses_index"] = "ix_sessions_ai_state_gin" in plan
+    finally:
+        if path is not None:
+            engine.dispose()
+            os.remove(path)
+        else:
+            with engine.begin() as conn:
+                conn.execute(DBSession.__table__.delete())
+            engine.dispose()
+    return results
+
+
+def run(quick: bool = False, sessions: int = None, database_url: Optional[str] = None) -> Dict[str, Any]:
+    from app.cohort_index import CohortIndex, state_terms
+
+    sessions = sessions or (50000 if quick else 200000)
+    states = synthetic_states(sessions)
+    index = CohortIndex()
+    started = time.perf_counter()
+    for i, state in enumerate(states):
+        index.index(f"00000000-0000-4000-8000-{i:012x}", state_terms(state))
+    results: Dict[str, Any] = {
+        "sessions": sessions,
+        "index_seconds": round(time.perf_counter() - started, 3),
+        **{key: value for key, value in index.stats().items() if key != "loaded"},
+        "queries": {},
+    }
+    scan_states = states[:min(sessions, 20000)]
+    for query in QUERIES:
+        count = index.search(query, limit=0).count
+        indexed = bench(lambda: index.search(query, limit=100), 5 if quick else 20, warmup=1)
+        scanned = bench(lambda: scan(scan_states, query), 1 if quick else 3)
+        # The scan is timed over at most 20k documents and scaled to the full cohort
+        scan_ms = scanned["mean_ms"] * sessions / len(scan_states)
+        results["queries"][query] = {
+            "count": count,
+            "index_ms": indexed["mean_ms"],
+            "scan_ms": round(scan_ms, 2),
+            "speedup": round(scan_ms / indexed["mean_ms"], 1),
+        }
+    results["sql"] = sql(states[:min(sessions, SQL_MAX_SESSIONS // (4 if quick else 1))], database_url, quick)
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Cohort search over the bitmap index")
+    parser.add_argument("--sessions", type=int, default=1000000)
+    parser.add_argument("--database-url", default=None,
+                        help="Database without sessions for the SQL symptom counts; the sessions "
+                             "added are deleted afterwards (default: a temporary SQLite file)")
+    args = parser.parse_args(argv)
+    logging.disable(logging.ERROR)
+    json.dump(run(sessions=args.sessions, database_url=args.database_url), sys.stdout, indent=2)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
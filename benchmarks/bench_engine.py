@@ -0,0 +1,129 @@
+"""
+Conversation engine benchmarks: full synthetic conversations through
+MSHealthAI.process_message, and the message parsers on a varied corpus.
+"""
+import time
+from typing import Any, Dict
+
+from .common import QueryCounter, bench, summarize, track_allocations
+from .conversations import PARSER_CORPUS, scripted_conversations
+
+
+def bench_conversations(conversations: int = 50) -> Dict[str, Any]:
+    """Drive full conversations through process_message against SQLite."""
+    from app.database import SessionLocal, engine
+    from app.ms_health_ai import MSHealthAI
+    from app.models import User, Session as DBSession
+
+    scripts = scripted_conversations(conversations)
+    email = "bench@example.com"
+
+    db = SessionLocal()
+    try:
+        if not db.query(User).filter(User.email == email).first():
+            db.add(User(email=email))
+            db.commit()
+
+        turn_latencies = []
+        conversation_latencies = []
+        with QueryCounter(engine) as counter, track_allocations() as allocations:
+            started = time.perf_counter()
+            for script in scripts:
+                session = DBSession(email=email, stage="initial", analysis_complete=False, ai_state={})
+                db.add(session)
+                db.commit()
+                session_id = str(session.id)
+
+                # A new MSHealthAI per turn, as the /chat endpoint does
+                conversation_start = time.perf_counter()
+                for message in script:
+                    t0 = time.perf_counter()
+                    MSHealthAI(db).process_message(session_id=session_id, message=message, email=email)
+                    turn_latencies.append(time.perf_counter() - t0)
+                conversation_latencies.append(time.perf_counter() - conversation_start)
+            elapsed = time.perf_counter() - started
+    finally:
+        db.close()
+
+    turns = len(turn_latencies)
+    return {
+        "turns": {
+            **summarize(turn_latencies, elapsed),
+            "queries_per_op": round(counter.count / turns, 2),
+            "alloc_net_kib_per_op": round(allocations["net_kib"] / turns, 3),
+        },
+        "conversations": summarize(conversation_latencies, elapsed),
+    }
+
+
+def bench_parsers(passes: int = 200) -> Dict[str, Any]:
+    """Run each message parser over the whole parser corpus `passes` times."""
+    from app.message_parsing import ParsedMessage
+    from app.ms_health_ai import MSHealthAI
+
+    ai = MSHealthAI(db=None)
+    parsers = {
+        "demographics": ai._parse_demographics,
+        "symptoms": ai._parse_symptoms,
+        "diagnostic_tests": ai._parse_diagnostic_tests,
+        "treatments": ai._parse_treatments,
+        "lifestyle": ai._parse_lifestyle,
+        "mycotoxin_tests": ai._parse_mycotoxin_tests,
+    }
+
+    results = {}
+    for name, parser in parsers.items():
+        def run_corpus(parser=parser):
+            for message in PARSER_CORPUS:
+                parser(message)
+        result = bench(run_corpus, iterations=passes, warmup=2)
+        result["messages_per_sec"] = round(result["ops_per_sec"] * len(PARSER_CORPUS), 2)
+        results[name] = result
+
+    def run_all():
+        for message in PARSER_CORPUS:
+            for parser in parsers.values():
+                parser(message)
+    results["all_parsers"] = bench(run_all, iterations=passes, warmup=2)
+    results["all_parsers"]["messages_per_sec"] = round(
+        results["all_parsers"]["ops_per_sec"] * len(PARSER_CORPUS), 2
+    )
+
+    # As in a turn: the message is preprocessed once and shared by every parser
+    def run_all_shared():
+        for message in PARSER_CORPUS:
+            parsed = ParsedMessage(message)
+            for parser in parsers.values():
+                parser(parsed)
+    results["all_parsers_shared"] = bench(run_all_shared, iterations=passes, warmup=2)
+    results["all_parsers_shared"]["messages_per_sec"] = round(
+        results["all_parsers_shared"]["ops_per_sec"] * len(PARSER_CORPUS), 2
+    )
+    return results
+
+
+def bench_state_roundtrip(iterations: int = 2000) -> Dict[str, Any]:
+    """Measure ConversationState to_dict/from_dict for a conversation up to the lifestyle stage."""
+    from app.ms_health_ai import MSHealthAI, ConversationState
+
+    ai = MSHealthAI(db=None)
+    state = ConversationState.from_dict({})
+    # Stop before the lifestyle turn so the state stays in its pre-analysis shape
+    for message in scripted_conversations(1)[0][:-1]:
+        state.chat_history.append({"role": "user", "content": message})
+        state.chat_history.append({"role": "assistant", "content": ai._get_stage_response(state, message)})
+    data = state.to_dict()
+
+    return {
+        "to_dict": bench(state.to_dict, iterations=iterations, warmup=10),
+        "from_dict": bench(lambda: ConversationState.from_dict(data), iterations=iterations, warmup=10),
+    }
+
+
+def run(quick: bool = False) -> Dict[str, Any]:
+    scale = 5 if quick else 1
+    return {
+        "conversations": bench_conversations(conversations=50 // scale),
+        "parsers": bench_parsers(passes=200 // scale),
+        "state_roundtrip": bench_state_roundtrip(iterations=2000 // scale),
+    }
@@ -0,0 +1,77 @@
+"""
+Initial-stage intent classification benchmarks: accuracy of the intent
+router and of the substring lists it replaced on the labelled fixture, and
+single and batch classification throughput. Needs no database:
+
+    python -m benchmarks.bench_intent
+"""
+import sys
+import json
+from typing import Any, Dict, List, Optional
+
+from .common import bench
+from .intent_fixture import INTENT_FIXTURE
+
+
+def legacy_classify(message: str) -> Optional[str]:
+    """The substring checks _handle_initial_stage used before the intent router."""
+    from app.vocabulary import INTENT_PHRASES
+
+    text = message.lower().strip()
+    for intent, phrases in INTENT_PHRASES.items():
+        if any(phrase in text for phrase in phrases):
+            return intent
+    return None
+
+
+def check_held_out() -> None:
+    """Fail if a fixture message is a training example: the model would be scored on what it learned."""
+    from app.intent_router import TRAINING_EXAMPLES
+    from app.message_parsing import ParsedMessage
+
+    def key(message: str):
+        # What the model sees, so case and punctuation differences still count as the same message
+        return tuple(token.text for token in ParsedMessage.of(message).tokens)
+
+    trained = {key(example) for examples in TRAINING_EXAMPLES.values() for example in examples}
+    overlap = [message for message, _ in INTENT_FIXTURE if key(message) in trained]
+    if overlap:
+        raise RuntimeError(f"Intent fixture messages are also training examples: {overlap}")
+
+
+def accuracy(classify) -> Dict[str, Any]:
+    errors = [(message, expected, classify(message))
+              for message, expected in INTENT_FIXTURE if classify(message) != expected]
+    return {
+        "accuracy": round(1 - len(errors) / len(INTENT_FIXTURE), 4),
+        "errors": [{"message": m, "expected": e, "got": g} for m, e, g in errors],
+    }
+
+
+def run(quick: bool = False) -> Dict[str, Any]:
+    from app.intent_router import router
+
+    check_held_out()
+    messages: List[str] = [message for message, _ in INTENT_FIXTURE]
+    router.classify("warm up the model")
+    iterations = 20 if quick else 200
+
+    results = {
+        "router": accuracy(router.classify),
+        "legacy": accuracy(legacy_classify),
+        "classify": bench(lambda: [router.classify(m) for m in messages], iterations, warmup=2),
+        "legacy_classify": bench(lambda: [legacy_classify(m) for m in messages], iterations, warmup=2),
+    }
+    for result in (results["classify"], results["legacy_classify"]):
+        result["messages_per_sec"] = round(result["ops_per_sec"] * len(messages), 2)
+    for size in (100, 10000):
+        batch = (messages * (size // len(messages) + 1))[:size]
+        result = bench(lambda: router.classify_batch(batch), max(2, iterations * 100 // size), warmup=1)
+        result["messages_per_sec"] = round(result["ops_per_sec"] * size, 2)
+        results[f"classify_batch_{size}"] = result
+    return results
+
+
+if __name__ == "__main__":
+    json.dump(run(quick="--quick" in sys.argv), sys.stdout, indent=2)
+    print()
@@ -0,0 +1,81 @@
+"""
+Resident session memory: the traced memory held by N conversation states
+(100k by default) in the stored dict format, as the state model used to hold
+them, versus ConversationState's compact containers.
+
+    python -m benchmarks.bench_memory --sessions 100000
+"""
+import sys
+import json
+import time
+import argparse
+import logging
+from typing import Any, Dict, List
+
+from .common import track_allocations
+from .conversations import scripted_conversations
+from .corpus import ConversationGenerator
+
+
+def session_blobs(count: int = 64) -> List[bytes]:
+    """Encoded states of `count` distinct conversations that reached the lifestyle stage."""
+    from app.ms_health_ai import MSHealthAI, ConversationState
+    from app.state_codec import dumps
+
+    ai = MSHealthAI(db=None)
+    generator = iter(ConversationGenerator(seed=0))
+    scripts = scripted_conversations(count // 2) + [next(generator)["messages"] for _ in range(count - count // 2)]
+    blobs = []
+    for script in scripts:
+        state = ConversationState.from_dict({})
+        for message in script:
+            state.chat_history.append({"role": "user", "content": message})
+            state.chat_history.append({"role": "assistant", "content": ai._get_stage_response(state, message)})
+        blobs.append(dumps(state.to_dict()))
+    return blobs
+
+
+def _resident(blobs: List[bytes], sessions: int, load) -> Dict[str, Any]:
+    # Each session decodes its own copy of the bytes, as when loaded from the database
+    sources = [bytes(bytearray(blobs[i % len(blobs)])) for i in range(sessions)]
+    started = time.perf_counter()
+    with track_allocations() as allocations:
+        resident = {f"session-{i}": load(source) for i, source in enumerate(sources)}
+        elapsed = time.perf_counter() - started
+    result = {
+        "sessions": len(resident),
+        "total_mib": round(allocations["net_kib"] / 1024, 2),
+        "bytes_per_session": round(allocations["net_kib"] * 1024 / sessions, 1),
+        "load_seconds": round(elapsed, 3),
+    }
+    del resident
+    return result
+
+
+def run(quick: bool = False, sessions: int = None) -> Dict[str, Any]:
+    from app.ms_health_ai import ConversationState
+    from app.state_codec import loads
+
+    sessions = sessions or (10000 if quick else 100000)
+    blobs = session_blobs()
+    results = {
+        "blob_bytes_mean": round(sum(len(blob) for blob in blobs) / len(blobs), 1),
+        "dict": _resident(blobs, sessions, loads),
+        "compact": _resident(blobs, sessions, lambda blob: ConversationState.from_dict(loads(blob), fresh=True)),
+    }
+    results["compact_vs_dict"] = round(results["compact"]["total_mib"] / results["dict"]["total_mib"], 3)
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Resident conversation state memory")
+    parser.add_argument("--sessions", type=int, default=100000)
+    args = parser.parse_args(argv)
+    logging.disable(logging.ERROR)
+    json.dump(run(sessions=args.sessions), sys.stdout, indent=2)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+Symptom pattern scoring throughput: cosine similarity of N sessions'
+symptoms (10k by default) to every MS course pattern, computed per session
+and pattern in Python versus PatternScorer.score_batch's one matrix product.
+
+    python -m benchmarks.bench_patterns --sessions 10000
+"""
+import sys
+import json
+import math
+import argparse
+import logging
+from typing import Any, Dict, List
+
+from .common import bench
+from .bench_memory import session_blobs
+
+
+def session_symptoms(sessions: int) -> List[Dict[str, List[str]]]:
+    from app.state_codec import loads
+
+    symptoms = [loads(blob)["symptoms"] for blob in session_blobs()]
+    return [symptoms[i % len(symptoms)] for i in range(sessions)]
+
+
+def python_scores(patterns: List[Dict[str, Any]], symptoms: Dict[str, List[str]]) -> List[float]:
+    """Cosine similarities computed with dict lookups, one pattern at a time."""
+    present = {symptom for terms in symptoms.values() for symptom in terms}
+    scores = []
+    for pattern in patterns:
+        weights = pattern.get("symptom_weights", {})
+        norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+        dot = sum(weights.get(symptom, 0.0) for symptom in present)
+        scores.append(dot / (norm * math.sqrt(len(present))) if present and norm else 0.0)
+    return scores
+
+
+def run(quick: bool = False, sessions: int = None) -> Dict[str, Any]:
+    from app.pattern_scoring import DATA_PATH, scorer
+
+    with open(DATA_PATH, encoding="utf-8") as f:
+        patterns = json.load(f)["symptom_patterns"]
+    sessions = sessions or (2000 if quick else 10000)
+    cohort = session_symptoms(sessions)
+    iterations = 3 if quick else 10
+
+    python = bench(lambda: [python_scores(patterns, symptoms) for symptoms in cohort], iterations, warmup=1)
+    batch = bench(lambda: scorer.score_batch([scorer.symptom_ids(symptoms) for symptoms in cohort]),
+                  iterations, warmup=1)
+    for result in (python, batch):
+        result["sessions_per_s"] = round(sessions / result["mean_ms"] * 1000, 1)
+    return {
+        "sessions": sessions,
+        "patterns": len(patterns),
+        "python": python,
+        "score_batch": batch,
+        "speedup": round(python["mean_ms"] / batch["mean_ms"], 2),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Symptom pattern scoring throughput")
+    parser.add_argument("--sessions", type=int, default=10000)
+    args = parser.parse_args(argv)
+    logging.disable(logging.ERROR)
+    json.dump(run(sessions=args.sessions), sys.stdout, indent=2)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
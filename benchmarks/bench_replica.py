@@ -0,0 +1,125 @@
+"""
+Read replica routing: the API with DATABASE_URL and READ_DATABASE_URL on
+two local SQLite files. The replica file is only updated when the scenario
+copies the primary into it, so a read served by the replica before a copy
+sees the lag. Checks that reads of a session or user written within
+READ_YOUR_WRITES_SECONDS go to the primary, that later reads go to the
+replica, and that deletes are read back the same way; times reads served
+by the replica.
+
+    python -m benchmarks.bench_replica --output replica.json
+
+Exits non-zero when a check fails.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import sqlite3
+import argparse
+import tempfile
+from typing import Any, Callable, Dict
+
+from .common import QueryCounter, configure_database, summarize, write_results
+
+# Reads stay on the primary this long (seconds) after a write
+WINDOW = 0.5
+
+
+def _replicate(primary: str, replica: str) -> None:
+    """Bring the replica up to date with the primary."""
+    with sqlite3.connect(primary) as source, sqlite3.connect(replica) as target:
+        source.backup(target)
+
+
+def run(workdir: str, requests: int = 200) -> Dict[str, Any]:
+    primary = os.path.join(workdir, "primary.db")
+    replica = os.path.join(workdir, "replica.db")
+    # The databases must be configured before the app modules are imported
+    configure_database(primary)
+    os.environ["READ_DATABASE_URL"] = f"sqlite:///{os.path.abspath(replica)}"
+    os.environ["READ_YOUR_WRITES_SECONDS"] = str(WINDOW)
+    os.environ["CHAT_WRITE_BEHIND"] = "false"
+
+    from fastapi.testclient import TestClient
+    from app.api import app
+    from app.database import engine, read_engine
+
+    _replicate(primary, replica)
+    checks: Dict[str, bool] = {}
+    email = "replica@example.com"
+
+    with TestClient(app) as client:
+        def read(path: str):
+            """GET `path`, returning its status, JSON body and the engine that served it."""
+            with QueryCounter(engine) as on_primary, QueryCounter(read_engine) as on_replica:
+                response = client.get(path)
+            served = "primary" if on_primary.count and not on_replica.count else (
+                "replica" if on_replica.count and not on_primary.count else "both")
+            return response.status_code, response.json(), served
+
+        def check(name: str, result, status: int, served: str, condition: Callable[[Any], bool] = None) -> None:
+            checks[name] = result[0] == status and result[2] == served and (condition is None or condition(result[1]))
+
+        session_id = client.post("/chat", json={"email": email, "message": "Hello"}).json()["session_id"]
+        chats, sessions = f"/session/{session_id}/chats", f"/user/{email}/sessions"
+
+        # Written just now: the primary, although the replica has neither the session nor the user
+        check("session_after_write", read(chats), 200, "primary", lambda body: len(body) == 1)
+        check("user_after_write", read(sessions), 200, "primary", lambda body: len(body) == 1)
+
+        time.sleep(WINDOW * 2)
+        check("session_replica_lagging", read(chats), 404, "replica")
+        check("user_replica_lagging", read(sessions), 404, "replica")
+        _replicate(primary, replica)
+        check("session_replica", read(chats), 200, "replica", lambda body: len(body) == 1)
+        check("user_replica", read(sessions), 200, "replica", lambda body: len(body) == 1)
+
+        timings = {}
+        for name, path in [("session_chats", chats), ("user_sessions", sessions)]:
+            latencies = []
+            started = time.perf_counter()
+            for _ in range(requests):
+                t0 = time.perf_counter()
+                client.get(path)
+                latencies.append(time.perf_counter() - t0)
+            timings[f"{name}_replica"] = summarize(latencies, time.perf_counter() - started)
+
+        # A delete is read back from the primary while the replica still has the session
+        checks["delete"] = client.delete(f"/session/{session_id}").status_code == 200
+        check("session_after_delete", read(chats), 404, "primary")
+        check("user_after_delete", read(sessions), 200, "primary", lambda body: body == [])
+
+        time.sleep(WINDOW * 2)
+        check("session_deleted_replica_lagging", read(chats), 200, "replica")
+        _replicate(primary, replica)
+        check("session_deleted_replica", read(chats), 404, "replica")
+        check("user_deleted_replica", read(sessions), 200, "replica", lambda body: body == [])
+
+    return {"checks": checks, "passed": all(checks.values()), **timings}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Read replica routing on two SQLite files")
+    parser.add_argument("--requests", type=int, default=200, help="Timed reads per endpoint")
+    parser.add_argument("--output", default=None, help="Optional JSON results file")
+    args = parser.parse_args(argv)
+    logging.disable(logging.INFO)
+
+    workdir = tempfile.mkdtemp(prefix="ms_replica_")
+    try:
+        results = run(workdir, args.requests)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    json.dump(results, sys.stdout, indent=2)
+    print()
+    if args.output:
+        write_results(args.output, {"replica": results})
+    return 0 if results["passed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
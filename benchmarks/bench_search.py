@@ -0,0 +1,134 @@
+"""
+Chat search: a user's messages searched through the full-text index
+(SQLite FTS5) versus LIKE scans of the same user's messages, over N
+synthetic messages (200k by default) on a separate SQLite database.
+
+    python -m benchmarks.bench_search --messages 1000000
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import logging
+import tempfile
+from datetime import datetime, timedelta
+from typing import Any, Dict
+
+from .common import bench
+from .conversations import OPENINGS, DEMOGRAPHICS, SYMPTOMS, TESTS, TREATMENTS, LIFESTYLE
+
+QUERIES = ["meditation", '"vision problems"', "mri OR copaxone", "blurry -dizzy"]
+MESSAGES_PER_USER = 1000
+
+
+def populate(engine, messages: int, seed: int = 0) -> str:
+    """Users with MESSAGES_PER_USER messages each in sessions of 10; returns one user's email."""
+    from sqlalchemy import insert
+    from app import response_store
+    from app.models import ChatMessage, ChatResponse, Session as DBSession, User
+
+    rng = random.Random(seed)
+    texts = OPENINGS + DEMOGRAPHICS + [m for group in SYMPTOMS for m in group] + TESTS + TREATMENTS + LIFESTYLE
+    responses = [
+        "Could you tell me about your symptoms? Common MS symptoms include fatigue, numbness, vision problems.",
+        "Thank you. Have you had any diagnostic tests, such as an MRI, lumbar puncture or evoked potentials?",
+        "Are you taking any treatments for MS, such as Copaxone, Tecfidera or Ocrevus?",
+        "Could you tell me about your lifestyle? This includes diet, exercise and stress management.",
+    ]
+    started = datetime(2024, 1, 1)
+    users = max(1, messages // MESSAGES_PER_USER)
+    stored = [response_store.encode(response, compression="none") for response in responses]
+    with engine.begin() as conn:
+        conn.execute(insert(ChatResponse), stored)
+        conn.execute(insert(User), [{"id": uuid.uuid4(), "email": f"user{u}@example.com"} for u in range(users)])
+        for u in range(users):
+            sessions = [uuid.uuid4() for _ in range(MESSAGES_PER_USER // 10)]
+            conn.execute(insert(DBSession), [
+                {"id": session_id, "email": f"user{u}@example.com", "stage": "analysis", "ai_state": {}}
+                for session_id in sessions
+            ])
+            conn.execute(insert(ChatMessage), [
+                {
+                    "id": uuid.uuid4(), "session_id": sessions[i // 10], "message": rng.choice(texts),
+                    "response_hash": rng.choice(stored)["hash"], "stage": "symptoms",
+                    "timestamp": started + timedelta(minutes=u * MESSAGES_PER_USER + i),
+                }
+                for i in range(MESSAGES_PER_USER)
+            ])
+    return f"user{users // 2}@example.com"
+
+
+def like_scan(db, email: str, query: str, limit: int):
+    """The same user's messages containing every word of the query, by LIKE."""
+    from sqlalchemy import and_, func, or_, select
+    from app.models import ChatMessage, ChatResponse, Session as DBSession
+
+    words = [word.strip('"').lower() for word in query.split() if word != "OR" and not word.startswith("-")]
+    response = func.coalesce(ChatMessage.response, ChatResponse.text)
+    conditions = [
+        or_(func.lower(ChatMessage.message).like(f"%{word}%"), func.lower(response).like(f"%{word}%"))
+        for word in words
+    ]
+    return db.execute(
+        select(ChatMessage.id, ChatMessage.message, response)
+        .join(DBSession, DBSession.id == ChatMessage.session_id)
+        .outerjoin(ChatResponse, ChatResponse.hash == ChatMessage.response_hash)
+        .where(DBSession.email == email, or_(*conditions) if " OR " in query else and_(*conditions))
+        .order_by(ChatMessage.timestamp.desc())
+        .limit(limit)
+    ).all()
+
+
+def run(quick: bool = False, messages: int = None) -> Dict[str, Any]:
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from app import chat_search
+    from app.models import Base
+
+    messages = messages or (50000 if quick else 200000)
+    path = os.path.join(tempfile.gettempdir(), "ms_bench_search.db")
+    if os.path.exists(path):
+        os.remove(path)
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    email = populate(engine, messages)
+    started = time.perf_counter()
+    chat_search.ensure(engine)
+    results: Dict[str, Any] = {
+        "messages": messages,
+        "messages_per_user": MESSAGES_PER_USER,
+        "index_seconds": round(time.perf_counter() - started, 3),
+        "queries": {},
+    }
+    try:
+        with Session(engine) as db:
+            for query in QUERIES:
+                indexed = bench(lambda: chat_search.search(db, email, query, 20), 10 if quick else 50, warmup=2)
+                scanned = bench(lambda: like_scan(db, email, query, 20), 10 if quick else 50, warmup=2)
+                results["queries"][query] = {
+                    "results": len(chat_search.search(db, email, query, 20)),
+                    "index_ms": indexed["mean_ms"],
+                    "like_ms": scanned["mean_ms"],
+                    "speedup": round(scanned["mean_ms"] / indexed["mean_ms"], 1),
+                }
+    finally:
+        engine.dispose()
+        os.remove(path)
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Chat search over the full-text index")
+    parser.add_argument("--messages", type=int, default=200000)
+    args = parser.parse_args(argv)
+    logging.disable(logging.ERROR)
+    json.dump(run(messages=args.messages), sys.stdout, indent=2)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""
+Shared helpers for the benchmark suite: timing statistics, allocation and
+query counting, SQLite setup and JSON result output.
+"""
+import os
+import gc
+import math
+import json
+import time
+import platform
+import subprocess
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+
+def configure_database(path: str) -> str:
+    """
+    Point the application at a fresh SQLite database.
+
+    Must be called before any `app` module is imported, since
+    `app/database.py` reads DATABASE_URL at import time.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    url = f"sqlite:///{os.path.abspath(path)}"
+    os.environ["DATABASE_URL"] = url
+    return url
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], elapsed: float, ops: Optional[int] = None) -> Dict[str, float]:
+    """Summarize per-operation latencies (seconds) into ops/s and percentiles (ms)."""
+    values = sorted(latencies)
+    count = ops if ops is not None else len(values)
+    return {
+        "ops": count,
+        "ops_per_sec": round(count / elapsed, 2) if elapsed > 0 else 0.0,
+        "mean_ms": round(sum(values) / len(values) * 1000, 4) if values else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 4),
+        "p99_ms": round(percentile(values, 99) * 1000, 4),
+        "max_ms": round(values[-1] * 1000, 4) if values else 0.0,
+    }
+
+
+class QueryCounter:
+    """Count SQL statements executed on an engine while active."""
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self) -> "QueryCounter":
+        from sqlalchemy import event
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        from sqlalchemy import event
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+
+@contextmanager
+def track_allocations():
+    """Yield a dict filled with net and peak traced allocations (KiB) on exit."""
+    result: Dict[str, float] = {}
+    gc.collect()
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    try:
+        yield result
+    finally:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["net_kib"] = round((current - start) / 1024, 2)
+        result["peak_kib"] = round((peak - start) / 1024, 2)
+
+
+def bench(func: Callable[[], Any], iterations: int, warmup: int = 0, engine=None) -> Dict[str, Any]:
+    """
+    Run `func` repeatedly and return timing, allocation and query statistics.
+
+    Timing and allocation tracking are separate passes so that tracemalloc
+    does not distort the latency numbers.
+    """
+    for _ in range(warmup):
+        func()
+
+    latencies = []
+    counter = QueryCounter(engine) if engine is not None else None
+    if counter:
+        counter.__enter__()
+    try:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            t0 = time.perf_counter()
+            func()
+            latencies.append(time.perf_counter() - t0)
+        elapsed = time.perf_counter() - started
+    finally:
+        if counter:
+            counter.__exit__()
+
+    result: Dict[str, Any] = summarize(latencies, elapsed)
+    if counter:
+        result["queries_per_op"] = round(counter.count / iterations, 2)
+
+    alloc_iterations = max(1, iterations // 10)
+    with track_allocations() as allocations:
+        for _ in range(alloc_iterations):
+            func()
+    result["alloc_net_kib_per_op"] = round(allocations["net_kib"] / alloc_iterations, 3)
+    result["alloc_peak_kib"] = allocations["peak_kib"]
+    return result
+
+
+def git_revision() -> Optional[str]:
+    """Return the current git commit hash, if available."""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def write_results(path: str, results: Dict[str, Any]) -> None:
+    """Write benchmark results together with environment metadata."""
+    payload = {
+        "commit": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(payload, f, indent=2, sort_keys=True)
@@ -0,0 +1,60 @@
+"""
+Compare two benchmark result files and report regressions.
+
+    python -m benchmarks.compare baseline.json current.json --threshold 10
+"""
+import sys
+import json
+import argparse
+from typing import Any, Dict, Iterator, Tuple
+
+# Metrics where a higher value is better; all other compared metrics are lower-is-better
+HIGHER_IS_BETTER = {"ops_per_sec", "messages_per_sec"}
+COMPARED = HIGHER_IS_BETTER | {"p50_ms", "p99_ms", "mean_ms", "queries_per_op", "alloc_net_kib_per_op"}
+
+
+def _flatten(results: Dict[str, Any], prefix: str = "") -> Iterator[Tuple[str, str, float]]:
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{key}.")
+        elif key in COMPARED and isinstance(value, (int, float)):
+            yield prefix.rstrip("."), key, float(value)
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> int:
+    base = {(name, metric): value for name, metric, value in _flatten(baseline["results"])}
+    regressions = 0
+    print(f"baseline {baseline.get('commit')} -> current {current.get('commit')}")
+    for name, metric, value in _flatten(current["results"]):
+        old = base.get((name, metric))
+        if old is None or old == 0:
+            continue
+        change = (value - old) / old * 100
+        worse = -change if metric in HIGHER_IS_BETTER else change
+        flag = ""
+        if worse > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{name:50s} {metric:22s} {old:14.3f} -> {value:14.3f} ({change:+7.1f}%){flag}")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="Percentage change counted as a regression")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = compare(baseline, current, args.threshold)
+    print(f"{regressions} regression(s) above {args.threshold}%")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+Scripted synthetic conversations and a parser message corpus.
+
+Each conversation walks the full stage sequence of MSHealthAI:
+initial -> demographics -> symptoms -> diagnostic_tests -> treatments -> lifestyle.
+"""
+import itertools
+from typing import List
+
+# Openings are greetings and questions, which keep the conversation in the
+# initial stage; any other first message is parsed as demographics
+OPENINGS = [
+    "Hello",
+    "What is MS?",
+    "Can you help me?",
+]
+
+DEMOGRAPHICS = [
+    "I am 35 years old and female",
+    "42, male",
+    "I'm 28 and a woman",
+    "age 51, man",
+]
+
+SYMPTOMS = [
+    [
+        "I feel tired all the time and my hands are numb",
+        "I keep forgetting things and I have trouble with focus",
+        "I've been feeling depressed and anxious",
+    ],
+    [
+        "My vision is blurry, I feel dizzy and my legs are weak",
+        "I am slow at thinking and there is a lot of brain fog",
+        "I get moody and irritable, and I feel overwhelmed by stress",
+    ],
+    [
+        "Pins and needles in my feet, bladder problems and some pain",
+        "Memory issues, it is hard to concentrate and I feel sad",
+    ],
+]
+
+TESTS = [
+    "I had an MRI which showed lesions and some blood work",
+    "My blood test was normal",
+    "I had an MRI and it was normal",
+    "no, none so far",
+]
+
+TREATMENTS = [
+    "I am taking copaxone",
+    "I was prescribed tecfidera and gilenya",
+    "none",
+    "I'm taking some medication for the pain",
+]
+
+LIFESTYLE = [
+    "I try to eat a mediterranean diet and walk every day",
+    "I go to the gym and do yoga to relax",
+    "I eat healthy food and use meditation for stress",
+]
+
+
+def scripted_conversations(count: int) -> List[List[str]]:
+    """Return `count` full conversations cycling through the message variants."""
+    combos = itertools.cycle(itertools.product(
+        OPENINGS, DEMOGRAPHICS, SYMPTOMS, TESTS, TREATMENTS, LIFESTYLE
+    ))
+    conversations = []
+    for opening, demographics, symptoms, tests, treatments, lifestyle in itertools.islice(combos, count):
+        conversations.append([opening, demographics, *symptoms, tests, treatments, lifestyle])
+    return conversations
+
+
+# Varied single messages for parser benchmarks: short, long, matching and non-matching
+PARSER_CORPUS: List[str] = [
+    "hi",
+    "35 male",
+    "I am 62 years old, female, and I have been tired and numb for months",
+    "Nothing much to report today, just checking in.",
+    "My MRI showed lesions, blood work was normal and I'm taking interferon",
+    "I eat a balanced diet, exercise at the gym, and meditate to manage stress",
+    "Ochratoxin A: 2.1, Aflatoxin Group (B1, B2, G1, G2): 0.9",
+    "I feel depressed, anxious, moody and I forget where I put my keys",
+    "Blurry vision in my left eye, balance problems and tremors in my hands",
+    " ".join(SYMPTOMS[0] + SYMPTOMS[1] + TESTS + TREATMENTS + LIFESTYLE),
+] + [message for conversation in scripted_conversations(12) for message in conversation]
@@ -0,0 +1,255 @@
+"""
+Seeded synthetic conversation corpus generator.
+
+Messages are composed from the vocabularies the parsers actually match on
+(app/vocabulary.py), the knowledge-base test and mycotoxin names, and the
+symptom descriptions in app/data/ms_symptoms.json. Conversations are
+streamed to JSONL (optionally gzip-compressed), one per line:
+
+    {"id": 0, "email": "patient17@example.com", "messages": ["...", "..."]}
+
+    python -m benchmarks.corpus --conversations 1000000 --output corpus.jsonl.gz \\
+        --symptom-turns poisson:2 --followup-turns geometric:0.5 --seed 7
+"""
+import os
+import gzip
+import json
+import math
+import random
+import argparse
+import sys
+from typing import Callable, Dict, IO, Iterator, List
+
+from app.vocabulary import (
+    SYMPTOM_KEYWORDS, MS_MEDICATIONS, LIFESTYLE_KEYWORDS, MRI_TERMS, BLOOD_TEST_TERMS
+)
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), "..", "app", "data", "ms_symptoms.json")
+
+# Greetings and questions keep the conversation in the initial stage
+OPENINGS = [
+    "Hello",
+    "hi there",
+    "Good morning",
+    "What is multiple sclerosis?",
+    "Can you help me understand my symptoms?",
+    "What can you do?",
+]
+GENDER_PHRASES = {
+    "male": ["male", "a man"],
+    "female": ["female", "a woman"],
+    "non-binary": ["non-binary", "nonbinary"],
+}
+DEMOGRAPHIC_TEMPLATES = [
+    "I am {age} years old and {gender}",
+    "{age}, {gender}",
+    "I'm {age} and {gender}",
+    "age {age}, {gender}",
+]
+SYMPTOM_TEMPLATES = [
+    "I have been dealing with {terms} lately",
+    "Recently I noticed {terms}",
+    "There is {terms} most days",
+    "I keep having {terms}",
+    "Mostly {terms}, it comes and goes",
+]
+DESCRIPTION_TEMPLATES = [
+    "My doctor said it looks like {description}",
+    "I read about this: {description}",
+]
+TEST_TEMPLATES = [
+    "I had {tests}",
+    "They did {tests} last month",
+    "So far {tests}",
+]
+TEST_FINDINGS = ["that showed lesions", "which came back normal", "but I don't know the results", ""]
+NO_TESTS = ["no", "none so far", "no tests yet"]
+TREATMENT_TEMPLATES = [
+    "I am taking {meds}",
+    "I was prescribed {meds}",
+    "Currently on {meds}",
+]
+NO_TREATMENTS = ["none", "no medication at the moment", "I'm taking some medication but I forget the name"]
+LIFESTYLE_TEMPLATES = [
+    "I {a} and try to {b}",
+    "Mostly I {a}, sometimes I {b}",
+    "I {a}",
+]
+LIFESTYLE_ACTIONS = {
+    "diet": ["eat a mediterranean diet", "watch my food", "follow a low sugar diet"],
+    "exercise": ["walk every day", "go to the gym", "run twice a week", "play a sport"],
+    "stress_management": ["do yoga", "relax with meditation", "manage stress by reading"],
+}
+FOLLOWUPS = [
+    "what symptoms did I mention",
+    "what tests did I say",
+    "what treatments did I mention",
+    "can you explain the analysis",
+    "thank you",
+    "what is ms",
+]
+
+
+def distribution(spec: str) -> Callable[[random.Random], int]:
+    """
+    Parse a non-negative integer distribution spec:
+    fixed:N, uniform:LO:HI, poisson:MEAN, geometric:P, lognormal:MU:SIGMA.
+    """
+    kind, *params = spec.split(":")
+    values = [float(p) for p in params]
+    if kind == "fixed":
+        return lambda rng: int(values[0])
+    if kind == "uniform":
+        return lambda rng: rng.randint(int(values[0]), int(values[1]))
+    if kind == "poisson":
+        mean = values[0]
+        def poisson(rng: random.Random) -> int:
+            # Knuth's method, adequate for the small means used here
+            limit, k, p = math.exp(-mean), 0, 1.0
+            while True:
+                p *= rng.random()
+                if p <= limit:
+                    return k
+                k += 1
+        return poisson
+    if kind == "geometric":
+        p = values[0]
+        return lambda rng: int(math.log(1.0 - rng.random()) / math.log(1.0 - p)) if p < 1 else 0
+    if kind == "lognormal":
+        return lambda rng: int(rng.lognormvariate(values[0], values[1]))
+    raise ValueError(f"Unknown distribution: {spec}")
+
+
+class ConversationGenerator:
+    """Compose plausible multi-turn patient conversations from a seeded RNG."""
+    def __init__(self, seed: int = 0, symptom_turns: str = "poisson:2",
+                 followup_turns: str = "geometric:0.5", users: int = 10000):
+        from app.ms_health_ai import MSHealthAI
+
+        self.rng = random.Random(seed)
+        self.symptom_turns = distribution(symptom_turns)
+        self.followup_turns = distribution(followup_turns)
+        self.users = users
+
+        knowledge_base = MSHealthAI(db=None).knowledge_base
+        self.test_names = [test["name"] for test in knowledge_base["diagnostic_tests"].values()]
+        self.test_names += MRI_TERMS + BLOOD_TEST_TERMS
+        self.mycotoxins = [test["name"] for test in knowledge_base["mycotoxin_tests"].values()]
+        self.symptom_terms: List[str] = [
+            keyword
+            for category in SYMPTOM_KEYWORDS.values()
+            for keywords in category.values()
+            for keyword in keywords
+        ]
+        with open(DATA_PATH) as f:
+            data = json.load(f)
+        self.descriptions = [
+            entry["description"].rstrip(".").lower()
+            for key in ("common_symptoms", "less_common_symptoms")
+            for entry in data.get(key, [])
+        ]
+        self.medications = MS_MEDICATIONS
+        self.lifestyle_categories = list(LIFESTYLE_KEYWORDS)
+
+    def _join(self, items: List[str]) -> str:
+        if len(items) == 1:
+            return items[0]
+        return ", ".join(items[:-1]) + " and " + items[-1]
+
+    def _symptom_message(self) -> str:
+        rng = self.rng
+        if rng.random() < 0.2:
+            return rng.choice(DESCRIPTION_TEMPLATES).format(description=rng.choice(self.descriptions))
+        terms = rng.sample(self.symptom_terms, rng.randint(1, 4))
+        return rng.choice(SYMPTOM_TEMPLATES).format(terms=self._join(terms))
+
+    def _tests_message(self) -> str:
+        rng = self.rng
+        if rng.random() < 0.2:
+            return rng.choice(NO_TESTS)
+        if rng.random() < 0.1:
+            toxin = rng.choice(self.mycotoxins)
+            return f"My {toxin} result was {rng.uniform(0, 3):.2f}"
+        tests = rng.sample(self.test_names, rng.randint(1, 2))
+        finding = rng.choice(TEST_FINDINGS)
+        return (rng.choice(TEST_TEMPLATES).format(tests=self._join(tests)) + " " + finding).strip()
+
+    def _treatments_message(self) -> str:
+        rng = self.rng
+        if rng.random() < 0.25:
+            return rng.choice(NO_TREATMENTS)
+        meds = rng.sample(self.medications, rng.randint(1, 2))
+        return rng.choice(TREATMENT_TEMPLATES).format(meds=self._join(meds))
+
+    def _lifestyle_message(self) -> str:
+        rng = self.rng
+        first, second = rng.sample(self.lifestyle_categories, 2)
+        return rng.choice(LIFESTYLE_TEMPLATES).format(
+            a=rng.choice(LIFESTYLE_ACTIONS[first]), b=rng.choice(LIFESTYLE_ACTIONS[second])
+        )
+
+    def conversation(self) -> Dict:
+        rng = self.rng
+        gender = rng.choice(list(GENDER_PHRASES))
+        messages = [rng.choice(OPENINGS)]
+        messages.append(rng.choice(DEMOGRAPHIC_TEMPLATES).format(
+            age=rng.randint(18, 80), gender=rng.choice(GENDER_PHRASES[gender])
+        ))
+        messages += [self._symptom_message() for _ in range(max(1, self.symptom_turns(rng)))]
+        messages.append(self._tests_message())
+        messages.append(self._treatments_message())
+        messages.append(self._lifestyle_message())
+        messages += [rng.choice(FOLLOWUPS) for _ in range(self.followup_turns(rng))]
+        return {"email": f"patient{rng.randrange(self.users)}@example.com", "messages": messages}
+
+    def __iter__(self) -> Iterator[Dict]:
+        index = 0
+        while True:
+            yield {"id": index, **self.conversation()}
+            index += 1
+
+
+def open_output(path: str) -> IO[str]:
+    if path == "-":
+        return sys.stdout
+    if path.endswith(".gz"):
+        return gzip.open(path, "wt", compresslevel=5)
+    return open(path, "w")
+
+
+def read_corpus(path: str) -> Iterator[Dict]:
+    """Stream conversations back from a (possibly gzipped) JSONL corpus."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Generate a synthetic conversation corpus (JSONL)")
+    parser.add_argument("--conversations", type=int, default=10000)
+    parser.add_argument("--output", default="corpus.jsonl", help="Output path, .gz for gzip, - for stdout")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--symptom-turns", default="poisson:2", help="Distribution of symptom turns per conversation")
+    parser.add_argument("--followup-turns", default="geometric:0.5", help="Distribution of follow-up turns after analysis")
+    parser.add_argument("--users", type=int, default=10000, help="Number of distinct user emails")
+    args = parser.parse_args(argv)
+
+    generator = ConversationGenerator(
+        seed=args.seed, symptom_turns=args.symptom_turns,
+        followup_turns=args.followup_turns, users=args.users
+    )
+    out = open_output(args.output)
+    try:
+        for _, conversation in zip(range(args.conversations), generator):
+            out.write(json.dumps(conversation, separators=(",", ":")))
+            out.write("\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
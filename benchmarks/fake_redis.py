@@ -0,0 +1,36 @@
+"""
+In-memory stand-in for the subset of the redis client that
+app.state_store.RedisStateStore uses, so the benchmarks can time and check
+the Redis backend without a server.
+"""
+import time
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+
+class InMemoryRedis:
+    """get, set(ex=) and delete on a dict; `clock` lets callers move expiry forward without waiting."""
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self._data: Dict[str, Tuple[bytes, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires is not None and expires <= self.clock():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key: str, value: bytes, ex: Optional[int] = None) -> bool:
+        with self._lock:
+            self._data[key] = (bytes(value), self.clock() + ex if ex else None)
+        return True
+
+    def delete(self, *keys: str) -> int:
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
@@ -0,0 +1,69 @@
+"""
+Labelled initial-stage messages for measuring intent classification
+accuracy. None of them is one of the router's training examples, up to case
+and punctuation (bench_intent checks this); None means the message has no
+intent and is parsed as demographics.
+"""
+from typing import List, Optional, Tuple
+
+INTENT_FIXTURE: List[Tuple[str, Optional[str]]] = [
+    # Greetings
+    ("Hello", "greeting"),
+    ("hi", "greeting"),
+    ("Hi!", "greeting"),
+    ("hey", "greeting"),
+    ("Hey there, how's it going?", "greeting"),
+    ("Good morning", "greeting"),
+    ("good evening!", "greeting"),
+    ("Greetings", "greeting"),
+    ("hey hey", "greeting"),
+    ("heyy", "greeting"),
+    ("Yo, what's up", "greeting"),
+    ("hello, it's me again", "greeting"),
+    ("Hi, I'm new here", "greeting"),
+    ("good afternoon doctor", "greeting"),
+    ("hullo there", "greeting"),
+    # Questions about MS
+    ("What is MS?", "ms_question"),
+    ("what is multiple sclerosis", "ms_question"),
+    ("Tell me about MS", "ms_question"),
+    ("Can you explain MS?", "ms_question"),
+    ("What kind of disease is MS?", "ms_question"),
+    ("what exactly is ms", "ms_question"),
+    ("What does MS stand for?", "ms_question"),
+    ("Why do people get MS?", "ms_question"),
+    ("explain multiple sclerosis to me", "ms_question"),
+    ("could you describe multiple sclerosis", "ms_question"),
+    # Help requests
+    ("Can you help me?", "help"),
+    ("help", "help"),
+    ("I need help", "help"),
+    ("What can you do?", "help"),
+    ("How can you help me?", "help"),
+    ("Please guide me", "help"),
+    ("Could you assist me with something?", "help"),
+    ("What are you for?", "help"),
+    ("I need some assistance", "help"),
+    ("How do I get started?", "help"),
+    # No intent: demographics and other statements
+    ("39 male", None),
+    ("I am 47 years old and male", None),
+    ("42, male", None),
+    ("I'm 28 and a woman", None),
+    ("age 60, woman", None),
+    ("This is my first visit", None),
+    ("They think it might be MS", None),
+    ("I think something is wrong with my legs", None),
+    ("Which tests should I get", None),
+    ("My chip on the shoulder", None),
+    ("I am 62 years old, female, and I have been tired and numb for months", None),
+    ("Nothing much to report today, just checking in.", None),
+    ("My MRI showed lesions", None),
+    ("I'm a 45 year old woman", None),
+    ("sheila, 33, female", None),
+    ("whether or not this matters, I'm 40", None),
+    ("yep", None),
+    ("thank you", None),
+    ("female 29", None),
+    ("male, 58, retired teacher", None),
+]
@@ -0,0 +1,134 @@
+"""
+Replay a conversation corpus against /chat at a target request rate.
+
+Turns are paced on a fixed schedule (open loop): request n is released at
+start + n / rps, whether or not earlier requests have finished, so server
+slowdowns show up as latency instead of silently lowering the offered load.
+Turns within a conversation stay sequential because each one needs the
+session id returned by the previous one.
+
+    python -m benchmarks.replay corpus.jsonl.gz --url http://localhost:8000 --rps 200 --duration 60
+    python -m benchmarks.replay corpus.jsonl --in-process --rps 100 --duration 10
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import logging
+from typing import Any, Dict, Iterator, List
+
+import httpx
+
+from .common import configure_database, summarize, write_results
+from .corpus import read_corpus
+
+
+class Pacer:
+    """Hand out send times at a fixed rate."""
+    def __init__(self, rps: float):
+        self.interval = 1.0 / rps
+        self.start = time.perf_counter()
+        self.issued = 0
+
+    async def wait(self) -> float:
+        """Sleep until the next slot and return how late the slot was taken (seconds)."""
+        slot = self.start + self.issued * self.interval
+        self.issued += 1
+        delay = slot - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+            return 0.0
+        return -delay
+
+
+async def replay(client: httpx.AsyncClient, conversations: Iterator[Dict], rps: float,
+                 duration: float, concurrency: int) -> Dict[str, Any]:
+    pacer = Pacer(rps)
+    deadline = time.perf_counter() + duration
+    latencies: List[float] = []
+    lag: List[float] = []
+    statuses: Dict[int, int] = {}
+    completed = 0
+
+    async def run_conversation(conversation: Dict) -> None:
+        nonlocal completed
+        session_id = None
+        for message in conversation["messages"]:
+            if time.perf_counter() >= deadline:
+                return
+            lag.append(await pacer.wait())
+            payload = {"email": conversation["email"], "message": message}
+            if session_id:
+                payload["session_id"] = session_id
+            t0 = time.perf_counter()
+            try:
+                response = await client.post("/chat", json=payload)
+                status = response.status_code
+            except httpx.HTTPError:
+                status = 0
+            latencies.append(time.perf_counter() - t0)
+            statuses[status] = statuses.get(status, 0) + 1
+            if status != 200:
+                return
+            session_id = response.json()["session_id"]
+        completed += 1
+
+    async def worker() -> None:
+        for conversation in conversations:
+            if time.perf_counter() >= deadline:
+                return
+            await run_conversation(conversation)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    result = summarize(latencies, elapsed)
+    result.update({
+        "target_rps": rps,
+        "concurrency": concurrency,
+        "conversations_completed": completed,
+        "status_counts": {str(k): v for k, v in sorted(statuses.items())},
+        "schedule_lag_p99_ms": round(sorted(lag)[int(len(lag) * 0.99)] * 1000, 3) if lag else 0.0,
+    })
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Replay a conversation corpus against /chat")
+    parser.add_argument("corpus", help="JSONL corpus written by benchmarks.corpus")
+    parser.add_argument("--url", default="http://localhost:8000", help="Base URL of the API")
+    parser.add_argument("--in-process", action="store_true",
+                        help="Drive the app in-process over ASGI against a temporary SQLite database")
+    parser.add_argument("--rps", type=float, default=50.0, help="Target requests per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="Replay duration in seconds")
+    parser.add_argument("--concurrency", type=int, default=64,
+                        help="Maximum number of conversations in flight")
+    parser.add_argument("--output", default=None, help="Optional JSON results file")
+    args = parser.parse_args(argv)
+
+    if args.in_process:
+        configure_database(os.path.join(tempfile.gettempdir(), "ms_replay.db"))
+        logging.disable(logging.INFO)
+        from app.api import app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://replay")
+    else:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        client = httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30.0)
+
+    async def run() -> Dict[str, Any]:
+        async with client:
+            return await replay(client, iter(read_corpus(args.corpus)), args.rps, args.duration, args.concurrency)
+
+    result = asyncio.run(run())
+    for key, value in result.items():
+        print(f"{key:26s} {value}")
+    if args.output:
+        write_results(args.output, {"replay": result})
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,53 @@
+"""
+Run the benchmark suite and write the results to JSON.
+
+    python -m benchmarks.run --output bench.json
+    python -m benchmarks.run --only engine --quick
+"""
+import os
+import sys
+import logging
+import argparse
+import tempfile
+
+from .common import configure_database, write_results
+
+SUITES = ["engine", "codec", "intent", "memory", "patterns", "cohort", "search", "api"]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="MS Health Assistant benchmarks")
+    parser.add_argument("--output", default="bench_results.json", help="Path of the JSON results file")
+    parser.add_argument("--only", default=",".join(SUITES), help=f"Comma-separated suites to run ({', '.join(SUITES)})")
+    parser.add_argument("--quick", action="store_true", help="Run a reduced number of iterations")
+    parser.add_argument("--database", default=os.path.join(tempfile.gettempdir(), "ms_bench.db"),
+                        help="SQLite database file used by the benchmarks (recreated on each run)")
+    args = parser.parse_args(argv)
+
+    # The database must be configured before the app modules are imported
+    configure_database(args.database)
+    logging.disable(logging.INFO)
+
+    from app.database import init_db
+    init_db()
+
+    from . import (bench_api, bench_codec, bench_engine, bench_intent, bench_memory, bench_patterns, bench_cohort,
+                   bench_search)
+    suites = {"engine": bench_engine.run, "codec": bench_codec.run, "intent": bench_intent.run,
+              "memory": bench_memory.run, "patterns": bench_patterns.run,
+              "cohort": bench_cohort.run, "search": bench_search.run, "api": bench_api.run}
+
+    results = {}
+    for name in [s.strip() for s in args.only.split(",") if s.strip()]:
+        if name not in suites:
+            parser.error(f"Unknown suite: {name}")
+        print(f"Running {name} benchmarks...", file=sys.stderr)
+        results[name] = suites[name](quick=args.quick)
+
+    write_results(args.output, results)
+    print(f"Results written to {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
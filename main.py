@@ -1,5 +1,6 @@
 from app.api import app
 from app.init_db import init_db
+import os
 import logging
 
 # Configure logging
@@ -15,5 +16,18 @@ except Exception as e:
     raise
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the MS Health AI API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")),
+                        help="worker processes; more than 1 runs the session-affinity cluster (app/cluster.py)")
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        from app.cluster import serve
+        serve(args.workers, host=args.host, port=args.port)
+    else:
+        import uvicorn
+        uvicorn.run(app, host=args.host, port=args.port)
\ No newline at end of file